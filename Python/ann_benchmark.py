@@ -0,0 +1,103 @@
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+
+from face_matching import FaceMatcher
+from ann_index import IVFIndex
+
+# Configuration
+RESULTS_DIR = 'validation_results'
+REPORT_FILE = os.path.join(RESULTS_DIR, 'ann_recall_latency.csv')
+EMBEDDING_DIM = 512
+
+
+# Function to build a synthetic gallery: every identity is a random direction and
+# its embeddings are noisy copies of it, roughly like real per-person clusters
+def make_synthetic_gallery(num_identities, images_per_identity, noise, rng, dim=EMBEDDING_DIM):
+    identities = rng.standard_normal((num_identities, dim)).astype(np.float32)
+    identities /= np.linalg.norm(identities, axis=1, keepdims=True)
+    gallery = {}
+    for i in range(num_identities):
+        samples = identities[i] + noise * rng.standard_normal((images_per_identity, dim)).astype(np.float32) / np.sqrt(dim)
+        gallery[f"person_{i}"] = samples
+    return gallery, identities
+
+
+# Function to time matching of every probe one at a time (the way requests arrive)
+def time_matching(matcher, probes, reduction):
+    names = []
+    start_time = time.time()
+    for probe in probes:
+        name, _, _ = matcher.match(probe, -1.0, reduction=reduction)
+        names.append(name)
+    elapsed = time.time() - start_time
+    return names, elapsed / len(probes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall vs latency of the IVF index against the exact matrix scan")
+    parser.add_argument('--identities', type=int, default=20000)
+    parser.add_argument('--images-per-identity', type=int, default=5)
+    parser.add_argument('--noise', type=float, default=1.0, help="Per-embedding noise norm relative to the identity vector")
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--nlist', type=int, default=0, help="Inverted lists (0 = about 4 * sqrt(gallery size))")
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument('--candidates', type=int, default=64)
+    parser.add_argument('--reduction', default='mean', choices=['mean', 'max', 'topk'])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"Building synthetic gallery: {args.identities} identities x {args.images_per_identity} embeddings...")
+    gallery, identities = make_synthetic_gallery(args.identities, args.images_per_identity, args.noise, rng)
+
+    # Probes are fresh noisy samples of randomly chosen identities
+    probe_ids = rng.choice(args.identities, args.queries)
+    probes = identities[probe_ids] + args.noise * rng.standard_normal((args.queries, EMBEDDING_DIM)).astype(np.float32) / np.sqrt(EMBEDDING_DIM)
+
+    exact_matcher = FaceMatcher(gallery)
+    exact_names, exact_latency = time_matching(exact_matcher, probes, args.reduction)
+    true_names = [f"person_{i}" for i in probe_ids]
+    exact_accuracy = np.mean([a == b for a, b in zip(exact_names, true_names)])
+    print(f"Exact scan: {exact_latency * 1000:.2f} ms/query, identification accuracy {exact_accuracy:.4f}")
+
+    nlist = args.nlist or int(4 * np.sqrt(exact_matcher.size))
+    start_time = time.time()
+    index = IVFIndex(nlist=nlist).train(exact_matcher.matrix)
+    ann_matcher = FaceMatcher(gallery).attach_index(index, args.candidates)
+    print(f"Built IVF index with {index.nlist} lists in {time.time() - start_time:.2f}s")
+
+    rows = [{
+        'method': 'exact',
+        'nprobe': None,
+        'recall_vs_exact': 1.0,
+        'accuracy': exact_accuracy,
+        'latency_ms': exact_latency * 1000,
+        'speedup': 1.0
+    }]
+
+    for nprobe in args.nprobe:
+        index.nprobe = nprobe
+        ann_names, ann_latency = time_matching(ann_matcher, probes, args.reduction)
+        recall = np.mean([a == b for a, b in zip(ann_names, exact_names)])
+        accuracy = np.mean([a == b for a, b in zip(ann_names, true_names)])
+        rows.append({
+            'method': 'ivf',
+            'nprobe': nprobe,
+            'recall_vs_exact': recall,
+            'accuracy': accuracy,
+            'latency_ms': ann_latency * 1000,
+            'speedup': exact_latency / ann_latency
+        })
+        print(f"IVF nprobe={nprobe:3d}: recall {recall:.4f}, accuracy {accuracy:.4f}, "
+              f"{ann_latency * 1000:.2f} ms/query ({exact_latency / ann_latency:.1f}x)")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    pd.DataFrame(rows).to_csv(REPORT_FILE, index=False)
+    print(f"Saved recall/latency report to {REPORT_FILE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import numpy as np
+
+from face_matching import l2_normalize
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate nearest-neighbour index for cosine similarity.
+
+    A spherical k-means coarse quantizer splits the (L2-normalized) vectors
+    into `nlist` inverted lists. A query only scans the `nprobe` lists whose
+    centroids are closest to it, so the cost per query is roughly
+    nprobe / nlist of an exact scan. Raising `nprobe` trades speed for recall.
+
+    Every stored vector carries an integer label (the person index in the
+    gallery); search returns labels, and vectors can be inserted or removed
+    by label without retraining the quantizer.
+    """
+
+    def __init__(self, nlist=256, nprobe=8, train_iters=10, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_iters = train_iters
+        self.seed = seed
+        self.centroids = None
+        self.list_vectors = []
+        self.list_labels = []
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    @property
+    def ntotal(self):
+        return sum(len(labels) for labels in self.list_labels)
+
+    # Learn the coarse quantizer with spherical k-means on (a sample of) the vectors
+    def train(self, vectors, max_samples=100000):
+        vectors = l2_normalize(vectors)
+        rng = np.random.default_rng(self.seed)
+        if len(vectors) > max_samples:
+            vectors = vectors[rng.choice(len(vectors), max_samples, replace=False)]
+
+        nlist = max(1, min(self.nlist, len(vectors)))
+        centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+
+        for _ in range(self.train_iters):
+            assignments = self._assign(vectors, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, vectors)
+            counts = np.bincount(assignments, minlength=nlist)
+
+            # Re-seed empty lists with random vectors so no list stays unused
+            empty = np.flatnonzero(counts == 0)
+            if len(empty):
+                sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+            centroids = l2_normalize(sums)
+
+        self.nlist = nlist
+        self.centroids = np.ascontiguousarray(centroids)
+        dim = vectors.shape[1]
+        self.list_vectors = [np.zeros((0, dim), dtype=np.float32) for _ in range(nlist)]
+        self.list_labels = [np.zeros(0, dtype=np.int64) for _ in range(nlist)]
+        return self
+
+    # Find the nearest centroid of every vector (processed in chunks to bound memory)
+    @staticmethod
+    def _assign(vectors, centroids, chunk_size=8192):
+        assignments = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), chunk_size):
+            chunk = vectors[start:start + chunk_size]
+            assignments[start:start + chunk_size] = np.argmax(chunk @ centroids.T, axis=1)
+        return assignments
+
+    # Insert vectors into their inverted lists
+    def add(self, vectors, labels):
+        if not self.is_trained:
+            raise RuntimeError("IVFIndex must be trained before vectors are added")
+
+        vectors = l2_normalize(vectors)
+        labels = np.asarray(labels, dtype=np.int64)
+        assignments = self._assign(vectors, self.centroids)
+
+        # New arrays are always created (never resized in place), so copies made
+        # with copy() that are being searched concurrently are not affected
+        for list_id in np.unique(assignments):
+            members = assignments == list_id
+            self.list_vectors[list_id] = np.concatenate((self.list_vectors[list_id], vectors[members]))
+            self.list_labels[list_id] = np.concatenate((self.list_labels[list_id], labels[members]))
+        return self
+
+    # Remove every vector carrying one of the given labels
+    def remove(self, labels):
+        labels = np.asarray(list(labels), dtype=np.int64)
+        if not len(labels):
+            return self
+
+        for list_id in range(self.nlist):
+            keep = ~np.isin(self.list_labels[list_id], labels)
+            if not keep.all():
+                self.list_vectors[list_id] = self.list_vectors[list_id][keep]
+                self.list_labels[list_id] = self.list_labels[list_id][keep]
+        return self
+
+    # Shallow copy: list arrays are shared until add/remove replaces them
+    def copy(self):
+        clone = IVFIndex(self.nlist, self.nprobe, self.train_iters, self.seed)
+        clone.centroids = self.centroids
+        clone.list_vectors = list(self.list_vectors)
+        clone.list_labels = list(self.list_labels)
+        return clone
+
+    # Return the labels and similarities of the k most similar stored vectors per query
+    # (padded with label -1 / similarity -inf when fewer than k vectors were scanned)
+    def search(self, queries, k, nprobe=None):
+        queries = l2_normalize(np.atleast_2d(queries))
+        nprobe = max(1, min(nprobe or self.nprobe, self.nlist))
+
+        coarse = queries @ self.centroids.T
+        if nprobe < self.nlist:
+            probed = np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            probed = np.tile(np.arange(self.nlist), (len(queries), 1))
+
+        result_labels = np.full((len(queries), k), -1, dtype=np.int64)
+        result_similarities = np.full((len(queries), k), -np.inf, dtype=np.float32)
+
+        for query_idx, query in enumerate(queries):
+            similarities = [self.list_vectors[list_id] @ query for list_id in probed[query_idx]]
+            labels = [self.list_labels[list_id] for list_id in probed[query_idx]]
+            similarities = np.concatenate(similarities)
+            labels = np.concatenate(labels)
+            if not len(labels):
+                continue
+
+            top_k = min(k, len(labels))
+            top = np.argpartition(-similarities, top_k - 1)[:top_k]
+            top = top[np.argsort(-similarities[top])]
+            result_labels[query_idx, :top_k] = labels[top]
+            result_similarities[query_idx, :top_k] = similarities[top]
+
+        return result_labels, result_similarities
@@ -1,176 +1,251 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, copy_current_request_context, g
 import cv2
 import os
 import numpy as np
-import tensorflow as tf
-from tensorflow.keras.models import load_model
-import pickle
-import shutil
 from flask_cors import CORS
 import datetime
 from datetime import datetime  # This is the correct import
 import base64
-from scipy.spatial.distance import cosine
-import mediapipe as mp
 import time
-from collections import Counter
+import threading
+import queue
+import json
+import struct
+import functools
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import Counter, deque
+from face_matching import FaceMatcher
+from embedding_projection import EmbeddingProjection
+from ann_index import IVFIndex
+from detector_pool import DetectorPool
+from face_pipeline import FACE_SIZE, FacePipeline, PipelineConfig
+from embedding_cache import EmbeddingCache, image_content_hash, model_file_version
+from enrollment_pipeline import EnrollmentPipeline, OK, UNREADABLE, NO_FACE
+from enrollment_jobs import EnrollmentJobStore, RUNNING, COMPLETED, FAILED
+from gallery_store import GalleryStore
+from serve import available_cores
+from metrics import MetricsRegistry, PROMETHEUS_MIME
+from gallery_format import GALLERY_MIME, encode_gallery, decode_gallery, gallery_to_dict, write_gallery, read_gallery
 
 
 app = Flask(__name__)
 CORS(app)
 
+# Enrollment worker processes are started with forkserver/spawn, which re-import the main script as
+# __mp_main__ when the service runs as `python app.py`. They only need enrollment_pipeline, so the
+# service state below (detectors, model batcher, executors, gallery, jobs, warm-up) is only set up
+# in the service process itself, and TensorFlow is only imported when the model is loaded.
+SERVICE_PROCESS = __name__ != '__mp_main__'
+
 # Configuration
 MODEL_FOLDER = 'resnet50_model'
 FEATURE_MODEL_PATH = os.path.join(MODEL_FOLDER, 'resnet50_face_features.h5')
-TEMP_FACES_DIR = 'temp_faces'
-OUTPUT_FILE = 'face_embeddings.pkl'
+QUANTIZED_MODEL_PATH = os.path.join(MODEL_FOLDER, 'resnet50_face_features_int8.tflite')  # Written by export_quantized_model.py
+INFERENCE_BACKEND = 'keras'  # 'keras' runs the float32 FEATURE_MODEL_PATH, 'tflite' the quantized QUANTIZED_MODEL_PATH
+INFERENCE_THREADS = 0  # CPU threads of the model (TensorFlow intra-op pool or TFLite interpreter); 0 = every available core
+INFERENCE_INTER_OP_THREADS = 1  # TensorFlow ops run side by side; one model call runs at a time, so its cores go to the intra-op pool
+DATA_DIR = os.environ.get('FACENROLL_DATA_DIR', '')  # Where the gallery, cache, jobs and saved faces live (default: working directory)
+TEMP_FACES_DIR = os.path.join(DATA_DIR, 'temp_faces')
+OUTPUT_FILE = os.path.join(DATA_DIR, 'face_gallery.fnrg')  # Compact binary gallery backup (see gallery_format.py)
+EAGER_STARTUP = False  # Warm up the model, detectors and inference path in the background at import (serve.py does this by default)
+GALLERY_STORE_DIR = os.path.join(DATA_DIR, 'gallery_store')  # Memory-mapped gallery the service restores at startup (see gallery_store.py)
+GALLERY_STORE_ENABLED = True
+GALLERY_STORE_POLL_SECONDS = 0.5  # How often the store is checked for gallery versions committed by other worker processes
+SAVE_EMBEDDINGS_FILE = False  # Also write a portable OUTPUT_FILE copy of the gallery after every enrollment
+LOAD_GALLERY_FILE = True  # Import OUTPUT_FILE at startup when the gallery store is still empty
+GALLERY_STORAGE_DTYPE = 'float16'  # Storage precision of gallery files: 'float32', 'float16' or 'int8'
+EMBEDDING_PROJECTION_FILE = os.path.join(MODEL_FOLDER, 'embedding_projection.npz')  # Written by fit_projection.py
+EMBEDDING_PROJECTION_ENABLED = True  # Store and match galleries in the smaller projected space when the file exists
+EMBEDDING_CACHE_ENABLED = True  # Reuse embeddings of unchanged enrollment images
+EMBEDDING_CACHE_FILE = os.path.join(DATA_DIR, 'embedding_cache.sqlite3')
+EMBEDDING_PIPELINE_VERSION = 2  # Bump when detection/alignment/preprocessing changes, to invalidate the cache
+ENROLLMENT_JOBS_DIR = os.path.join(DATA_DIR, 'enrollment_jobs')  # Event logs and results of background enrollment jobs
+ENROLLMENT_JOB_RETENTION_HOURS = 24  # Finished jobs older than this are deleted
+ENROLLMENT_JOB_CHUNK_IMAGES = 64  # Images processed (and released) per step of a job
+ENROLLMENT_JOB_CONCURRENCY = 1  # Jobs running at the same time; others wait in line
+ENROLLMENT_JOB_HEARTBEAT_SECONDS = 15  # Keep-alive interval for idle event streams
 SIMILARITY_THRESHOLD = 0.4  # Adjusted for ResNet50 (higher value means more similar)
+PROJECTED_SIMILARITY_THRESHOLD = None  # Threshold for projected galleries (None: the one fit_projection.py saved with the projection)
+BURST_MAX_FRAMES = 16  # Most frames accepted by /api/recognize-burst in one request
+BURST_VOTE_CONFIDENCE = 0.65  # Share of frames that must agree on a name when fusing by vote
+MULTI_FACE_MAX_FACES = 16  # Most faces recognized per frame in multi-face mode
+FACE_BOX_PADDING = 0.2  # Margin added around detected faces on recognition, as a fraction of the box size
+SIMILARITY_MIME = 'application/x-facenroll-similarities'  # Compact binary encoding of recognition scores
+MATCH_REDUCTION = 'mean'  # How per-embedding scores are combined per person: 'mean', 'max' or 'topk'
+MATCH_TOP_K = 3  # Number of best embeddings averaged per person when MATCH_REDUCTION is 'topk'
 
-# Ensure temp directory exists
-os.makedirs(TEMP_FACES_DIR, exist_ok=True)
+# Inference settings
+INFERENCE_MAX_BATCH_SIZE = 16  # Largest batch run in one forward pass
+INFERENCE_BATCH_WINDOW_MS = 10  # How long the first queued crop waits for others to join its batch
+INFERENCE_QUEUE_LIMIT = 256  # Queued crops beyond this are rejected (back-pressure)
+MODEL_BATCH_SIZES = (1, 2, 4, 8, 16)  # Batch sizes traced ahead of time by the model wrapper
 
-# Configure TensorFlow for better performance (optional)
-tf.config.threading.set_intra_op_parallelism_threads(4)
-tf.config.threading.set_inter_op_parallelism_threads(4)
+# Serving limits for the CPU-bound endpoints (decode, detection, inference)
+SERVING_MAX_CONCURRENCY = 4  # Requests whose CPU work runs at the same time
+SERVING_MAX_QUEUE_DEPTH = 32  # Requests allowed to wait for a slot; more are rejected with 429
+SERVING_RETRY_AFTER_SECONDS = 1
 
-# Initialize MediaPipe Face Detection
-mp_face_detection = mp.solutions.face_detection
-mp_drawing = mp.solutions.drawing_utils
-face_detection = mp_face_detection.FaceDetection(
-    model_selection=1,  # 0=closer faces, 1=longer distance faces
-    min_detection_confidence=0.5
-)
+# Approximate nearest-neighbour index for large galleries (see ann_index.py)
+ANN_ENABLED = True
+ANN_MIN_GALLERY_SIZE = 20000  # Only use the index once the gallery holds this many embeddings
+ANN_NLIST = 0  # Number of inverted lists (0 = about 4 * sqrt(gallery size))
+ANN_NPROBE = 8  # Lists scanned per query: higher means better recall but slower
+ANN_CANDIDATES = 64  # Nearest embeddings fetched per query before exact re-scoring of their persons
 
-# Function to perform face alignment using eye landmarks
-def align_face(image, landmarks):
-    # Extract eye landmarks (MediaPipe provides normalized coordinates)
-    h, w, _ = image.shape
-    
-    # Convert to absolute coordinates (rough estimate from MediaPipe landmarks)
-    left_eye_x = int(landmarks.location_data.relative_keypoints[0].x * w)
-    left_eye_y = int(landmarks.location_data.relative_keypoints[0].y * h)
-    right_eye_x = int(landmarks.location_data.relative_keypoints[1].x * w)
-    right_eye_y = int(landmarks.location_data.relative_keypoints[1].y * h)
-    
-    # Calculate angle
-    dx = right_eye_x - left_eye_x
-    dy = right_eye_y - left_eye_y
-    angle = np.degrees(np.arctan2(dy, dx))
-    
-    # Get rotation matrix
-    center = ((left_eye_x + right_eye_x) // 2, (left_eye_y + right_eye_y) // 2)
-    rotation_matrix = cv2.getRotationMatrix2D(center, angle, scale=1.0)
-    
-    # Apply rotation
-    aligned_image = cv2.warpAffine(image, rotation_matrix, (w, h), flags=cv2.INTER_CUBIC)
-    
-    return aligned_image
-
-# Function to preprocess image for ResNet50 model
-def preprocess_image(img):
-    # Resize to 224x224 (ResNet input size)
-    resized = cv2.resize(img, (224, 224))
-    # Convert from BGR to RGB (OpenCV uses BGR, but model expects RGB)
-    rgb_img = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
-    
-    # Convert to float32 BEFORE subtraction
-    bgr_img = rgb_img[..., ::-1].copy().astype(np.float32)
-    
-    # Zero-center by mean pixel values
-    bgr_img[..., 0] -= 91.4953
-    bgr_img[..., 1] -= 103.8827
-    bgr_img[..., 2] -= 131.0912
-    
-    # Add batch dimension
-    preprocessed = np.expand_dims(bgr_img, axis=0)
-    return preprocessed
-
-# Function to extract face embeddings using ResNet50 model
-def extract_resnet_features(face_img, resnet_feature_model):
-    preprocessed = preprocess_image(face_img)
-    features = resnet_feature_model.predict(preprocessed, verbose=0)
-    return features[0]  # Return the feature vector
-
-# Function to detect face using MediaPipe and return cropped face
-def detect_and_crop_face(image):
-    # Convert the BGR image to RGB
-    rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    # Process the image
-    results = face_detection.process(rgb_image)
-    
-    if not results.detections:
-        return None, None
-    
-    # Get the first detected face
-    detection = results.detections[0]
-    bboxC = detection.location_data.relative_bounding_box
-    
-    # Convert normalized coordinates to absolute pixel values
-    ih, iw, _ = image.shape
-    x = int(bboxC.xmin * iw)
-    y = int(bboxC.ymin * ih)
-    w = int(bboxC.width * iw)
-    h = int(bboxC.height * ih)
-    
-    # Ensure coordinates are within image boundaries
-    x = max(0, x)
-    y = max(0, y)
-    w = min(w, iw - x)
-    h = min(h, ih - y)
-    
-    # Crop the face
-    face_img = image[y:y+h, x:x+w]
-    
-    # Try to align the face if landmarks are available
+
+# Hot-path metrics, exposed at /api/metrics in the Prometheus text format
+metrics_registry = MetricsRegistry()
+STAGE_SECONDS = metrics_registry.histogram(
+    'facenroll_stage_seconds', 'Time spent in each stage of the recognition and enrollment hot paths', ['stage'])
+REQUEST_SECONDS = metrics_registry.histogram(
+    'facenroll_request_seconds', 'Request latency until the response is ready', ['endpoint', 'method', 'status'])
+INFERENCE_BATCH_SIZE = metrics_registry.histogram(
+    'facenroll_inference_batch_size', 'Faces per ResNet50 forward pass', buckets=(1, 2, 4, 8, 16, 32, 64))
+INFERENCE_QUEUE_WAIT_SECONDS = metrics_registry.histogram(
+    'facenroll_inference_queue_wait_seconds', 'Time a face crop waits in the inference queue')
+
+# Function to time one stage: `with time_stage('detection'): ...`
+def time_stage(stage):
+    return STAGE_SECONDS.time(stage=stage)
+
+# Function to record a stage duration measured elsewhere (e.g. in an enrollment worker process)
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+
+# Size the model's thread pools to the cores this process may run on (serve.py sizes prefork workers the same
+# way); TensorFlow itself is configured when the model is loaded, so serve.py can still change them
+INFERENCE_THREADS = INFERENCE_THREADS or available_cores()
+
+# Function to apply the inference thread settings to TensorFlow; must run before its first operation
+def configure_tensorflow_threads():
+    import tensorflow as tf
     try:
-        aligned_face = align_face(image, detection)
-        # Re-crop the aligned face using the same boundaries
-        aligned_face_crop = aligned_face[y:y+h, x:x+w]
-        if aligned_face_crop.size > 0:
-            face_img = aligned_face_crop
-    except Exception as e:
-        print(f"Warning: Face alignment failed: {e}")
+        tf.config.threading.set_intra_op_parallelism_threads(INFERENCE_THREADS)
+        tf.config.threading.set_inter_op_parallelism_threads(INFERENCE_INTER_OP_THREADS)
+    except RuntimeError as e:
+        print(f"Could not configure TensorFlow threads: {str(e)}")
+
+# Function to get the model file of the configured inference backend
+def active_model_path():
+    if INFERENCE_BACKEND == 'tflite':
+        return QUANTIZED_MODEL_PATH
+    if INFERENCE_BACKEND != 'keras':
+        raise ValueError(f"Unknown inference backend '{INFERENCE_BACKEND}', expected 'keras' or 'tflite'")
+    return FEATURE_MODEL_PATH
+
+# Initialize a pool of MediaPipe Face Detection graphs (one per concurrent request)
+DETECTOR_POOL_SIZE = 4
+detector_pool = DetectorPool(size=DETECTOR_POOL_SIZE) if SERVICE_PROCESS else None
+
+# Settings of the shared face pipeline (see face_pipeline.py). The defaults are those of
+# enrollment; recognition pads the face box by FACE_BOX_PADDING.
+face_pipeline_config = PipelineConfig(
+    face_size=FACE_SIZE,
+    model_batch_sizes=MODEL_BATCH_SIZES,
+    inference_threads=INFERENCE_THREADS,
+    max_faces=1,
+    box_padding=0.0,
+    align=True,
+    similarity_threshold=SIMILARITY_THRESHOLD,
+    projected_similarity_threshold=PROJECTED_SIMILARITY_THRESHOLD,
+    match_reduction=MATCH_REDUCTION,
+    match_top_k=MATCH_TOP_K
+)
+
+# Bulk enrollment: decode/detect fans out over worker processes, crops stream into the inference batcher
+ENROLLMENT_WORKERS = 0  # Decode/detect worker processes (0 = one per CPU core)
+ENROLLMENT_PARALLEL_MIN_IMAGES = 8  # Smaller requests are decoded and detected in the request thread
+ENROLLMENT_MAX_IN_FLIGHT = 64  # Crops allowed to wait for embeddings before decoded results are held back
+enrollment_pipeline = EnrollmentPipeline(
+    face_pipeline_config,
+    workers=ENROLLMENT_WORKERS,
+    max_in_flight=ENROLLMENT_MAX_IN_FLIGHT,
+    min_parallel_images=ENROLLMENT_PARALLEL_MIN_IMAGES,
+    inline_detector=detector_pool,
+    observe_stage=observe_stage
+) if SERVICE_PROCESS else None
+
+# Function to decode encoded image bytes (JPEG/PNG) into a BGR array; returns None on failure
+def decode_image_bytes(image_bytes):
+    with time_stage('image_decode'):
+        np_arr = np.frombuffer(image_bytes, np.uint8)
+        return cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+
+# Function to decode a base64 (or data URL) image into a BGR array; returns None on failure
+def decode_base64_image(image_data):
+    if ',' in image_data:
+        image_data = image_data.split(',')[1]  # Remove data URL prefix
     
-    return face_img, (x, y, w, h)
+    with time_stage('base64_decode'):
+        image_bytes = base64.b64decode(image_data)
+    return decode_image_bytes(image_bytes)
+
+# Function to tell whether a request carries binary images (multipart/form-data or a raw image/* body)
+def is_binary_request():
+    return request.mimetype == 'multipart/form-data' or request.mimetype.startswith('image/')
+
+# Function to collect request parameters from the JSON body, or from form fields and the query string
+def request_params():
+    if is_binary_request():
+        params = request.args.to_dict()
+        params.update(request.form.to_dict())
+        return params
+    return request.get_json(silent=True) or {}
+
+# Function to read a boolean flag that may arrive as JSON true or as a form/query string
+def param_flag(params, name):
+    return params.get(name) in (True, 1, 'true', 'True', '1', 'yes')
+
+# Function to read binary image payloads: the raw body for image/* requests, otherwise the
+# uploaded files of the given multipart field (read straight from the request stream)
+def read_binary_images(field):
+    if request.mimetype.startswith('image/'):
+        return [request.get_data(cache=False)]
+    return [uploaded.read() for uploaded in request.files.getlist(field)]
+
+# Function to encode recognition scores compactly:
+# magic 'FNRS', version (uint8) + 3 pad bytes, uint32 header length, UTF-8 JSON header,
+# uint32 count, count x uint32 person indices (gallery order, see /api/gallery/names),
+# count x float32 scores; all little-endian
+def encode_similarities_binary(header, matcher, similarities):
+    header_bytes = json.dumps(header).encode('utf-8')
+    indices = np.array([matcher.name_to_index[name] for name in similarities], dtype='<u4')
+    scores = np.array(list(similarities.values()), dtype='<f4')
+    return b''.join([
+        b'FNRS',
+        struct.pack('<B3xI', 1, len(header_bytes)),
+        header_bytes,
+        struct.pack('<I', len(indices)),
+        indices.tobytes(),
+        scores.tobytes()
+    ])
 
 # Function to detect face in an image (for validation only)
 def detect_face(image_data):
     try:
-        # Convert base64 to image
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]  # Remove data URL prefix
-        
-        image_bytes = base64.b64decode(image_data)
-        np_arr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+        # Convert base64 (or raw uploaded bytes) to image
+        if isinstance(image_data, bytes):
+            img = decode_image_bytes(image_data)
+        else:
+            img = decode_base64_image(image_data)
         
         if img is None:
             return False, "Failed to decode image"
         
-        # Detect face using MediaPipe instead of Haar cascade
-        rgb_image = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        results = face_detection.process(rgb_image)
+        # Detect faces using MediaPipe instead of Haar cascade
+        faces = face_pipeline.detect([img], max_faces=None)[0]
         
-        if not results.detections:
+        if not faces:
             return False, "No face detected in the image"
-        elif len(results.detections) > 1:
+        elif len(faces) > 1:
             return False, "Multiple faces detected, please capture only one face"
         
         # Get the first detected face
-        detection = results.detections[0]
+        detection, _, score = faces[0]
         bboxC = detection.location_data.relative_bounding_box
         
-        # Convert normalized coordinates to absolute pixel values
-        ih, iw, _ = img.shape
-        x = int(bboxC.xmin * iw)
-        y = int(bboxC.ymin * ih)
-        w = int(bboxC.width * iw)
-        h = int(bboxC.height * ih)
-        
         # Calculate face area ratio
-        image_area = img.shape[0] * img.shape[1]
-        face_area = w * h
-        face_ratio = face_area / image_area
+        face_ratio = bboxC.width * bboxC.height
         
         if face_ratio < 0.05:
             return False, "Face is too small in the image, please move closer"
@@ -178,7 +253,7 @@ def detect_face(image_data):
             return False, "Face is too large in the image, please move back"
         
         # Additional check for face detection confidence
-        if detection.score[0] < 0.7:
+        if score < 0.7:
             return False, "Face detection confidence is too low, please try with better lighting"
         
         return True, "Face detected successfully"
@@ -186,26 +261,516 @@ def detect_face(image_data):
     except Exception as e:
         return False, f"Error processing image: {str(e)}"
 
-# Load the ResNet50 model (lazy loading - will only load when needed)
+# Function to load the learned embedding projection used for new galleries (None when disabled or not fitted)
+def load_embedding_projection():
+    if not EMBEDDING_PROJECTION_ENABLED or not os.path.exists(EMBEDDING_PROJECTION_FILE):
+        return None
+    try:
+        projection = EmbeddingProjection.load(EMBEDDING_PROJECTION_FILE)
+        # Projected scores are on another scale, so SIMILARITY_THRESHOLD does not apply to them
+        if projection.similarity_threshold is None and PROJECTED_SIMILARITY_THRESHOLD is None:
+            print(f"Not using embedding projection {EMBEDDING_PROJECTION_FILE}: it has no fitted similarity threshold "
+                  f"(run fit_projection.py again or set PROJECTED_SIMILARITY_THRESHOLD)")
+            return None
+        threshold = PROJECTED_SIMILARITY_THRESHOLD if PROJECTED_SIMILARITY_THRESHOLD is not None else projection.similarity_threshold
+        print(f"Loaded embedding projection {projection.version} ({projection.input_dim} -> {projection.dim} dimensions, "
+              f"similarity threshold {threshold:.3f})")
+        return projection
+    except Exception as e:
+        print(f"Could not load embedding projection {EMBEDDING_PROJECTION_FILE}: {str(e)}")
+        return None
+
+embedding_projection = load_embedding_projection()
+
+# Resident embedding gallery (loaded once through /api/gallery and reused by every recognition request);
+# every change is committed to the on-disk gallery store before it is swapped in
+gallery_store = GalleryStore(GALLERY_STORE_DIR, projection=embedding_projection) if GALLERY_STORE_ENABLED and SERVICE_PROCESS else None
+_gallery_lock = threading.Lock()
+_gallery = {
+    "version": None,
+    "matcher": FaceMatcher({}),
+    "loadedAt": None,
+    "storeStamp": None  # Gallery store index the matcher was loaded from
+}
+_gallery_checked_at = 0.0
+
+# Function to attach an approximate index to a matcher when the gallery is large enough
+def build_matcher_index(matcher):
+    if not ANN_ENABLED or matcher.size < ANN_MIN_GALLERY_SIZE:
+        return matcher
+    
+    nlist = ANN_NLIST or int(4 * np.sqrt(matcher.size))
+    start_time = time.time()
+    index = IVFIndex(nlist=nlist, nprobe=ANN_NPROBE).train(matcher.ordered_matrix())
+    matcher.attach_index(index, ANN_CANDIDATES)
+    print(f"Built ANN index with {index.nlist} lists over {matcher.size} embeddings in {time.time() - start_time:.2f}s")
+    return matcher
+
+# Function to attach the approximate index in a background thread, so that no request (or /api/metrics
+# scrape) that swaps in a gallery waits for the training; the matcher searches exactly until then
+def build_matcher_index_in_background(matcher):
+    if ANN_ENABLED and matcher.size >= ANN_MIN_GALLERY_SIZE:
+        def build():
+            try:
+                build_matcher_index(matcher)
+            except Exception as e:
+                print(f"Could not build ANN index: {str(e)}")
+        threading.Thread(target=build, name="ann-index", daemon=True).start()
+    return matcher
+
+# Function to replace the resident gallery with a new set of embeddings
+def set_gallery(stored_embeddings, version=None):
+    global _gallery
+    version = str(version) if version is not None else datetime.now().isoformat()
+    # Build the new gallery completely before swapping it in, so concurrent
+    # recognition requests always see either the old or the new version
+    with _gallery_lock:
+        store_stamp = None
+        if gallery_store is not None:
+            gallery_store.replace(stored_embeddings, version)
+            store_stamp = gallery_store.index_stamp()
+            matcher, _ = gallery_store.load_matcher()
+        else:
+            matcher = FaceMatcher(stored_embeddings, embedding_projection)
+        _gallery = {
+            "version": version,
+            "matcher": build_matcher_index(matcher),
+            "loadedAt": datetime.now().isoformat(),
+            "storeStamp": store_stamp
+        }
+        return _gallery
+
+# Function to add or replace persons in the resident gallery (e.g. after enrollment) and delete the
+# persons named in `removed`; persons without embeddings are left unchanged
+def update_gallery(embeddings_by_person, removed=()):
+    global _gallery
+    embeddings_by_person = {name: embeddings for name, embeddings in embeddings_by_person.items() if len(embeddings)}
+    removed = list(removed)
+    with _gallery_lock:
+        previous = _gallery["matcher"]
+        version = datetime.now().isoformat()
+        store_stamp = None
+        if gallery_store is not None:
+            index = gallery_store.update(embeddings_by_person, version, removed=removed)
+            store_stamp = gallery_store.index_stamp()
+            matcher, _ = gallery_store.load_matcher()
+            # The index can only be carried over when the update was applied to this process's
+            # version of the gallery (another worker may have committed in between)
+            if index["previousVersion"] == _gallery["version"]:
+                matcher = matcher.carry_index(previous, list(embeddings_by_person) + removed)
+        else:
+            matcher = previous.updated(embeddings_by_person, removed=removed)
+        if matcher.index is None:
+            # The gallery may have just grown past the size where the index pays off
+            matcher = build_matcher_index_in_background(matcher)
+        _gallery = {
+            "version": version,
+            "matcher": matcher,
+            "loadedAt": datetime.now().isoformat(),
+            "storeStamp": store_stamp
+        }
+        return _gallery
+
+# Function to swap in a gallery version that another process (e.g. another prefork worker of
+# serve.py) committed to the gallery store; only the changed index is read, rows are memory-mapped
+def refresh_gallery():
+    global _gallery
+    if gallery_store.index_stamp() in (None, _gallery["storeStamp"]):
+        return _gallery
+    with _gallery_lock:
+        store_stamp = gallery_store.index_stamp()
+        if store_stamp in (None, _gallery["storeStamp"]):
+            return _gallery
+        try:
+            matcher, version = gallery_store.load_matcher()
+        except Exception as e:
+            # E.g. a compaction removed the segments of the index just read; retried on the next check
+            print(f"Could not refresh gallery from {GALLERY_STORE_DIR}: {str(e)}")
+            return _gallery
+        if matcher is None:
+            return _gallery
+        _gallery = {
+            "version": version,
+            "matcher": build_matcher_index_in_background(matcher),
+            "loadedAt": datetime.now().isoformat(),
+            "storeStamp": store_stamp
+        }
+        print(f"Picked up gallery version {version} ({len(matcher)} persons) from {GALLERY_STORE_DIR}")
+        return _gallery
+
+# Function to get the current resident gallery
+def get_gallery():
+    global _gallery_checked_at
+    # Look for versions committed by other processes at most every GALLERY_STORE_POLL_SECONDS
+    if gallery_store is not None and time.monotonic() - _gallery_checked_at >= GALLERY_STORE_POLL_SECONDS:
+        _gallery_checked_at = time.monotonic()
+        return refresh_gallery()
+    # Writers swap the whole dict in one assignment, so readers need no lock
+    return _gallery
+
+# Function to summarize a gallery for API responses
+def describe_gallery(gallery):
+    projection = gallery["matcher"].projection
+    return {
+        "version": gallery["version"],
+        "persons": len(gallery["matcher"]),
+        "embeddings": gallery["matcher"].size,
+        "projection": projection.version if projection is not None else None,
+        "annIndex": gallery["matcher"].index is not None,
+        "loadedAt": gallery["loadedAt"]
+    }
+
+# Function to check that the vectors of a gallery file can be stored: model embeddings always can,
+# projected ones only with the projection they were made with
+def check_gallery_projection(info):
+    projected_with = info["metadata"].get("projection")
+    current = embedding_projection.version if embedding_projection is not None else None
+    if projected_with is not None and projected_with != current:
+        raise ValueError(f"Gallery vectors were projected with {projected_with}, "
+                         f"the service uses {current or 'no projection'}; re-enroll from the face images instead")
+
+# Function to restore the resident gallery from a gallery file written by an earlier run
+def load_gallery_file(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        start_time = time.time()
+        names, counts, vectors, info = read_gallery(path)
+        check_gallery_projection(info)
+        gallery = set_gallery(gallery_to_dict(names, counts, vectors), info["metadata"].get("version"))
+        print(f"Restored gallery version {gallery['version']} ({len(names)} persons, {info['dtype']}) "
+              f"from {path} in {time.time() - start_time:.2f}s")
+        return gallery
+    except Exception as e:
+        print(f"Could not load gallery file {path}: {str(e)}")
+        return None
+
+# Function to restore the resident gallery from the gallery store; only the index is read,
+# the embeddings are memory-mapped
+def load_gallery_store():
+    global _gallery
+    try:
+        start_time = time.time()
+        store_stamp = gallery_store.index_stamp()
+        matcher, version = gallery_store.load_matcher()
+        if matcher is None:
+            return None
+        with _gallery_lock:
+            _gallery = {
+                "version": version,
+                "matcher": build_matcher_index(matcher),
+                "loadedAt": datetime.now().isoformat(),
+                "storeStamp": store_stamp
+            }
+        print(f"Mapped gallery version {version} ({len(matcher)} persons, {matcher.size} embeddings) "
+              f"from {GALLERY_STORE_DIR} in {time.time() - start_time:.3f}s")
+        stored_with = matcher.projection.version if matcher.projection is not None else None
+        configured = embedding_projection.version if embedding_projection is not None else None
+        if stored_with != configured:
+            # The gallery keeps matching through its own projection until it is replaced
+            print(f"Gallery store uses projection {stored_with or 'none'}, the service is configured with "
+                  f"{configured or 'none'}; it switches when the gallery is next replaced (PUT /api/gallery)")
+        return _gallery
+    except Exception as e:
+        print(f"Could not load gallery store {GALLERY_STORE_DIR}: {str(e)}")
+        return None
+
+if SERVICE_PROCESS and (gallery_store is None or load_gallery_store() is None):
+    if LOAD_GALLERY_FILE:
+        load_gallery_file(OUTPUT_FILE)
+
+# Raised when the inference queue is full and the caller should back off
+class InferenceQueueFull(Exception):
+    pass
+
+# Dynamic micro-batching scheduler for ResNet50 inference: face crops submitted by
+# concurrent requests are collected for a short window and embedded in one forward pass.
+# The worker thread resizes (or copies) each crop straight into a reused uint8 batch
+# buffer; casting and mean subtraction happen inside the model graph.
+class InferenceBatcher:
+    def __init__(self, model_getter, max_batch_size=16, window_ms=10, queue_limit=256, submit_timeout=0.5):
+        self.model_getter = model_getter
+        self.max_batch_size = max_batch_size
+        self.window = window_ms / 1000.0
+        self.submit_timeout = submit_timeout
+        self._queue = queue.Queue(maxsize=queue_limit)
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._batch_buffer = None  # Only touched by the worker thread
+        
+        # Per-batch metrics
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.rejected = 0
+        self.errors = 0
+        self.batch_sizes = Counter()
+        self.recent_batches = deque(maxlen=100)  # (size, queue wait seconds, inference seconds)
+    
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._worker_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="inference-batcher", daemon=True)
+                    self._worker.start()
+    
+    # Queue one uint8 BGR face crop (any size; aligned 224x224 crops are not resized again)
+    # and get a Future for its embedding
+    def submit(self, face_img):
+        self._ensure_worker()
+        future = Future()
+        try:
+            self._queue.put((face_img, future, time.time()), timeout=self.submit_timeout)
+        except queue.Full:
+            with self._stats_lock:
+                self.rejected += 1
+            raise InferenceQueueFull("Inference queue is full, try again later")
+        return future
+    
+    # Embed one face crop (blocks until its batch has run)
+    def embed(self, face_img, timeout=30):
+        return self.submit(face_img).result(timeout=timeout)
+    
+    # Embed several face crops; they are queued together so they usually share a batch
+    def embed_many(self, face_imgs, timeout=30):
+        futures = [self.submit(face_img) for face_img in face_imgs]
+        return [future.result(timeout=timeout) for future in futures]
+    
+    # Put the batch's crops into the reused input buffer; returns a view of the first
+    # rows, padded (with stale rows) up to the traced batch size the model will run
+    def _fill_batch(self, model, face_imgs):
+        rows = max(len(face_imgs), model.bucket_size(len(face_imgs)))
+        if self._batch_buffer is None or len(self._batch_buffer) < rows:
+            capacity = max(rows, model.bucket_size(self.max_batch_size))
+            self._batch_buffer = np.zeros((capacity, FACE_SIZE, FACE_SIZE, 3), dtype=np.uint8)
+        from face_model import resize_faces
+        resize_faces(face_imgs, FACE_SIZE, out=self._batch_buffer)
+        return self._batch_buffer[:rows]
+    
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.time() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+    
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            start_time = time.time()
+            try:
+                model = self.model_getter()
+                if model is None:
+                    raise RuntimeError("Failed to load ResNet50 model")
+                with time_stage('preprocessing'):
+                    inputs = self._fill_batch(model, [item[0] for item in batch])
+                with time_stage('inference'):
+                    features = model.embed(inputs)[:len(batch)]
+                for (_, future, _), row in zip(batch, features):
+                    future.set_result(row)
+            except Exception as e:
+                with self._stats_lock:
+                    self.errors += 1
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            
+            inference_time = time.time() - start_time
+            queue_wait = start_time - min(item[2] for item in batch)
+            INFERENCE_BATCH_SIZE.observe(len(batch))
+            for item in batch:
+                INFERENCE_QUEUE_WAIT_SECONDS.observe(start_time - item[2])
+            with self._stats_lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.batch_sizes[len(batch)] += 1
+                self.recent_batches.append((len(batch), queue_wait, inference_time))
+    
+    def stats(self):
+        with self._stats_lock:
+            recent = list(self.recent_batches)
+            return {
+                "queueDepth": self._queue.qsize(),
+                "batches": self.batches,
+                "items": self.items,
+                "rejected": self.rejected,
+                "errors": self.errors,
+                "averageBatchSize": self.items / self.batches if self.batches else 0,
+                "batchSizes": {str(size): count for size, count in sorted(self.batch_sizes.items())},
+                "recentAverageQueueWaitMs": 1000 * float(np.mean([r[1] for r in recent])) if recent else 0,
+                "recentAverageInferenceMs": 1000 * float(np.mean([r[2] for r in recent])) if recent else 0
+            }
+
+# Load the ResNet50 model (lazy loading - will only load when needed, unless warmed up at startup)
 _resnet_model = None
+_resnet_model_lock = threading.Lock()
+_resnet_model_timings = {}
 def get_resnet_model():
     global _resnet_model
     if _resnet_model is None:
-        print("Loading ResNet50 Face feature extraction model...")
-        try:
-            _resnet_model = load_model(FEATURE_MODEL_PATH)
-            print("Model loaded successfully!")
-        except Exception as e:
-            print(f"Error loading model: {str(e)}")
-            _resnet_model = None
+        with _resnet_model_lock:
+            if _resnet_model is None:
+                print(f"Loading ResNet50 Face feature extraction model ({INFERENCE_BACKEND} backend)...")
+                try:
+                    from face_model import load_embedding_model
+                    configure_tensorflow_threads()
+                    start_time = time.perf_counter()
+                    model = load_embedding_model(active_model_path(), batch_sizes=MODEL_BATCH_SIZES, warm_up=False,
+                                                 num_threads=INFERENCE_THREADS)
+                    _resnet_model_timings["loadSeconds"] = time.perf_counter() - start_time
+                    
+                    # Run every traced batch size once so no request pays for first-call initialisation
+                    start_time = time.perf_counter()
+                    model.warm_up()
+                    _resnet_model_timings["warmUpSeconds"] = time.perf_counter() - start_time
+                    _resnet_model = model
+                    print(f"Model loaded successfully in {_resnet_model_timings['loadSeconds']:.2f}s "
+                          f"(warm-up {_resnet_model_timings['warmUpSeconds']:.2f}s)!")
+                except Exception as e:
+                    print(f"Error loading model: {str(e)}")
+                    _resnet_model = None
     return _resnet_model
 
+# Function to summarize the inference backend for API responses; quantized exports also report
+# their quantization and the embedding drift against the float model measured at export time
+def describe_model():
+    description = {
+        "loaded": _resnet_model is not None,
+        "backend": INFERENCE_BACKEND,
+        "path": active_model_path(),
+        **_resnet_model_timings
+    }
+    metadata = getattr(_resnet_model, 'metadata', None)
+    if metadata:
+        description["quantization"] = metadata.get("quantization")
+        description["drift"] = metadata.get("drift")
+    return description
+
+# Persistent embedding cache keyed by image content hash and model version (created on first use)
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+def get_embedding_cache():
+    global _embedding_cache
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+    if _embedding_cache is None:
+        with _embedding_cache_lock:
+            if _embedding_cache is None:
+                try:
+                    model_version = model_file_version(active_model_path(), EMBEDDING_PIPELINE_VERSION)
+                    _embedding_cache = EmbeddingCache(EMBEDDING_CACHE_FILE, model_version)
+                except Exception as e:
+                    print(f"Embedding cache unavailable: {str(e)}")
+                    return None
+    return _embedding_cache
+
+# Shared inference scheduler used by every endpoint that needs embeddings
+inference_batcher = InferenceBatcher(
+    get_resnet_model,
+    max_batch_size=INFERENCE_MAX_BATCH_SIZE,
+    window_ms=INFERENCE_BATCH_WINDOW_MS,
+    queue_limit=INFERENCE_QUEUE_LIMIT
+) if SERVICE_PROCESS else None
+
+# Face pipeline used by the request handlers: pooled detectors, embeddings through the batcher
+face_pipeline = FacePipeline(
+    face_pipeline_config,
+    detector=detector_pool,
+    embedder=inference_batcher.embed_many,
+    observe_stage=observe_stage
+) if SERVICE_PROCESS else None
+
+# Raised when the service already has as many requests waiting as it is allowed to queue
+class ServiceOverloaded(Exception):
+    pass
+
+# Bounded executor for CPU-bound request work: at most max_concurrency requests run at once and at
+# most max_queue_depth wait for a slot; beyond that callers are rejected instead of piling up
+class WorkLimiter:
+    def __init__(self, max_concurrency, max_queue_depth):
+        self.max_concurrency = max_concurrency
+        self.max_queue_depth = max_queue_depth
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="face-work")
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+    
+    # Run fn on the executor and wait for its result; raises ServiceOverloaded when the queue is full
+    def run(self, fn, *args, **kwargs):
+        with self._lock:
+            if self.pending >= self.max_concurrency + self.max_queue_depth:
+                self.rejected += 1
+                raise ServiceOverloaded("Face service is busy, try again later")
+            self.pending += 1
+        try:
+            return self.executor.submit(fn, *args, **kwargs).result()
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+    
+    def stats(self):
+        with self._lock:
+            return {
+                "maxConcurrency": self.max_concurrency,
+                "maxQueueDepth": self.max_queue_depth,
+                "inFlight": min(self.pending, self.max_concurrency),
+                "queued": max(0, self.pending - self.max_concurrency),
+                "completed": self.completed,
+                "rejected": self.rejected
+            }
+
+work_limiter = WorkLimiter(SERVING_MAX_CONCURRENCY, SERVING_MAX_QUEUE_DEPTH) if SERVICE_PROCESS else None
+
+# Function to resize the serving limits (used by serve.py before it starts accepting requests)
+def configure_serving(max_concurrency, max_queue_depth):
+    global work_limiter
+    old_limiter = work_limiter
+    work_limiter = WorkLimiter(max_concurrency, max_queue_depth)
+    old_limiter.executor.shutdown(wait=False)
+
+# Function to size this process's model threads and enrollment worker pool (used by serve.py, e.g. to give
+# each prefork worker its share of the cores). Must run before the model is loaded: TensorFlow fixes its
+# thread pools when its runtime starts.
+def configure_inference_threads(intra_op_threads, inter_op_threads, enrollment_workers=None):
+    global INFERENCE_THREADS, INFERENCE_INTER_OP_THREADS
+    if _resnet_model is not None:
+        raise RuntimeError("The model is already loaded; configure inference threads before warming up")
+    INFERENCE_THREADS = intra_op_threads
+    INFERENCE_INTER_OP_THREADS = inter_op_threads
+    face_pipeline_config.inference_threads = intra_op_threads
+    if enrollment_workers:
+        enrollment_pipeline.workers = enrollment_workers
+
+# Decorator running a route's work on the bounded executor; the server thread only
+# hands the request over and writes the response, and overload becomes a 429
+def limited_work(route):
+    @functools.wraps(route)
+    def wrapper(*args, **kwargs):
+        try:
+            return work_limiter.run(copy_current_request_context(route), *args, **kwargs)
+        except ServiceOverloaded as e:
+            response = jsonify({"error": str(e)})
+            response.headers['Retry-After'] = str(SERVING_RETRY_AFTER_SECONDS)
+            return response, 429
+    return wrapper
+
 @app.route('/api/validate-faces', methods=['POST'])
+@limited_work
 def validate_faces():
     try:
-        # Get the images data from request
-        data = request.json
-        images = data.get('images', [])
+        # Get the images data from request (base64 strings in JSON, or uploaded files)
+        if is_binary_request():
+            images = read_binary_images('images')
+        else:
+            images = request.json.get('images', [])
         
         if not images:
             return jsonify({"error": "No images provided"}), 400
@@ -226,12 +791,156 @@ def validate_faces():
     except Exception as e:
         return jsonify({"error": f"Validation error: {str(e)}"}), 500
 
+# Function to get the raw bytes of one enrollment image (uploaded bytes or base64 data)
+def enrollment_image_bytes(img_data):
+    image_bytes = img_data.get('imageBytes')
+    if image_bytes is not None:
+        return image_bytes
+    
+    image_base64 = img_data.get('imageData')
+    
+    # Handle different base64 formats
+    if ',' in image_base64:
+        image_base64 = image_base64.split(',')[1]  # Remove data URL prefix
+    
+    with time_stage('base64_decode'):
+        return base64.b64decode(image_base64)
+
+# Function to persist one enrollment image under TEMP_FACES_DIR/<person>/ (only on request)
+def save_enrollment_image(person_name, image_name, image_bytes):
+    person_dir = os.path.join(TEMP_FACES_DIR, os.path.basename(person_name))
+    os.makedirs(person_dir, exist_ok=True)
+    with open(os.path.join(person_dir, os.path.basename(image_name)), 'wb') as f:
+        f.write(image_bytes)
+
+# Function to build the metadata written with exported gallery files
+def gallery_file_metadata(gallery):
+    projection = gallery["matcher"].projection
+    return {
+        "version": gallery["version"],
+        "model": os.path.basename(active_model_path()),
+        "projection": projection.version if projection is not None else None
+    }
+
+# Function to write the current resident gallery to the backup file. The write is atomic and
+# serialized, so concurrent enrollments never leave a torn or outdated file behind.
+_gallery_file_lock = threading.Lock()
+def save_gallery_file():
+    with _gallery_file_lock:
+        gallery = get_gallery()
+        matcher = gallery["matcher"]
+        return write_gallery(OUTPUT_FILE, matcher.names, matcher.counts, matcher.ordered_matrix(),
+                             dtype=GALLERY_STORAGE_DTYPE, metadata=gallery_file_metadata(gallery))
+
+# Function to read enrollment images from the request: JSON {"images": [...]} or a multipart upload
+def read_enrollment_images():
+    if request.mimetype == 'multipart/form-data':
+        # Each uploaded file's field name is the person name and its filename the image name
+        return [{
+            "personName": person_name,
+            "imageName": uploaded.filename,
+            "imageBytes": uploaded.read()
+        } for person_name, uploaded in request.files.items(multi=True)]
+    return (request.json or {}).get('images', [])
+
+# Function to group enrollment images by person name, keeping request order
+def group_images_by_person(images):
+    person_images = {}
+    for img_data in images:
+        person_name = img_data.get('personName')
+        if person_name not in person_images:
+            person_images[person_name] = []
+        person_images[person_name].append(img_data)
+    return person_images
+
+# Function to compute embeddings for {person: [image data]}; log lines are passed to `log`.
+# Returns (embeddings_data, errors, cache_hits, cache_misses)
+def enroll_persons(person_images, persist_images, log):
+    embeddings_data = {}
+    
+    # Unchanged images are served from the content-addressed embedding cache
+    embedding_cache = get_embedding_cache()
+    cache_hits = 0
+    cache_misses = 0
+    
+    # Pass 1: resolve cached images; everything else becomes a job for the pipeline
+    slots_by_person = {}  # person -> [(image name, embedding)] in request order
+    jobs = []  # (person, slot index, image name, image hash, image bytes)
+    errors = []  # Per-image failures: {"personName", "imageName", "error"}
+    for person_name, person_img_list in person_images.items():
+        slots = slots_by_person.setdefault(person_name, [])
+        for img_data in person_img_list:
+            img_name = img_data.get('imageName')
+            try:
+                image_bytes = enrollment_image_bytes(img_data)
+                image_hash = image_content_hash(image_bytes)
+                
+                if persist_images:
+                    save_enrollment_image(person_name, img_name, image_bytes)
+                    log(f"  Saved image: {img_name} for person: {person_name}")
+                
+                if embedding_cache is not None:
+                    found, cached_embedding = embedding_cache.get(image_hash)
+                    if found:
+                        cache_hits += 1
+                        if cached_embedding is None:
+                            log(f"  No face detected in: {img_name} (cached)")
+                        else:
+                            slots.append((img_name, cached_embedding))
+                            log(f"  Processed: {img_name} (cached)")
+                        continue
+                    cache_misses += 1
+                
+                jobs.append((person_name, len(slots), img_name, image_hash, image_bytes))
+                slots.append((img_name, None))
+            
+            except Exception as e:
+                log(f"  Error processing {img_name}: {str(e)}")
+                errors.append({"personName": person_name, "imageName": img_name, "error": str(e)})
+    
+    # Pass 2: decode/detect in parallel and embed the crops as they stream in
+    if jobs:
+        log(f"Decoding and detecting {len(jobs)} images...")
+        outcomes = enrollment_pipeline.run([job[4] for job in jobs], inference_batcher.submit)
+        for (person_name, slot_idx, img_name, image_hash, _), (outcome, value) in zip(jobs, outcomes):
+            if outcome == OK:
+                slots_by_person[person_name][slot_idx] = (img_name, value)
+                log(f"  Processed: {img_name} for person: {person_name}")
+            elif outcome == NO_FACE:
+                log(f"  No face detected in: {img_name}")
+            elif outcome == UNREADABLE:
+                log(f"Could not read image: {img_name}")
+            else:
+                log(f"  Error processing {img_name}: {value}")
+                errors.append({"personName": person_name, "imageName": img_name, "error": value})
+            
+            # Failures are not cached so the image is retried on the next enrollment
+            if embedding_cache is not None and outcome in (OK, NO_FACE):
+                embedding_cache.put(image_hash, value)
+    
+    # Store embeddings (numpy arrays converted to lists for JSON)
+    for person_name, slots in slots_by_person.items():
+        embeddings_data[person_name] = [embedding.tolist() for _, embedding in slots if embedding is not None]
+    
+    if embedding_cache is not None:
+        log(f"Embedding cache: {cache_hits} hits, {cache_misses} misses")
+    
+    return embeddings_data, errors, cache_hits, cache_misses
+
+# Function to keep only the persons an enrollment produced embeddings for
+def usable_embeddings(embeddings_data):
+    return {person_name: embeddings for person_name, embeddings in embeddings_data.items() if embeddings}
+
+# Function to list the persons an enrollment produced no embeddings for (no face found or every image failed)
+def unusable_persons(embeddings_data):
+    return [person_name for person_name, embeddings in embeddings_data.items() if not embeddings]
+
 @app.route('/api/process-images', methods=['POST'])
+@limited_work
 def process_images():
     try:
         # Get the images data from request
-        data = request.json
-        images = data.get('images', [])
+        images = read_enrollment_images()
         
         if not images:
             return jsonify({"error": "No images provided"}), 400
@@ -241,100 +950,41 @@ def process_images():
         if resnet_feature_model is None:
             return jsonify({"error": "Failed to load ResNet50 model"}), 500
         
-        # Clear temp directory
-        if os.path.exists(TEMP_FACES_DIR):
-            shutil.rmtree(TEMP_FACES_DIR)
-        os.makedirs(TEMP_FACES_DIR, exist_ok=True)
-        
-        # Save images to temp directory
+        # Images are decoded and processed in memory; they are only written to
+        # disk when the request asks for it (persistImages)
+        persist_images = param_flag(request_params(), 'persistImages')
         logs = ["Starting image processing with ResNet50 model..."]
         
         # Group images by person name
-        person_images = {}
-        for img_data in images:
-            person_name = img_data.get('personName')
-            if person_name not in person_images:
-                person_images[person_name] = []
-            person_images[person_name].append(img_data)
-        
+        person_images = group_images_by_person(images)
         logs.append(f"Found images for {len(person_images)} users")
         
-        # Save images grouped by person
-        for person_name, person_img_list in person_images.items():
-            person_dir = os.path.join(TEMP_FACES_DIR, person_name)
-            os.makedirs(person_dir, exist_ok=True)
-            
-            logs.append(f"Saving {len(person_img_list)} images for {person_name}")
-            
-            for img_data in person_img_list:
-                image_name = img_data.get('imageName')
-                image_base64 = img_data.get('imageData')
-                
-                # Handle different base64 formats
-                if ',' in image_base64:
-                    image_base64 = image_base64.split(',')[1]  # Remove data URL prefix
-                
-                # Convert base64 to image and save
-                image_bytes = base64.b64decode(image_base64)
-                img_path = os.path.join(person_dir, image_name)
-                with open(img_path, 'wb') as f:
-                    f.write(image_bytes)
-                
-                logs.append(f"  Saved image: {image_name} for person: {person_name}")
-        
         # Process images with ResNet50 model
         logs.append("Processing images with ResNet50 model...")
-        
-        # Process each person's directory
-        embeddings_data = {}
-        
-        for person_name in os.listdir(TEMP_FACES_DIR):
-            person_path = os.path.join(TEMP_FACES_DIR, person_name)
-            if os.path.isdir(person_path):
-                embeddings_data[person_name] = []
-                logs.append(f"Processing images for: {person_name}")
-                
-                # Process each image in the person's directory
-                for img_name in os.listdir(person_path):
-                    if img_name.lower().endswith(('.png', '.jpg', '.jpeg')):
-                        img_path = os.path.join(person_path, img_name)
-                        try:
-                            # Load image
-                            img = cv2.imread(img_path)
-                            if img is None:
-                                logs.append(f"Could not read image: {img_path}")
-                                continue
-                            
-                            # Detect face in the image using MediaPipe
-                            face_img, face_coords = detect_and_crop_face(img)
-                            
-                            if face_img is not None and face_img.size > 0:
-                                # Extract features using ResNet50
-                                embedding = extract_resnet_features(face_img, resnet_feature_model)
-                                
-                                # Store embedding
-                                embeddings_data[person_name].append(embedding.tolist())  # Convert numpy array to list for JSON
-                                logs.append(f"  Processed: {img_name}")
-                            else:
-                                logs.append(f"  No face detected in: {img_name}")
-                        
-                        except Exception as e:
-                            logs.append(f"  Error processing {img_path}: {str(e)}")
+        embeddings_data, errors, cache_hits, cache_misses = enroll_persons(person_images, persist_images, logs.append)
         
         # Print summary
         total_embeddings = sum(len(emb) for emb in embeddings_data.values())
         logs.append(f"\nProcessed {total_embeddings} face images for {len(embeddings_data)} persons")
         
+        # Insert the new embeddings into the resident gallery; persons without a usable face keep their entry
+        for person_name in unusable_persons(embeddings_data):
+            logs.append(f"No usable face images for {person_name}; gallery entry left unchanged")
+        gallery = update_gallery(usable_embeddings(embeddings_data))
+        logs.append(f"Updated resident gallery to version {gallery['version']}")
+        
         # Save embeddings to file (for backup/local use)
-        logs.append(f"Saving embeddings to {OUTPUT_FILE}...")
-        with open(OUTPUT_FILE, 'wb') as f:
-            pickle.dump(embeddings_data, f)
-        logs.append("Embeddings saved successfully!")
+        if SAVE_EMBEDDINGS_FILE:
+            logs.append(f"Saving gallery to {OUTPUT_FILE}...")
+            saved_bytes = save_gallery_file()
+            logs.append(f"Gallery saved successfully ({saved_bytes} bytes)!")
         
         # Return the embeddings and logs
         response = {
             "logs": logs,
             "embeddings": embeddings_data,
+            "cache": {"enabled": get_embedding_cache() is not None, "hits": cache_hits, "misses": cache_misses},
+            "errors": errors,
             "timestamp": datetime.now().isoformat()  # FIXED: Changed from datetime.datetime.now()
         }
         
@@ -343,94 +993,336 @@ def process_images():
     except Exception as e:
         return jsonify({"error": f"Processing error: {str(e)}"}), 500
 
+# Background enrollment jobs: results are streamed as events and kept on disk for later retrieval
+enrollment_jobs = EnrollmentJobStore(ENROLLMENT_JOBS_DIR, retention_seconds=ENROLLMENT_JOB_RETENTION_HOURS * 3600) \
+    if SERVICE_PROCESS else None
+enrollment_job_executor = ThreadPoolExecutor(max_workers=ENROLLMENT_JOB_CONCURRENCY, thread_name_prefix="enrollment-job") \
+    if SERVICE_PROCESS else None
+
+# Function to run one enrollment job: persons are processed in chunks of about
+# ENROLLMENT_JOB_CHUNK_IMAGES images, and each chunk's results are emitted and released
+def run_enrollment_job(job, person_images, persist_images):
+    def log(message):
+        job.emit('log', message=message)
+    
+    try:
+        job.update(status=RUNNING, startedAt=datetime.now().isoformat())
+        if get_resnet_model() is None:
+            raise RuntimeError("Failed to load ResNet50 model")
+        
+        log("Starting image processing with ResNet50 model...")
+        log(f"Found images for {len(person_images)} users")
+        
+        processed_images = 0
+        processed_persons = 0
+        total_embeddings = 0
+        gallery = None
+        person_names = list(person_images)
+        while person_names:
+            # Take whole persons until the chunk is large enough to keep the pipeline busy
+            chunk = {}
+            chunk_images = 0
+            while person_names and (not chunk or chunk_images < ENROLLMENT_JOB_CHUNK_IMAGES):
+                person_name = person_names.pop(0)
+                chunk[person_name] = person_images.pop(person_name)
+                chunk_images += len(chunk[person_name])
+            
+            embeddings_data, errors, _, _ = enroll_persons(chunk, persist_images, log)
+            for person_name, embeddings in embeddings_data.items():
+                person_errors = [error for error in errors if error["personName"] == person_name]
+                job.emit('person', personName=person_name, embeddings=embeddings, errors=person_errors)
+                total_embeddings += len(embeddings)
+            
+            # New persons become recognizable as soon as their chunk is done; persons without a
+            # usable face keep their entry
+            for person_name in unusable_persons(embeddings_data):
+                log(f"No usable face images for {person_name}; gallery entry left unchanged")
+            gallery = update_gallery(usable_embeddings(embeddings_data))
+            
+            processed_images += chunk_images
+            processed_persons += len(chunk)
+            job.update(processedImages=processed_images, processedPersons=processed_persons)
+            job.emit('progress', processedImages=processed_images, totalImages=job.meta["totalImages"],
+                     processedPersons=processed_persons, totalPersons=job.meta["totalPersons"],
+                     galleryVersion=gallery["version"])
+        
+        log(f"\nProcessed {total_embeddings} face images for {processed_persons} persons")
+        
+        # Save embeddings to file (for backup/local use)
+        if SAVE_EMBEDDINGS_FILE:
+            log(f"Saving gallery to {OUTPUT_FILE}...")
+            saved_bytes = save_gallery_file()
+            log(f"Gallery saved successfully ({saved_bytes} bytes)!")
+        
+        gallery_version = gallery["version"] if gallery is not None else None
+        job.emit('completed', processedImages=processed_images, processedPersons=processed_persons,
+                 galleryVersion=gallery_version)
+        job.update(status=COMPLETED, finishedAt=datetime.now().isoformat(), galleryVersion=gallery_version)
+    
+    except Exception as e:
+        print(f"Enrollment job {job.id} failed: {str(e)}")
+        job.emit('failed', error=str(e))
+        job.update(status=FAILED, finishedAt=datetime.now().isoformat(), error=str(e))
+
+# Route to submit an enrollment job; returns immediately with the job id
+@app.route('/api/enrollment-jobs', methods=['POST'])
+def create_enrollment_job():
+    try:
+        images = read_enrollment_images()
+        if not images:
+            return jsonify({"error": "No images provided"}), 400
+        
+        person_images = group_images_by_person(images)
+        persist_images = param_flag(request_params(), 'persistImages')
+        job = enrollment_jobs.create(totalImages=len(images), totalPersons=len(person_images),
+                                     processedImages=0, processedPersons=0)
+        enrollment_job_executor.submit(run_enrollment_job, job, person_images, persist_images)
+        
+        response = dict(job.meta)
+        response["eventsUrl"] = f"/api/enrollment-jobs/{job.id}/events"
+        response["resultsUrl"] = f"/api/enrollment-jobs/{job.id}/results"
+        return jsonify(response), 202
+    
+    except Exception as e:
+        return jsonify({"error": f"Could not create enrollment job: {str(e)}"}), 500
+
+# Route to get the status of an enrollment job
+@app.route('/api/enrollment-jobs/<job_id>', methods=['GET'])
+def enrollment_job_status(job_id):
+    job = enrollment_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown enrollment job"}), 404
+    return jsonify(job.meta)
+
+# Route to stream an enrollment job's events as NDJSON, or as server-sent events when the
+# client accepts text/event-stream. Events after ?after=<seq> (or Last-Event-ID) are replayed first.
+@app.route('/api/enrollment-jobs/<job_id>/events', methods=['GET'])
+def enrollment_job_events(job_id):
+    job = enrollment_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown enrollment job"}), 404
+    
+    try:
+        after = int(request.args.get('after', request.headers.get('Last-Event-ID', -1)))
+    except ValueError:
+        return jsonify({"error": "after must be an event sequence number"}), 400
+    
+    server_sent_events = request.args.get('format') == 'sse' or request.accept_mimetypes.best == 'text/event-stream'
+    
+    def generate():
+        for event in job.follow(after=after, heartbeat=ENROLLMENT_JOB_HEARTBEAT_SECONDS):
+            if server_sent_events:
+                if event is None:
+                    yield ": heartbeat\n\n"
+                else:
+                    yield f"id: {event['seq']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+            elif event is None:
+                yield json.dumps({"type": "heartbeat"}) + '\n'
+            else:
+                yield json.dumps(event) + '\n'
+    
+    mimetype = 'text/event-stream' if server_sent_events else 'application/x-ndjson'
+    response = Response(generate(), mimetype=mimetype)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# Route to fetch the results of a finished enrollment job (same shape as /api/process-images)
+@app.route('/api/enrollment-jobs/<job_id>/results', methods=['GET'])
+def enrollment_job_results(job_id):
+    job = enrollment_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown enrollment job"}), 404
+    if job.status != COMPLETED:
+        return jsonify({"error": f"Enrollment job is {job.status}", "status": job.status,
+                        "jobError": job.meta.get("error")}), 409
+    
+    embeddings_data, errors, logs = job.results()
+    return jsonify({
+        "jobId": job.id,
+        "logs": logs,
+        "embeddings": embeddings_data,
+        "errors": errors,
+        "galleryVersion": job.meta.get("galleryVersion"),
+        "timestamp": job.meta.get("finishedAt")
+    })
+
+# Route to load or replace the resident embedding gallery
+@app.route('/api/gallery', methods=['PUT', 'POST'])
+def load_gallery():
+    try:
+        if request.mimetype == GALLERY_MIME:
+            # Compact binary gallery (see gallery_format.py); the version may be given as ?version=
+            try:
+                names, counts, vectors, info = decode_gallery(request.get_data())
+                check_gallery_projection(info)
+            except ValueError as e:
+                return jsonify({"error": f"Invalid gallery data: {str(e)}"}), 400
+            stored_embeddings = gallery_to_dict(names, counts, vectors)
+            version = request.args.get('version', info["metadata"].get("version"))
+        else:
+            data = request.json
+            stored_embeddings = data.get('embeddings')
+            version = data.get('version')
+        
+        if stored_embeddings is None:
+            return jsonify({"error": "No embeddings provided"}), 400
+        
+        gallery = set_gallery(stored_embeddings, version)
+        print(f"Loaded gallery version {gallery['version']} with {len(gallery['matcher'])} persons")
+        
+        return jsonify(describe_gallery(gallery))
+    
+    except Exception as e:
+        return jsonify({"error": f"Gallery error: {str(e)}"}), 500
+
+# Route to check which gallery version is currently loaded (the latest committed to the gallery store,
+# whichever worker committed it, so clients do not reload a gallery another worker already has)
+@app.route('/api/gallery', methods=['GET'])
+def gallery_info():
+    return jsonify(describe_gallery(refresh_gallery() if gallery_store is not None else get_gallery()))
+
+# Route to download the resident gallery in the compact binary format (?dtype=float32|float16|int8)
+@app.route('/api/gallery/export', methods=['GET'])
+def export_gallery():
+    dtype = request.args.get('dtype', GALLERY_STORAGE_DTYPE)
+    gallery = get_gallery()
+    matcher = gallery["matcher"]
+    try:
+        data = encode_gallery(matcher.names, matcher.counts, matcher.ordered_matrix(), dtype=dtype,
+                              metadata=gallery_file_metadata(gallery))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    response = Response(data, mimetype=GALLERY_MIME)
+    response.headers['X-Gallery-Version'] = str(gallery["version"])
+    return response
+
+# Route to list person names in gallery order (decodes the indices of binary similarity responses)
+@app.route('/api/gallery/names', methods=['GET'])
+def gallery_names():
+    gallery = get_gallery()
+    return jsonify({"version": gallery["version"], "names": gallery["matcher"].names})
+
+# Route to delete a person from the resident gallery (and the gallery store)
+@app.route('/api/gallery/persons/<person_name>', methods=['DELETE'])
+def delete_gallery_person(person_name):
+    try:
+        if person_name not in get_gallery()["matcher"].name_to_index:
+            return jsonify({"error": f"Unknown person '{person_name}'"}), 404
+        gallery = update_gallery({}, removed=[person_name])
+        if SAVE_EMBEDDINGS_FILE:
+            save_gallery_file()
+        return jsonify(describe_gallery(gallery))
+    except Exception as e:
+        return jsonify({"error": f"Gallery error: {str(e)}"}), 500
+
+# Function to pick the matcher for a recognition request; returns (matcher, gallery version, error response)
+def resolve_matcher(data):
+    stored_embeddings = data.get('embeddings')
+    gallery_version = data.get('galleryVersion')
+    
+    if stored_embeddings:
+        # Legacy clients still send the whole gallery with every request
+        return FaceMatcher(stored_embeddings), None, None
+    
+    # Use the resident gallery loaded through /api/gallery
+    gallery = get_gallery()
+    if gallery_version is not None and str(gallery_version) != gallery["version"] and gallery_store is not None:
+        # Another worker may have committed the client's version since the last poll
+        gallery = refresh_gallery()
+    if gallery_version is not None and str(gallery_version) != gallery["version"]:
+        return None, None, (jsonify({
+            "error": "Gallery version mismatch",
+            "galleryVersion": gallery["version"]
+        }), 409)
+    
+    if gallery["version"] is None:
+        return None, None, (jsonify({"error": "No embeddings provided and no gallery loaded"}), 400)
+    
+    return gallery["matcher"], gallery["version"], None
+
 # New route for face recognition using stored embeddings
 @app.route('/api/recognize-face', methods=['POST'])
+@limited_work
 def recognize_face():
     try:
-        # Get the image data from request
-        data = request.json
-        image_data = data.get('image')
-        stored_embeddings = data.get('embeddings')
+        # Get the image data from request: a base64 string in JSON, a multipart
+        # 'image' file, or a raw image/jpeg body (parameters then come from the query string)
+        data = request_params()
+        if is_binary_request():
+            image_payloads = read_binary_images('image')
+            image_data = image_payloads[0] if image_payloads else None
+        else:
+            image_data = data.get('image')
         
         if not image_data:
             return jsonify({"error": "No image provided"}), 400
         
-        if not stored_embeddings:
-            return jsonify({"error": "No embeddings provided"}), 400
-        
-        # Convert stored embeddings from lists back to numpy arrays
-        processed_embeddings = {}
-        for person_name, embeddings_list in stored_embeddings.items():
-            processed_embeddings[person_name] = [np.array(emb) for emb in embeddings_list]
+        matcher, gallery_version, error_response = resolve_matcher(data)
+        if error_response is not None:
+            return error_response
         
         # Load ResNet50 model
         resnet_feature_model = get_resnet_model()
         if resnet_feature_model is None:
             return jsonify({"error": "Failed to load ResNet50 model"}), 500
         
-        # Convert base64 to image
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]  # Remove data URL prefix
-        
-        image_bytes = base64.b64decode(image_data)
-        np_arr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+        # Convert the payload to an image
+        if isinstance(image_data, bytes):
+            img = decode_image_bytes(image_data)
+        else:
+            img = decode_base64_image(image_data)
         
         if img is None:
             return jsonify({"error": "Failed to decode image"}), 400
         
-        # Detect face in the image using MediaPipe with error handling
-        max_retries = 3
-        face_img = None
-        face_coords = None
-        
-        for attempt in range(max_retries):
+        # Multi-face mode: recognize every face in the frame at once
+        if param_flag(data, 'multiFace'):
             try:
-                face_img, face_coords = detect_and_crop_face_with_custom_handler(img)
-                if face_img is not None and face_img.size > 0:
-                    break  # Successfully detected face
-            except Exception as e:
-                # Log the error but continue to retry
-                print(f"Face detection attempt {attempt+1} failed: {str(e)}")
-                # Brief pause before retrying
-                time.sleep(0.1)
+                result = recognize_all_faces(img, matcher, gallery_version)
+                with time_stage('serialization'):
+                    return jsonify(result)
+            except InferenceQueueFull as e:
+                return jsonify({"error": str(e)}), 503
+        
+        # Detect face in the image using a pooled MediaPipe detector
+        # (a detector that fails is replaced by the pool and the detection retried once)
+        face_img, face_coords = detect_and_crop_face_with_custom_handler(img)
         
         if face_img is None or face_img.size == 0:
             return jsonify({"recognizedName": "Unknown", "similarity": 0, 
                            "message": "No face detected in the image",
                            "timestamp": datetime.now().isoformat()}), 200  # FIXED: Changed from datetime.datetime.now()
         
-        # Extract features using ResNet50
-        embedding = extract_resnet_features(face_img, resnet_feature_model)
+        # Extract features using ResNet50 (batched with concurrent requests)
+        try:
+            embedding = face_pipeline.embed([face_img])[0]
+        except InferenceQueueFull as e:
+            return jsonify({"error": str(e)}), 503
         
         # Compare with known faces
-        best_match = "Unknown"
-        best_similarity = 0
-        similarities = {}
+        best_match, best_similarity, similarities = face_pipeline.match_one(embedding, matcher)
         
-        for person_name, known_embeddings in processed_embeddings.items():
-            if not known_embeddings:
-                continue
-            
-            # Calculate cosine similarity with all known embeddings for this person
-            person_similarities = [1 - cosine(embedding, known_emb) for known_emb in known_embeddings]
-            avg_similarity = np.mean(person_similarities)
-            similarities[person_name] = avg_similarity
-            
-            # Update best match if this person is more similar
-            if avg_similarity > best_similarity and avg_similarity > SIMILARITY_THRESHOLD:
-                best_similarity = avg_similarity
-                best_match = person_name
-        
-        # Create response
+        # Create response; with the ANN index (galleries of ANN_MIN_GALLERY_SIZE embeddings and more)
+        # the similarity map only holds the candidate persons the index returned, not every person
         recognition_result = {
             "recognizedName": best_match,
             "similarity": float(best_similarity) if best_match != "Unknown" else 0,
-            "allSimilarities": {name: float(sim) for name, sim in similarities.items()},
+            "approximate": matcher.index is not None,
+            "galleryVersion": gallery_version,
             "timestamp": datetime.now().isoformat()  # FIXED: Changed from datetime.datetime.now()
         }
         
-        return jsonify(recognition_result)
+        # Clients that ask for it get the similarity map as packed indices and float32 scores
+        with time_stage('serialization'):
+            if SIMILARITY_MIME in request.headers.get('Accept', '') or data.get('responseFormat') == 'binary':
+                return app.response_class(
+                    encode_similarities_binary(recognition_result, matcher, similarities),
+                    mimetype=SIMILARITY_MIME
+                )
+            
+            recognition_result["allSimilarities"] = {name: float(sim) for name, sim in similarities.items()}
+            return jsonify(recognition_result)
     
     except Exception as e:
         print(f"Recognition error: {str(e)}")
@@ -442,77 +1334,341 @@ def recognize_face():
             "timestamp": datetime.now().isoformat()  # FIXED: Changed from datetime.datetime.now()
         }), 200  # Using 200 status so frontend continues to work
 
-# Add this new function that uses a custom InputStreamHandler
-def detect_and_crop_face_with_custom_handler(image):
-    # Create a MediaPipe face detection solution with custom config
-    mp_face_detection = mp.solutions.face_detection
-    
-    # Configure face detection with custom options
-    # Increase timeout_micros and configure for immediate input stream handling
-    with mp_face_detection.FaceDetection(
-        model_selection=1,  # 0 for short-range, 1 for full-range detection
-        min_detection_confidence=0.5,
-    ) as face_detection:
-        # Important: set the InputStreamHandler option (this is done through internal properties)
-        # Since we can't directly set this in the Python API, we need to handle errors
-        
-        # Convert the image to RGB (MediaPipe uses RGB)
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        
-        # Process the image - use non_blocking to avoid timestamp issues
-        # Perform detections with added robustness
-        results = face_detection.process(image_rgb)
-        
-        if results.detections:
-            # Get the first face detection (highest confidence)
-            detection = results.detections[0]
-            
-            # Get bounding box
-            bboxC = detection.location_data.relative_bounding_box
-            ih, iw, _ = image.shape
-            x = int(bboxC.xmin * iw)
-            y = int(bboxC.ymin * ih)
-            w = int(bboxC.width * iw)
-            h = int(bboxC.height * ih)
-            
-            # Adjust for out-of-bounds coordinates
-            x = max(0, x)
-            y = max(0, y)
-            w = min(w, iw - x)
-            h = min(h, ih - y)
-            
-            # Crop face
-            face_img = image[y:y+h, x:x+w]
-            
-            # Add padding around the face (20% each side)
-            padding_x = int(0.2 * w)
-            padding_y = int(0.2 * h)
-            
-            # Calculate new coordinates with padding
-            padded_x = max(0, x - padding_x)
-            padded_y = max(0, y - padding_y)
-            padded_w = min(iw - padded_x, w + 2 * padding_x)
-            padded_h = min(ih - padded_y, h + 2 * padding_y)
-            
-            # Crop padded face
-            padded_face = image[padded_y:padded_y+padded_h, padded_x:padded_x+padded_w]
-            
-            # Return the face image and coordinates
-            return padded_face, (padded_x, padded_y, padded_w, padded_h)
+# Function to fuse per-frame results into one decision; returns (name, similarity, confidence)
+def fuse_burst(matcher, embeddings, frame_names, frame_similarities, fusion):
+    if fusion == 'mean':
+        # Average the normalized embeddings and match the result once
+        normalized = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        name, similarity, _ = face_pipeline.match_one(normalized.mean(axis=0), matcher)
+        confidence = frame_names.count(name) / len(frame_names)
+        return name, similarity, confidence
+    
+    # Majority vote over the per-frame decisions (same rule as FaceTracker in test2.py)
+    most_common_name, count = Counter(frame_names).most_common(1)[0]
+    confidence = count / len(frame_names)
+    if most_common_name == "Unknown" or confidence < BURST_VOTE_CONFIDENCE:
+        return "Unknown", 0.0, confidence
+    similarity = float(np.mean([s for n, s in zip(frame_names, frame_similarities) if n == most_common_name]))
+    return most_common_name, similarity, confidence
+
+# Route to recognize one person from a burst of frames with server-side fusion
+@app.route('/api/recognize-burst', methods=['POST'])
+@limited_work
+def recognize_burst():
+    try:
+        # Frames come as base64 strings in JSON or as multipart 'frames' files
+        # (parameters then come from the form fields and the query string)
+        data = request_params()
+        if is_binary_request():
+            frames = read_binary_images('frames')
         else:
-            return None, None
+            frames = data.get('frames', [])
+        fusion = data.get('fusion', 'mean')
+        
+        if not frames:
+            return jsonify({"error": "No frames provided"}), 400
+        if len(frames) > BURST_MAX_FRAMES:
+            return jsonify({"error": f"Too many frames, at most {BURST_MAX_FRAMES} are allowed"}), 400
+        if fusion not in ('mean', 'vote'):
+            return jsonify({"error": "fusion must be 'mean' or 'vote'"}), 400
+        
+        matcher, gallery_version, error_response = resolve_matcher(data)
+        if error_response is not None:
+            return error_response
+        
+        if get_resnet_model() is None:
+            return jsonify({"error": "Failed to load ResNet50 model"}), 500
+        
+        # Decode every frame (a bad frame only fails itself), then detect and crop the faces
+        # of all decoded frames in one batch
+        decode_errors = {}
+        images = []
+        for i, frame_data in enumerate(frames):
+            try:
+                img = decode_image_bytes(frame_data) if isinstance(frame_data, bytes) else decode_base64_image(frame_data)
+            except Exception as e:
+                img = None
+                decode_errors[i] = f"Failed to decode image: {str(e)}"
+            images.append(img)
+        decoded = [i for i, img in enumerate(images) if img is not None]
+        face_imgs, owners = face_pipeline.detect_and_align(
+            [images[i] for i in decoded], max_faces=1, padding=FACE_BOX_PADDING, align=False
+        )
+        face_frame_indices = [decoded[frame_index] for frame_index, _, _ in owners]
+        boxes = {decoded[frame_index]: box for frame_index, box, _ in owners}
         
+        frame_results = []
+        for i, img in enumerate(images):
+            if i in boxes:
+                frame_results.append({"frameIndex": i, "faceDetected": True, "box": [int(v) for v in boxes[i]]})
+            else:
+                frame_results.append({
+                    "frameIndex": i,
+                    "faceDetected": False,
+                    "message": decode_errors.get(i, "Failed to decode image") if img is None else "No face detected in the image"
+                })
+        
+        if len(face_imgs) == 0:
+            return jsonify({
+                "recognizedName": "Unknown",
+                "similarity": 0,
+                "confidence": 0,
+                "framesWithFace": 0,
+                "frames": frame_results,
+                "message": "No face detected in any frame",
+                "galleryVersion": gallery_version,
+                "timestamp": datetime.now().isoformat()
+            }), 200
+        
+        # Embed all faces of the burst in one batch and score them in one matrix operation
+        try:
+            embeddings = face_pipeline.embed(face_imgs)
+        except InferenceQueueFull as e:
+            return jsonify({"error": str(e)}), 503
+        
+        frame_names, frame_similarities, _ = face_pipeline.match(embeddings, matcher)
+        for frame_index, name, similarity in zip(face_frame_indices, frame_names, frame_similarities):
+            frame_results[frame_index]["recognizedName"] = name
+            frame_results[frame_index]["similarity"] = float(similarity)
+        
+        best_match, best_similarity, confidence = fuse_burst(
+            matcher, embeddings, frame_names, frame_similarities, fusion
+        )
+        
+        return jsonify({
+            "recognizedName": best_match,
+            "similarity": float(best_similarity) if best_match != "Unknown" else 0,
+            "confidence": float(confidence),
+            "fusion": fusion,
+            "framesWithFace": len(face_imgs),
+            "frames": frame_results,
+            "galleryVersion": gallery_version,
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    except Exception as e:
+        print(f"Burst recognition error: {str(e)}")
+        return jsonify({
+            "recognizedName": "Unknown",
+            "similarity": 0,
+            "error": "Recognition error occurred",
+            "timestamp": datetime.now().isoformat()
+        }), 200
+
+# Function to detect every face in a frame; returns [(aligned FACE_SIZE crop, box, detection score)]
+def detect_and_crop_faces(image, max_faces=None):
+    crops, owners = face_pipeline.detect_and_align([image], max_faces=max_faces, padding=FACE_BOX_PADDING)
+    return [(crop, box, score) for crop, (_, box, score) in zip(crops, owners)]
+
+# Function to detect a face with a pooled detector and return it with 20% padding, cropped
+# (without rotation) and resized to FACE_SIZE in one warp
+def detect_and_crop_face_with_custom_handler(image):
+    # The pool hands this request a detector no other thread is using,
+    # so MediaPipe never sees interleaved timestamps from concurrent requests
+    crops, owners = face_pipeline.detect_and_align([image], max_faces=1, padding=FACE_BOX_PADDING, align=False)
+    if not owners:
+        return None, None
+    return crops[0], owners[0][1]
+
+# Function to recognize every face in a frame with one batched forward pass and one matrix match
+def recognize_all_faces(img, matcher, gallery_version):
+    faces = detect_and_crop_faces(img, MULTI_FACE_MAX_FACES)
+    
+    face_results = []
+    if faces:
+        embeddings = face_pipeline.embed([face_img for face_img, _, _ in faces])
+        names, best_similarities, _ = face_pipeline.match(embeddings, matcher)
+        for (_, box, score), name, similarity in zip(faces, names, best_similarities):
+            face_results.append({
+                "box": [int(v) for v in box],
+                "detectionScore": score,
+                "recognizedName": name,
+                "similarity": float(similarity) if name != "Unknown" else 0
+            })
+    
+    # Keep the single-face fields for existing clients: report the most similar recognized face
+    best = max(face_results, key=lambda f: f["similarity"], default=None)
+    return {
+        "recognizedName": best["recognizedName"] if best else "Unknown",
+        "similarity": best["similarity"] if best else 0,
+        "faceCount": len(face_results),
+        "faces": face_results,
+        "galleryVersion": gallery_version,
+        "timestamp": datetime.now().isoformat()
+    }
+        
+# Startup warm-up and readiness: the service is live as soon as it accepts requests, and ready
+# once the model, the detectors and the inference path are warm. Without a warm-up (lazy mode)
+# everything is loaded by the first request that needs it, as before, and the service reports
+# ready only once that request has loaded (and warmed up) the model.
+_readiness_lock = threading.Lock()
+_readiness = {
+    "state": "lazy",  # lazy, warming, ready or failed
+    "startedAt": None,
+    "finishedAt": None,
+    "warmUpSeconds": None,
+    "stages": {},
+    "error": None
+}
+
+# Function to get a snapshot of the readiness state
+def get_readiness():
+    with _readiness_lock:
+        readiness = dict(_readiness)
+        readiness["stages"] = dict(_readiness["stages"])
+        return readiness
+
+# Function to tell whether requests are served without cold-start delays
+def is_ready():
+    if _readiness["state"] == "lazy":
+        return _resnet_model is not None
+    return _readiness["state"] == "ready"
+
+# Function to load and warm up everything the first request would otherwise wait for
+def warm_up_service():
+    with _readiness_lock:
+        if _readiness["state"] in ("warming", "ready"):
+            return
+        _readiness.update(state="warming", startedAt=datetime.now().isoformat(), finishedAt=None, error=None, stages={})
+    
+    print("Warming up face recognition service...")
+    start_time = time.perf_counter()
+    stages = {}
+    try:
+        # Model: deserialise the .h5 file and run every traced batch size once
+        if get_resnet_model() is None:
+            raise RuntimeError("Failed to load ResNet50 model")
+        stages["modelLoadSeconds"] = _resnet_model_timings.get("loadSeconds")
+        stages["modelWarmUpSeconds"] = _resnet_model_timings.get("warmUpSeconds")
+        
+        # Detectors: run a detection on every pooled graph (broken ones are replaced)
+        stage_start = time.perf_counter()
+        detector_pool.check_health()
+        stages["detectorSeconds"] = time.perf_counter() - stage_start
+        
+        # Inference path: one full batch through the batcher thread, as a request would send it
+        stage_start = time.perf_counter()
+        blank_face = np.zeros((FACE_SIZE, FACE_SIZE, 3), dtype=np.uint8)
+        inference_batcher.embed_many([blank_face] * INFERENCE_MAX_BATCH_SIZE)
+        stages["inferencePathSeconds"] = time.perf_counter() - stage_start
+        
+        # Enrollment workers: start the processes and their detectors
+        stage_start = time.perf_counter()
+        enrollment_pipeline.warm_up()
+        stages["enrollmentWorkersSeconds"] = time.perf_counter() - stage_start
+        
+        warm_up_seconds = time.perf_counter() - start_time
+        with _readiness_lock:
+            _readiness.update(state="ready", finishedAt=datetime.now().isoformat(),
+                              warmUpSeconds=warm_up_seconds, stages=stages)
+        print(f"Face recognition service ready after {warm_up_seconds:.2f}s warm-up")
+    except Exception as e:
+        with _readiness_lock:
+            _readiness.update(state="failed", finishedAt=datetime.now().isoformat(),
+                              warmUpSeconds=time.perf_counter() - start_time, stages=stages, error=str(e))
+        print(f"Warm-up failed: {str(e)}")
+
+# Function to start the warm-up, in a background thread (the service stays live but not ready) or inline
+def start_warm_up(background=True):
+    if background:
+        threading.Thread(target=warm_up_service, name="warm-up", daemon=True).start()
+    else:
+        warm_up_service()
+
+# Route for liveness probes: the process is up and answering
+@app.route('/api/health/live', methods=['GET'])
+def liveness():
+    return jsonify({"live": True, "timestamp": datetime.now().isoformat()}), 200
+
+# Route for readiness probes: 503 until the warm-up has finished
+@app.route('/api/health/ready', methods=['GET'])
+def readiness():
+    state = get_readiness()
+    state["ready"] = is_ready()
+    return jsonify(state), 200 if state["ready"] else 503
+
+# Request latency per endpoint (streamed responses are timed until they start streaming)
+@app.before_request
+def start_request_timer():
+    g.request_start_time = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    start_time = g.get('request_start_time')
+    if start_time is not None:
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - start_time, endpoint=endpoint,
+                                method=request.method, status=response.status_code)
+    return response
+
+# Service state sampled whenever /api/metrics is scraped
+metrics_registry.gauge('facenroll_model_loaded', 'Whether the ResNet50 model is loaded (1) or not (0)',
+                       lambda: int(_resnet_model is not None))
+metrics_registry.gauge('facenroll_model_similarity_to_float', 'Mean cosine similarity of the quantized model to the float model',
+                       lambda: (getattr(_resnet_model, 'metadata', None) or {}).get("drift", {}).get("meanCosine"))
+metrics_registry.gauge('facenroll_ready', 'Whether the service is ready to serve without cold-start delays (1) or not (0)',
+                       lambda: int(is_ready()))
+metrics_registry.gauge('facenroll_warm_up_seconds', 'Duration of the startup warm-up',
+                       lambda: _readiness["warmUpSeconds"])
+metrics_registry.gauge('facenroll_inference_queue_depth', 'Face crops waiting for inference',
+                       lambda: inference_batcher.stats()["queueDepth"])
+metrics_registry.counter('facenroll_inference_rejected_total', 'Face crops rejected because the inference queue was full',
+                         lambda: inference_batcher.stats()["rejected"])
+metrics_registry.counter('facenroll_inference_errors_total', 'Inference batches that failed',
+                         lambda: inference_batcher.stats()["errors"])
+metrics_registry.gauge('facenroll_serving_in_flight', 'Requests whose work is running',
+                       lambda: work_limiter.stats()["inFlight"])
+metrics_registry.gauge('facenroll_serving_queued', 'Requests waiting for a work slot',
+                       lambda: work_limiter.stats()["queued"])
+metrics_registry.counter('facenroll_serving_rejected_total', 'Requests rejected with 429',
+                         lambda: work_limiter.stats()["rejected"])
+metrics_registry.gauge('facenroll_detector_pool_idle', 'Face detectors not in use',
+                       lambda: detector_pool.stats()["idle"])
+metrics_registry.counter('facenroll_detector_failures_total', 'Face detector calls that failed',
+                         lambda: detector_pool.stats()["failures"])
+metrics_registry.gauge('facenroll_gallery_persons', 'Persons in the resident gallery',
+                       lambda: len(get_gallery()["matcher"]))
+metrics_registry.gauge('facenroll_gallery_embeddings', 'Embeddings in the resident gallery',
+                       lambda: get_gallery()["matcher"].size)
+metrics_registry.counter('facenroll_embedding_cache_lookups_total', 'Embedding cache lookups by result',
+                         lambda: {('hit',): _embedding_cache.hits, ('miss',): _embedding_cache.misses}
+                         if _embedding_cache is not None else None, ['result'])
+metrics_registry.counter('facenroll_enrollment_images_total', 'Images through the enrollment pipeline by outcome',
+                         lambda: {(outcome,): count for outcome, count in enrollment_pipeline.stats()["outcomes"].items()},
+                         ['outcome'])
+
+# Route exposing the metrics in the Prometheus text format
+@app.route('/api/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics_registry.render(), mimetype=PROMETHEUS_MIME)
+
 # Add this route to your Python Flask app (assuming you're using Flask)
 
 @app.route('/api/status', methods=['GET'])
 def status():
     """Simple endpoint to check if the recognition service is up and running"""
+    ready = is_ready()
     return jsonify({
         'status': 'online',
-        'message': 'Face recognition service is operational',
+        'live': True,
+        'ready': ready,
+        'message': 'Face recognition service is operational' if ready else 'Face recognition service is warming up',
+        'readiness': get_readiness(),
+        'model': describe_model(),
+        'detectorPool': detector_pool.stats(),
+        'inference': inference_batcher.stats(),
+        'serving': work_limiter.stats(),
+        'enrollmentPipeline': enrollment_pipeline.stats(),
+        'galleryStore': gallery_store.stats() if gallery_store is not None else None,
+        'workerPid': os.getpid(),
+        'inferenceThreads': INFERENCE_THREADS,
+        'embeddingProjection': embedding_projection.describe() if embedding_projection is not None else None,
+        'embeddingCache': _embedding_cache.stats() if _embedding_cache is not None else None,
         'timestamp': datetime.now().isoformat()  # FIXED: Changed from datetime.datetime.now()
     }), 200
 
+if EAGER_STARTUP and SERVICE_PROCESS:
+    start_warm_up(background=True)
 
 if __name__ == "__main__":
     app.run(debug=True, port=5001)
\ No newline at end of file
@@ -0,0 +1,149 @@
+import queue
+import threading
+import numpy as np
+import mediapipe as mp
+
+
+# Function to create a MediaPipe face detector with the settings used across the project
+def create_face_detector(model_selection=1, min_detection_confidence=0.5):
+    return mp.solutions.face_detection.FaceDetection(
+        model_selection=model_selection,  # 0=closer faces, 1=longer distance faces
+        min_detection_confidence=min_detection_confidence
+    )
+
+
+class DetectorPool:
+    """
+    Thread-safe pool of pre-initialised MediaPipe face detectors.
+
+    A MediaPipe graph must not be used by two threads at once, and building a
+    new one costs tens of milliseconds. Requests check a detector out, use it
+    exclusively and return it. A detector that throws is closed and replaced
+    by a freshly built, health-checked one, and the call is retried once.
+    """
+
+    def __init__(self, size=2, factory=create_face_detector, checkout_timeout=5.0):
+        self.size = size
+        self.factory = factory
+        self.checkout_timeout = checkout_timeout
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self.replaced = 0
+        self.failures = 0
+        self._missing = 0  # Detectors that could not be replaced yet
+
+        for _ in range(size):
+            self._idle.put(self._create_healthy())
+
+    # Function to check that a detector can still run a graph end to end
+    @staticmethod
+    def is_healthy(detector):
+        try:
+            detector.process(np.zeros((64, 64, 3), dtype=np.uint8))
+            return True
+        except Exception:
+            return False
+
+    def _create_healthy(self, attempts=3):
+        last_error = None
+        for _ in range(attempts):
+            detector = self.factory()
+            if self.is_healthy(detector):
+                return detector
+            last_error = RuntimeError("Newly created face detector failed its health check")
+            self._close(detector)
+        raise last_error
+
+    @staticmethod
+    def _close(detector):
+        try:
+            detector.close()
+        except Exception:
+            pass
+
+    def _checkout(self):
+        # Rebuild detectors whose earlier replacement failed before waiting on the queue
+        with self._lock:
+            rebuild = self._missing > 0
+            if rebuild:
+                self._missing -= 1
+        if rebuild:
+            try:
+                return self._create_healthy()
+            except Exception:
+                with self._lock:
+                    self._missing += 1
+
+        try:
+            return self._idle.get(timeout=self.checkout_timeout)
+        except queue.Empty:
+            raise TimeoutError("No face detector became available in time")
+
+    # Close a broken detector and build a new one; returns None when that fails
+    def _replace(self, detector):
+        self._close(detector)
+        try:
+            new_detector = self._create_healthy()
+        except Exception as e:
+            print(f"Could not replace face detector: {str(e)}")
+            with self._lock:
+                self._missing += 1
+            return None
+        with self._lock:
+            self.replaced += 1
+        return new_detector
+
+    # Run detection on an RGB image using a pooled detector
+    def process(self, rgb_image):
+        detector = self._checkout()
+        try:
+            try:
+                return detector.process(rgb_image)
+            except Exception as e:
+                # The graph is in an unknown state (e.g. timestamp mismatch): swap it for a fresh one and retry once
+                with self._lock:
+                    self.failures += 1
+                print(f"Face detector failed, replacing it: {str(e)}")
+                detector = self._replace(detector)
+                if detector is None:
+                    raise
+                return detector.process(rgb_image)
+        finally:
+            if detector is not None:
+                self._idle.put(detector)
+
+    # Health-check every idle detector and replace the broken ones; returns how many were replaced
+    def check_health(self):
+        replaced = 0
+        checked = []
+        while True:
+            try:
+                checked.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            for i, detector in enumerate(checked):
+                if not self.is_healthy(detector):
+                    checked[i] = self._replace(detector)
+                    replaced += 1
+        finally:
+            for detector in checked:
+                if detector is not None:
+                    self._idle.put(detector)
+        return replaced
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "idle": self._idle.qsize(),
+            "missing": self._missing,
+            "failures": self.failures,
+            "replaced": self.replaced
+        }
+
+    def close(self):
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                break
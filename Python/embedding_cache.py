@@ -0,0 +1,103 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+
+
+# Function to hash raw image bytes; the hash is the cache key for that image's embedding
+def image_content_hash(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+# Function to fingerprint a model file by content, so a retrained model never reuses old embeddings
+def model_file_version(model_path, pipeline_version=1):
+    digest = hashlib.sha256()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return f"{digest.hexdigest()[:16]}-p{pipeline_version}"
+
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed cache of face embeddings.
+
+    Entries are keyed by the SHA-256 of the encoded image bytes plus the model
+    version, so an unchanged picture is never sent through detection and
+    ResNet50 again, while a new model version automatically misses. Images in
+    which no face was found are cached too (as an entry without embedding).
+
+    The database is shared by every worker process of serve.py: it runs in WAL
+    mode, so readers never wait for a writer, and a writer waits up to
+    `busy_timeout` seconds for another one instead of failing.
+    """
+
+    def __init__(self, path, model_version, busy_timeout=5.0):
+        self.path = path
+        self.model_version = model_version
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(f"PRAGMA busy_timeout = {int(busy_timeout * 1000)}")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " image_hash TEXT NOT NULL,"
+            " model_version TEXT NOT NULL,"
+            " embedding BLOB,"
+            " created REAL NOT NULL,"
+            " PRIMARY KEY (image_hash, model_version))"
+        )
+        self._connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    # Look up an image; returns (found, embedding) where embedding is None for "no face detected"
+    def get(self, image_hash):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT embedding FROM embeddings WHERE image_hash = ? AND model_version = ?",
+                (image_hash, self.model_version)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+        return True, None if row[0] is None else np.frombuffer(row[0], dtype=np.float32)
+
+    # Store the embedding of an image (None records that no face was detected)
+    def put(self, image_hash, embedding):
+        blob = None if embedding is None else np.asarray(embedding, dtype=np.float32).tobytes()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO embeddings (image_hash, model_version, embedding, created) VALUES (?, ?, ?, ?)",
+                (image_hash, self.model_version, blob, time.time())
+            )
+            self._connection.commit()
+
+    # Drop entries computed with other model versions
+    def prune(self):
+        with self._lock:
+            deleted = self._connection.execute(
+                "DELETE FROM embeddings WHERE model_version != ?", (self.model_version,)
+            ).rowcount
+            self._connection.commit()
+        return deleted
+
+    def stats(self):
+        with self._lock:
+            entries = self._connection.execute(
+                "SELECT COUNT(*) FROM embeddings WHERE model_version = ?", (self.model_version,)
+            ).fetchone()[0]
+        return {
+            "path": os.path.abspath(self.path),
+            "modelVersion": self.model_version,
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
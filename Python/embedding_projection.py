@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+from face_matching import l2_normalize
+
+
+class EmbeddingProjection:
+    """
+    Learned linear projection that shrinks embeddings before storage and matching.
+
+    Fitted with PCA on L2-normalized model embeddings (e.g. the 512-d output
+    of the ResNet50 head): vectors are centred on the fitted mean, projected
+    on the top `dim` principal components and L2-normalized again, so cosine
+    matching works unchanged on the smaller vectors. With whitening every
+    component is also scaled to unit variance, which spreads identities more
+    evenly but amplifies the noise in weak components.
+
+    The projection's version is a hash of its parameters and its similarity
+    threshold, so refitting either gives a new version. A gallery store
+    keeps a copy of the projection its rows were made with (see
+    gallery_store.py), so a gallery is never matched through another one.
+
+    Projected vectors score on another scale than model embeddings, so
+    fit_projection.py stores the similarity threshold that best separated
+    genuine from impostor pairs in the projected space in the metadata
+    ("similarityThreshold").
+    """
+
+    def __init__(self, mean, components, whiten=False, explained_variance=None, metadata=None):
+        self.mean = np.ascontiguousarray(mean, dtype=np.float32)
+        self.components = np.ascontiguousarray(components, dtype=np.float32)  # (input_dim, dim)
+        self.whiten = bool(whiten)
+        self.explained_variance = float(explained_variance) if explained_variance is not None else None
+        self.metadata = metadata or {}
+        digest = hashlib.sha1(self.mean.tobytes() + self.components.tobytes() + bytes([self.whiten]))
+        if self.similarity_threshold is not None:
+            # Matching results depend on the threshold too (left out without one, so older files keep their version)
+            digest.update(repr(self.similarity_threshold).encode('utf-8'))
+        self.version = f"pca{self.dim}-{digest.hexdigest()[:12]}"
+
+    @property
+    def input_dim(self):
+        return self.components.shape[0]
+
+    @property
+    def dim(self):
+        return self.components.shape[1]
+
+    # Similarity threshold fitted for the projected space (None for projections saved without one)
+    @property
+    def similarity_threshold(self):
+        threshold = self.metadata.get("similarityThreshold")
+        return float(threshold) if threshold is not None else None
+
+    # Fit a projection to `dim` dimensions on model embeddings of shape (N, input_dim)
+    @classmethod
+    def fit(cls, embeddings, dim, whiten=False, metadata=None):
+        vectors = l2_normalize(np.asarray(embeddings, dtype=np.float32))
+        if vectors.ndim != 2 or not 0 < dim < vectors.shape[1]:
+            raise ValueError(f"Projection dimension must be between 1 and {vectors.shape[1] - 1}, got {dim}")
+        if len(vectors) <= dim:
+            raise ValueError(f"Fitting {dim} dimensions needs more than {dim} embeddings, got {len(vectors)}")
+
+        mean = vectors.mean(axis=0)
+        _, singular_values, vt = np.linalg.svd(vectors - mean, full_matrices=False)
+        variances = singular_values ** 2 / (len(vectors) - 1)
+        components = vt[:dim].T
+        if whiten:
+            components = components / np.sqrt(variances[:dim] + 1e-6)
+        explained = variances[:dim].sum() / max(variances.sum(), 1e-12)
+        return cls(mean, components, whiten, explained, metadata)
+
+    # Project model embeddings into the gallery space; returns L2-normalized float32 rows
+    def project(self, vectors):
+        vectors = l2_normalize(np.atleast_2d(vectors))
+        return l2_normalize((vectors - self.mean) @ self.components)
+
+    # Bring stored rows into the gallery space: model embeddings are projected, rows that
+    # already have the projected size (e.g. from a gallery file exported by a projected
+    # gallery) are only normalized
+    def project_rows(self, rows):
+        rows = np.asarray(rows, dtype=np.float32)
+        if rows.shape[1] == self.input_dim:
+            return self.project(rows)
+        if rows.shape[1] == self.dim:
+            return l2_normalize(rows)
+        raise ValueError(f"Embedding dimension {rows.shape[1]} matches neither the model ({self.input_dim}) "
+                         f"nor the projection ({self.dim})")
+
+    # Write the projection to an .npz file (atomically)
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, mean=self.mean, components=self.components, whiten=np.array(self.whiten),
+                 explained_variance=np.array(np.nan if self.explained_variance is None else self.explained_variance),
+                 metadata=np.array(json.dumps(self.metadata)))
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            explained = float(data["explained_variance"])
+            return cls(data["mean"], data["components"], bool(data["whiten"]),
+                       None if np.isnan(explained) else explained, json.loads(str(data["metadata"])))
+
+    def describe(self):
+        return {
+            "version": self.version,
+            "inputDim": self.input_dim,
+            "dim": self.dim,
+            "whiten": self.whiten,
+            "explainedVariance": self.explained_variance,
+            "similarityThreshold": self.similarity_threshold
+        }
@@ -0,0 +1,513 @@
+import argparse
+import base64
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+import urllib.error
+import urllib.request
+import zipfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import cv2
+import numpy as np
+
+from ann_benchmark import make_synthetic_gallery
+from gallery_format import GALLERY_MIME, encode_gallery, gallery_from_dict
+
+# Configuration
+RESULTS_DIR = 'validation_results'
+FACES_ZIP = 'faces.zip'
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+ENDPOINTS = {
+    'validate': '/api/validate-faces',
+    'recognize': '/api/recognize-face',
+    'enroll': '/api/process-images'
+}
+# Metrics compared by --compare: (label, getter, True when higher is better)
+COMPARED_METRICS = [
+    ('throughput rps', lambda r: r["throughputRps"], True),
+    ('p50 ms', lambda r: r["latencyMs"]["p50"], False),
+    ('p95 ms', lambda r: r["latencyMs"]["p95"], False),
+    ('p99 ms', lambda r: r["latencyMs"]["p99"], False)
+]
+
+
+# Function to load sample face photos from the faces archive as BGR arrays
+def load_sample_faces(zip_path):
+    faces = []
+    if not os.path.exists(zip_path):
+        return faces
+    with zipfile.ZipFile(zip_path) as archive:
+        for name in sorted(archive.namelist()):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                img = cv2.imdecode(np.frombuffer(archive.read(name), np.uint8), cv2.IMREAD_COLOR)
+                if img is not None:
+                    faces.append(img)
+    return faces
+
+
+# Function to draw a simple synthetic face (skin-coloured oval with eyes, brows, nose and mouth)
+def draw_synthetic_face(rng, size):
+    img = np.full((size, size, 3), rng.integers(90, 200, 3), dtype=np.uint8)
+    cx, cy = size // 2 + int(rng.integers(-size // 16, size // 16)), size // 2
+    fw, fh = int(size * rng.uniform(0.22, 0.28)), int(size * rng.uniform(0.30, 0.36))
+    skin = tuple(int(c) for c in rng.integers([60, 110, 150], [120, 170, 230]))
+    cv2.ellipse(img, (cx, cy), (fw, fh), 0, 0, 360, skin, -1)
+    eye_y, eye_dx = cy - fh // 4, fw // 2
+    for side in (-1, 1):
+        cv2.ellipse(img, (cx + side * eye_dx, eye_y), (fw // 5, fh // 12), 0, 0, 360, (255, 255, 255), -1)
+        cv2.circle(img, (cx + side * eye_dx, eye_y), fh // 16, (40, 30, 20), -1)
+        cv2.line(img, (cx + side * eye_dx - fw // 5, eye_y - fh // 6), (cx + side * eye_dx + fw // 5, eye_y - fh // 6), (30, 30, 40), 3)
+    cv2.line(img, (cx, eye_y + fh // 10), (cx, cy + fh // 6), tuple(int(c * 0.8) for c in skin), 3)
+    cv2.ellipse(img, (cx, cy + fh // 2 - fh // 8), (fw // 3, fh // 12), 0, 0, 180, (60, 60, 150), 3)
+    return img
+
+
+# Function to make one synthetic face image: a sample photo (or a drawn face) with random
+# scale, flip, rotation and lighting; returns JPEG bytes
+def make_face_image(rng, sample_faces, size, quality):
+    if sample_faces:
+        img = sample_faces[int(rng.integers(len(sample_faces)))]
+        scale = size / max(img.shape[:2]) * rng.uniform(0.85, 1.0)
+        img = cv2.resize(img, (max(1, int(img.shape[1] * scale)), max(1, int(img.shape[0] * scale))))
+    else:
+        img = draw_synthetic_face(rng, size)
+    if rng.random() < 0.5:
+        img = cv2.flip(img, 1)
+    h, w = img.shape[:2]
+    rotation = cv2.getRotationMatrix2D((w / 2, h / 2), rng.uniform(-8, 8), 1.0)
+    img = cv2.warpAffine(img, rotation, (w, h), borderMode=cv2.BORDER_REFLECT)
+    img = cv2.convertScaleAbs(img, alpha=rng.uniform(0.8, 1.2), beta=rng.uniform(-20, 20))
+    ok, encoded = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return encoded.tobytes()
+
+
+def to_base64(image_bytes):
+    return 'data:image/jpeg;base64,' + base64.b64encode(image_bytes).decode('ascii')
+
+
+# Function to build the request payloads for each endpoint; a payload is (kind, body)
+# where kind is 'json', 'multipart' ([(field, filename, bytes)]) or 'image' (raw JPEG body)
+def build_payloads(endpoint, images, args):
+    payloads = []
+    for i in range(args.distinct_payloads):
+        pick = [images[(i * 7 + j) % len(images)] for j in range(max(args.validate_images, args.enroll_persons * args.enroll_images))]
+        if endpoint == 'recognize':
+            image_bytes = pick[0]
+            if args.transport == 'binary':
+                payloads.append(('image', image_bytes))
+            else:
+                payloads.append(('json', {"image": to_base64(image_bytes)}))
+        elif endpoint == 'validate':
+            poses = pick[:args.validate_images]
+            if args.transport == 'binary':
+                payloads.append(('multipart', [('images', f"pose{j}.jpg", b) for j, b in enumerate(poses)]))
+            else:
+                payloads.append(('json', {"images": [to_base64(b) for b in poses]}))
+        else:
+            # The same benchmark persons are re-enrolled by every request, so the gallery size stays constant
+            files = [(f"bench_enroll_{p}", f"bench_{i}_{p}_{j}.jpg", pick[p * args.enroll_images + j])
+                     for p in range(args.enroll_persons) for j in range(args.enroll_images)]
+            if args.transport == 'binary':
+                payloads.append(('multipart', files))
+            else:
+                payloads.append(('json', {"images": [{"personName": person, "imageName": name, "imageData": to_base64(b)}
+                                                     for person, name, b in files]}))
+    return payloads
+
+
+# Function to encode multipart/form-data for the HTTP client; returns (body, content type)
+def encode_multipart(files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for field, filename, data in files:
+        parts.append(f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field}\"; filename=\"{filename}\"\r\n"
+                     f"Content-Type: image/jpeg\r\n\r\n".encode('utf-8'))
+        parts.append(data)
+        parts.append(b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode('utf-8'))
+    return b''.join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+class InProcessClient:
+    """Sends requests through the Flask test client (one client per thread)."""
+
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self._local = threading.local()
+
+    def _client(self):
+        if not hasattr(self._local, 'client'):
+            self._local.client = self.app.test_client()
+        return self._local.client
+
+    def post(self, path, payload):
+        kind, body = payload
+        if kind == 'json':
+            response = self._client().post(path, json=body)
+        elif kind == 'image':
+            response = self._client().post(path, data=body, content_type='image/jpeg')
+        else:
+            data = {}
+            for field, filename, file_bytes in body:
+                data.setdefault(field, []).append((io.BytesIO(file_bytes), filename))
+            response = self._client().post(path, data=data, content_type='multipart/form-data')
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpClient:
+    """Sends requests to a running service over HTTP."""
+
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def request(self, method, path, body=None, content_type=None):
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        if content_type:
+            req.add_header('Content-Type', content_type)
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def post(self, path, payload):
+        kind, body = payload
+        if kind == 'json':
+            status, data = self.request('POST', path, json.dumps(body).encode('utf-8'), 'application/json')
+        elif kind == 'image':
+            status, data = self.request('POST', path, body, 'image/jpeg')
+        else:
+            status, data = self.request('POST', path, *encode_multipart(body))
+        try:
+            return status, json.loads(data)
+        except ValueError:
+            return status, None
+
+    # Read the stage histogram sums and counts from /api/metrics; returns {stage: (count, sum)}
+    def stage_totals(self):
+        status, data = self.request('GET', '/api/metrics')
+        totals = {}
+        if status != 200:
+            return totals
+        for line in data.decode('utf-8').splitlines():
+            for suffix, position in (('_count', 0), ('_sum', 1)):
+                prefix = f"facenroll_stage_seconds{suffix}{{stage=\""
+                if line.startswith(prefix):
+                    stage, value = line[len(prefix):].split('"} ')
+                    totals.setdefault(stage, [0, 0.0])[position] = float(value)
+        return totals
+
+
+# Function to classify the failure messages of one response (per image or per pose): rejected when
+# the inference queue was full, unreadable, noFace or invalidFace (a face that failed a quality
+# check) when every message says so, otherwise error
+def classify_messages(messages):
+    if not messages:
+        return 'ok'
+    if any('queue is full' in message for message in messages):
+        return 'rejected'
+    for outcome, prefixes in (('unreadable', ('Failed to decode image', 'Could not read image')),
+                              ('noFace', ('No face detected',)),
+                              ('invalidFace', ('Multiple faces detected', 'Face is too', 'Face detection confidence'))):
+        if all(message.startswith(prefixes) for message in messages):
+            return outcome
+    return 'error'
+
+
+# Function to classify one response: ok, noFace, invalidFace, unreadable, rejected (429/503 or a
+# full inference queue) or error
+def classify(endpoint, status, body, images_per_request=1):
+    if status in (429, 503):
+        return 'rejected'
+    if status != 200 or body is None or (isinstance(body, dict) and body.get('error')):
+        return 'error'
+    if endpoint == 'recognize':
+        return classify_messages([body['message']] if body.get('message') else [])
+    if endpoint == 'validate':
+        return classify_messages([result.get('errorMessage') or '' for result in body if not result.get('isValid')])
+    # Enrollment only reports failures in `errors`; images without a usable face just yield no embedding
+    outcome = classify_messages([error.get('error') or '' for error in body.get('errors', [])])
+    if outcome == 'ok' and sum(len(rows) for rows in body.get('embeddings', {}).values()) < images_per_request:
+        return 'noFace'
+    return outcome
+
+
+def percentiles_ms(seconds):
+    if not seconds:
+        return {"mean": None, "p50": None, "p95": None, "p99": None, "max": None}
+    values = np.asarray(seconds) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"mean": float(values.mean()), "p50": float(p50), "p95": float(p95), "p99": float(p99), "max": float(values.max())}
+
+
+# Function to drive one endpoint: warm-up requests first, then the measured requests from
+# `concurrency` threads; per-stage timings are collected while the measured requests run
+def run_endpoint(endpoint, client, payloads, args, stage_recorder):
+    path = ENDPOINTS[endpoint]
+    images_per_request = {'recognize': 1, 'validate': args.validate_images,
+                          'enroll': args.enroll_persons * args.enroll_images}[endpoint]
+    for i in range(args.warmup):
+        client.post(path, payloads[i % len(payloads)])
+
+    def one(i):
+        start_time = time.perf_counter()
+        status, body = client.post(path, payloads[i % len(payloads)])
+        return time.perf_counter() - start_time, classify(endpoint, status, body, images_per_request)
+
+    stage_recorder.start()
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(one, range(args.requests)))
+    wall_seconds = time.perf_counter() - start_time
+    stages = stage_recorder.stop()
+
+    latencies = [seconds for seconds, _ in results]
+    return {
+        "path": path,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "imagesPerRequest": images_per_request,
+        "wallSeconds": wall_seconds,
+        "throughputRps": args.requests / wall_seconds,
+        "imagesPerSecond": args.requests * images_per_request / wall_seconds,
+        "latencyMs": percentiles_ms(latencies),
+        "outcomes": dict(Counter(outcome for _, outcome in results)),
+        "stages": stages
+    }
+
+
+class InProcessStageRecorder:
+    """Collects every raw stage observation of the service's stage histogram."""
+
+    def __init__(self, histogram, requests):
+        self.histogram = histogram
+        self.requests = requests
+        self._samples = None
+        self._remove = None
+
+    def start(self):
+        self._samples = []
+        self._remove = self.histogram.add_observer(lambda value, labels: self._samples.append((labels.get('stage'), value)))
+
+    def stop(self):
+        self._remove()
+        by_stage = {}
+        for stage, value in self._samples:
+            by_stage.setdefault(stage, []).append(value)
+        stages = {}
+        for stage, values in sorted(by_stage.items()):
+            summary = percentiles_ms(values)
+            stages[stage] = {
+                "count": len(values),
+                "perRequest": len(values) / self.requests,
+                "meanMs": summary["mean"],
+                "p50Ms": summary["p50"],
+                "p95Ms": summary["p95"],
+                "p99Ms": summary["p99"]
+            }
+        return stages
+
+
+class HttpStageRecorder:
+    """Derives per-stage counts and means from /api/metrics scraped before and after a run."""
+
+    def __init__(self, client, requests):
+        self.client = client
+        self.requests = requests
+        self._before = None
+
+    def start(self):
+        self._before = self.client.stage_totals()
+
+    def stop(self):
+        stages = {}
+        for stage, (count, total) in sorted(self.client.stage_totals().items()):
+            before_count, before_total = self._before.get(stage, (0, 0.0))
+            count -= before_count
+            if count > 0:
+                stages[stage] = {
+                    "count": int(count),
+                    "perRequest": count / self.requests,
+                    "meanMs": (total - before_total) / count * 1000
+                }
+        return stages
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+# Function to print the change of each endpoint's headline metrics against an earlier results file
+def compare_results(previous, current, threshold):
+    print(f"\nComparison with {previous.get('commit') or 'unknown commit'} ({previous.get('createdAt')}):")
+    regressions = 0
+    for endpoint, result in current["endpoints"].items():
+        old = previous.get("endpoints", {}).get(endpoint)
+        if old is None:
+            continue
+        for label, getter, higher_is_better in COMPARED_METRICS:
+            before, after = getter(old), getter(result)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            worse = change < -threshold if higher_is_better else change > threshold
+            regressions += int(worse)
+            print(f"  {endpoint:>10} {label:>14}: {before:10.2f} -> {after:10.2f} ({change * 100:+6.1f}%)"
+                  f"{'  REGRESSION' if worse else ''}")
+    print(f"{regressions} regression(s) beyond {threshold * 100:.0f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput and latency percentiles of the face service endpoints")
+    parser.add_argument('--url', help="Benchmark a running service (e.g. http://localhost:5001); "
+                                      "by default the app is driven in-process through the Flask test client")
+    parser.add_argument('--allow-writes', action='store_true',
+                        help="With --url: allow loading the synthetic gallery and enrolling the bench_enroll_* persons "
+                             "(deleted again at the end) in the running service")
+    parser.add_argument('--endpoints', nargs='+', default=list(ENDPOINTS), choices=list(ENDPOINTS))
+    parser.add_argument('--requests', type=int, default=200, help="Measured requests per endpoint")
+    parser.add_argument('--warmup', type=int, default=10, help="Unmeasured requests per endpoint before measuring")
+    parser.add_argument('--concurrency', type=int, default=4, help="Requests in flight at the same time")
+    parser.add_argument('--transport', default='json', choices=['json', 'binary'],
+                        help="Base64 JSON bodies or binary uploads (multipart / raw image/jpeg)")
+    parser.add_argument('--identities', type=int, default=1000, help="Persons in the synthetic gallery")
+    parser.add_argument('--images-per-identity', type=int, default=5)
+    parser.add_argument('--noise', type=float, default=1.0, help="Per-embedding noise norm relative to the identity vector")
+    parser.add_argument('--dim', type=int, help="Embedding dimension of the synthetic gallery (default: the model's output)")
+    parser.add_argument('--no-gallery', action='store_true', help="Keep the service's gallery instead of loading a synthetic one "
+                                                                  "(with --url the synthetic gallery replaces the server's gallery)")
+    parser.add_argument('--faces-zip', default=FACES_ZIP, help="Sample photos the synthetic images are made from; "
+                                                               "drawn faces are used when the archive is missing")
+    parser.add_argument('--image-size', type=int, default=640, help="Longest side of the synthetic images")
+    parser.add_argument('--jpeg-quality', type=int, default=90)
+    parser.add_argument('--distinct-payloads', type=int, default=16, help="Different request bodies cycled through per endpoint")
+    parser.add_argument('--validate-images', type=int, default=5, help="Poses per /api/validate-faces request")
+    parser.add_argument('--enroll-persons', type=int, default=2, help="Persons per /api/process-images request")
+    parser.add_argument('--enroll-images', type=int, default=5, help="Images per person per /api/process-images request")
+    parser.add_argument('--cache', action='store_true', help="Leave the embedding cache on for /api/process-images (in-process only)")
+    parser.add_argument('--timeout', type=float, default=120, help="HTTP request timeout in seconds")
+    parser.add_argument('--output', help="Results file (default: validation_results/benchmark_<timestamp>.json)")
+    parser.add_argument('--compare', help="Earlier results file to compare against")
+    parser.add_argument('--regression-threshold', type=float, default=0.10, help="Relative change reported as a regression")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if args.url and not args.allow_writes:
+        writes = (["replaces its gallery"] if not args.no_gallery else []) + \
+                 (["enrolls bench_enroll_* persons"] if 'enroll' in args.endpoints else [])
+        if writes:
+            parser.error(f"Benchmarking a running service {' and '.join(writes)}; pass --allow-writes, "
+                         f"or --no-gallery and --endpoints without enroll")
+
+    rng = np.random.default_rng(args.seed)
+    sample_faces = load_sample_faces(args.faces_zip)
+    print(f"Generating synthetic images from {len(sample_faces)} sample photos" if sample_faces
+          else "Generating synthetic drawn faces (no sample photos found)")
+    images = [make_face_image(rng, sample_faces, args.image_size, args.jpeg_quality) for _ in range(64)]
+
+    work_dir = tempfile.TemporaryDirectory(prefix='facenroll-benchmark-')
+    gallery_info = None
+    if args.url:
+        client = HttpClient(args.url, args.timeout)
+        stage_recorder_factory = lambda: HttpStageRecorder(client, args.requests)
+        if not args.no_gallery:
+            if not args.dim:
+                parser.error("--dim is required to load a synthetic gallery into a running service")
+            gallery, _ = make_synthetic_gallery(args.identities, args.images_per_identity, args.noise, rng, dim=args.dim)
+            names, counts, vectors = gallery_from_dict(gallery)
+            status, body = client.request('PUT', f'/api/gallery?version=benchmark-{args.identities}',
+                                          encode_gallery(names, counts, vectors, dtype='float32'), GALLERY_MIME)
+            if status != 200:
+                parser.error(f"Loading the synthetic gallery failed ({status}): {body[:200]!r}")
+            gallery_info = json.loads(body)
+    else:
+        # Keep the benchmark's galleries, enrollments and cache out of the service's own files: the
+        # data directory must be set before the import, which already opens and loads the gallery
+        os.environ['FACENROLL_DATA_DIR'] = work_dir.name
+        import app as face_service
+
+        face_service.EMBEDDING_CACHE_ENABLED = args.cache
+        face_service.SAVE_EMBEDDINGS_FILE = False
+
+        start_time = time.perf_counter()
+        face_service.start_warm_up(background=False)
+        if not face_service.is_ready():
+            raise SystemExit(f"Warm-up failed: {face_service.get_readiness().get('error')}")
+        print(f"Service warmed up in {time.perf_counter() - start_time:.2f}s")
+
+        if not args.no_gallery:
+            dim = args.dim or face_service.get_resnet_model().output_dim
+            gallery, _ = make_synthetic_gallery(args.identities, args.images_per_identity, args.noise, rng, dim=dim)
+            start_time = time.perf_counter()
+            face_service.set_gallery(gallery, f"benchmark-{args.identities}")
+            print(f"Loaded synthetic gallery in {time.perf_counter() - start_time:.2f}s")
+        gallery_info = face_service.describe_gallery(face_service.get_gallery())
+
+        client = InProcessClient(face_service.app)
+        stage_recorder_factory = lambda: InProcessStageRecorder(face_service.STAGE_SECONDS, args.requests)
+
+    if gallery_info is not None:
+        print(f"Gallery: {gallery_info['persons']} persons, {gallery_info['embeddings']} embeddings"
+              f"{' (ANN index)' if gallery_info.get('annIndex') else ''}")
+
+    commit, dirty = git_commit()
+    results = {
+        "createdAt": datetime.now().isoformat(),
+        "commit": commit,
+        "dirty": dirty,
+        "mode": 'http' if args.url else 'in-process',
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpuCount": os.cpu_count()},
+        "config": vars(args),
+        "gallery": gallery_info,
+        "endpoints": {}
+    }
+
+    for endpoint in args.endpoints:
+        payloads = build_payloads(endpoint, images, args)
+        print(f"\nBenchmarking {ENDPOINTS[endpoint]} ({args.requests} requests, concurrency {args.concurrency})...")
+        result = run_endpoint(endpoint, client, payloads, args, stage_recorder_factory())
+        results["endpoints"][endpoint] = result
+        latency = result["latencyMs"]
+        print(f"  {result['throughputRps']:.1f} req/s ({result['imagesPerSecond']:.1f} images/s), "
+              f"p50 {latency['p50']:.1f} ms, p95 {latency['p95']:.1f} ms, p99 {latency['p99']:.1f} ms, "
+              f"outcomes {result['outcomes']}")
+        for stage, summary in result["stages"].items():
+            percentiles = (f", p50 {summary['p50Ms']:.2f} ms, p95 {summary['p95Ms']:.2f} ms, p99 {summary['p99Ms']:.2f} ms"
+                           if 'p50Ms' in summary else '')
+            print(f"    {stage:>16}: {summary['perRequest']:.1f}/request, mean {summary['meanMs']:.2f} ms{percentiles}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nSaved benchmark results to {output}")
+
+    # Remove the benchmark's enrolled persons from a running service again
+    if args.url and 'enroll' in args.endpoints:
+        for p in range(args.enroll_persons):
+            status, _ = client.request('DELETE', f"/api/gallery/persons/bench_enroll_{p}")
+            if status not in (200, 404):
+                print(f"Could not delete bench_enroll_{p} from the service ({status})")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare_results(json.load(f), results, args.regression_threshold)
+    work_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime
+
+# Job states; a job in one of the FINISHED_STATES never changes again
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+INTERRUPTED = 'interrupted'  # The service stopped while the job was queued or running
+FINISHED_STATES = (COMPLETED, FAILED, INTERRUPTED)
+
+# Event types that end a job's event stream
+TERMINAL_EVENTS = ('completed', 'failed')
+
+_JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+# How often a job run by another process (e.g. another prefork worker) is re-read from disk while followed
+FOREIGN_POLL_SECONDS = 1.0
+
+
+# Function to check whether a process is still running
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+class EnrollmentJob:
+    """
+    One background enrollment job, persisted under its own directory.
+
+    job.json holds the job's metadata (rewritten atomically on every change)
+    and events.ndjson is an append-only log of numbered events: log lines,
+    progress counters and one result event per enrolled person. Embeddings
+    only live in that file, so a job never has to keep its results in memory,
+    and any number of readers can replay or follow the stream.
+
+    Only the process that created a job (its owner) runs and updates it.
+    Other processes serving the same job directory re-read its metadata and
+    poll its event log.
+    """
+
+    def __init__(self, directory, meta):
+        self.id = meta["jobId"]
+        self.directory = directory
+        self.meta = meta
+        self.meta_path = os.path.join(directory, 'job.json')
+        self.events_path = os.path.join(directory, 'events.ndjson')
+        self._condition = threading.Condition()
+        self._next_seq = meta.get("eventCount", 0)
+
+    @property
+    def local(self):
+        return self.meta.get("ownerPid") == os.getpid()
+
+    # Re-read the metadata written by the owning process
+    def reload(self):
+        try:
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self._condition:
+            self.meta = meta
+
+    @property
+    def status(self):
+        return self.meta["status"]
+
+    @property
+    def finished(self):
+        return self.meta["status"] in FINISHED_STATES
+
+    def _write_meta(self):
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, self.meta_path)
+
+    # Update metadata fields and wake up readers waiting on the job
+    def update(self, **fields):
+        with self._condition:
+            self.meta.update(fields)
+            self.meta["eventCount"] = self._next_seq
+            self._write_meta()
+            self._condition.notify_all()
+
+    # Append one event; returns its sequence number
+    def emit(self, event_type, **fields):
+        with self._condition:
+            event = {"seq": self._next_seq, "type": event_type, "time": datetime.now().isoformat()}
+            event.update(fields)
+            with open(self.events_path, 'a') as f:
+                f.write(json.dumps(event) + '\n')
+            self._next_seq += 1
+            self._condition.notify_all()
+            return event["seq"]
+
+    # Replay the events after sequence number `after` and follow new ones until the job ends.
+    # Yields None whenever `heartbeat` seconds pass without a new event.
+    def follow(self, after=-1, heartbeat=15.0):
+        offset = 0
+        idle = 0.0
+        while True:
+            if not self.local:
+                self.reload()
+            with self._condition:
+                events, offset = self._read_events(offset, after)
+                if not events:
+                    if self.finished:
+                        return
+                    # Jobs of other processes are never notified here, so their log is polled
+                    wait = heartbeat if self.local else min(heartbeat, FOREIGN_POLL_SECONDS)
+                    self._condition.wait(timeout=wait)
+                    events, offset = self._read_events(offset, after)
+            if not events:
+                idle += wait
+                if idle >= heartbeat:
+                    idle = 0.0
+                    yield None
+                continue
+            idle = 0.0
+            for event in events:
+                after = event["seq"]
+                yield event
+                if event["type"] in TERMINAL_EVENTS:
+                    return
+
+    def _read_events(self, offset, after):
+        events = []
+        if not os.path.exists(self.events_path):
+            return events, offset
+        with open(self.events_path) as f:
+            f.seek(offset)
+            for line in f:
+                event = json.loads(line)
+                if event["seq"] > after:
+                    events.append(event)
+            offset = f.tell()
+        return events, offset
+
+    # Collect the job's results from its event log: {person: embeddings}, per-image errors and log lines
+    def results(self):
+        embeddings = {}
+        errors = []
+        logs = []
+        with self._condition:
+            events, _ = self._read_events(0, -1)
+        for event in events:
+            if event["type"] == 'person':
+                embeddings[event["personName"]] = event["embeddings"]
+                errors.extend(event.get("errors", []))
+            elif event["type"] == 'log':
+                logs.append(event["message"])
+        return embeddings, errors, logs
+
+
+class EnrollmentJobStore:
+    """
+    Directory of enrollment jobs (one sub-directory per job id).
+
+    Jobs stay retrievable after they finish, including across service
+    restarts, until they are older than the retention period.
+    """
+
+    def __init__(self, directory, retention_seconds=24 * 3600):
+        self.directory = directory
+        self.retention_seconds = retention_seconds
+        self._jobs = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    # Create a new queued job with the given metadata fields
+    def create(self, **fields):
+        self.prune()
+        job_id = uuid.uuid4().hex
+        directory = os.path.join(self.directory, job_id)
+        os.makedirs(directory)
+        meta = {
+            "jobId": job_id,
+            "status": QUEUED,
+            "createdAt": datetime.now().isoformat(),
+            "created": time.time(),
+            "ownerPid": os.getpid()
+        }
+        meta.update(fields)
+        job = EnrollmentJob(directory, meta)
+        job.update()
+        with self._lock:
+            self._jobs[job_id] = job
+        return job
+
+    # Look up a job by id (loading it from disk if needed); returns None for unknown ids
+    def get(self, job_id):
+        if not _JOB_ID_PATTERN.match(job_id or ''):
+            return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.local:
+                return job
+            if job is not None:
+                # Run by another process: its status is only current on disk
+                job.reload()
+            else:
+                directory = os.path.join(self.directory, job_id)
+                try:
+                    with open(os.path.join(directory, 'job.json')) as f:
+                        meta = json.load(f)
+                except (OSError, ValueError):
+                    return None
+                job = EnrollmentJob(directory, meta)
+                self._jobs[job_id] = job
+
+        # Not finished, but its owner is gone: it belonged to an earlier run of the service
+        owner = job.meta.get("ownerPid")
+        if not job.finished and not (owner and owner != os.getpid() and _process_alive(owner)):
+            job.update(status=INTERRUPTED, error="The service stopped before the job finished")
+        return job
+
+    # Delete finished jobs older than the retention period; returns how many were removed
+    def prune(self):
+        cutoff = time.time() - self.retention_seconds
+        removed = 0
+        for job_id in os.listdir(self.directory):
+            job = self.get(job_id)
+            if job is None or not job.finished or job.meta.get("created", 0) >= cutoff:
+                continue
+            with self._lock:
+                self._jobs.pop(job_id, None)
+            shutil.rmtree(job.directory, ignore_errors=True)
+            removed += 1
+        return removed
@@ -0,0 +1,201 @@
+import os
+import threading
+import time
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import cv2
+import numpy as np
+from face_pipeline import FacePipeline, PipelineConfig
+
+# Outcomes of the decode/detect stage for one image
+OK = 'ok'
+UNREADABLE = 'unreadable'
+NO_FACE = 'no_face'
+ERROR = 'error'
+
+
+# Face pipeline owned by a pool worker process (created once by the pool initializer)
+_worker_pipeline = None
+
+def _init_worker(config):
+    global _worker_pipeline
+    _worker_pipeline = FacePipeline(config)
+    _worker_pipeline.detector  # Build the detector now rather than on the first image
+
+def _worker_ready():
+    return os.getpid()
+
+# Function to decode one encoded image, detect its face and align it into a model-size crop
+# with the face pipeline; returns (outcome, crop, {stage: seconds}). Runs in a pool worker
+# unless a pipeline is given.
+def decode_and_crop(image_bytes, pipeline=None):
+    timings = {}
+    start_time = time.perf_counter()
+    img = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    timings["image_decode"] = time.perf_counter() - start_time
+    if img is None:
+        return UNREADABLE, None, timings
+
+    crops, _ = (pipeline or _worker_pipeline).detect_and_align([img], max_faces=1, timings=timings)
+    if len(crops) == 0:
+        return NO_FACE, None, timings
+    return OK, crops[0], timings
+
+
+class EnrollmentPipeline:
+    """
+    Staged pipeline for bulk enrollment.
+
+    Stage one (JPEG decode, MediaPipe detection, alignment into the model crop) fans out
+    over a pool of worker processes, each owning its own detector. Crops are
+    streamed into the embedding stage as soon as they arrive, so detection of
+    later images overlaps with ResNet50 batches of earlier ones. Results are
+    collected back into input order, with one outcome per image.
+
+    Small requests skip the pool and run stage one in the calling thread.
+    Per-stage timings measured in the workers are passed to `observe_stage`
+    (stage name, seconds) in the calling process.
+    """
+
+    def __init__(self, config=None, workers=0, max_in_flight=64, min_parallel_images=8,
+                 inline_detector=None, start_method=None, observe_stage=None):
+        self.config = config or PipelineConfig()
+        self.workers = workers or os.cpu_count() or 1
+        self.max_in_flight = max_in_flight
+        self.min_parallel_images = min_parallel_images
+        # Stage one of small requests; its timings are reported with the workers' ones
+        self.inline_pipeline = FacePipeline(self.config, detector=inline_detector)
+        self.observe_stage = observe_stage
+        # The service process already runs TensorFlow and MediaPipe threads, so workers are
+        # never forked from it directly. forkserver/spawn workers still re-import the main
+        # script as __mp_main__ (app.py only sets up its service state when it is not
+        # imported that way); the fork server itself only preloads this module.
+        if start_method is None:
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        self.start_method = start_method
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self.runs = 0
+        self.parallel_runs = 0
+        self.images = 0
+        self.outcomes = {OK: 0, UNREADABLE: 0, NO_FACE: 0, ERROR: 0}
+        self.pool_restarts = 0
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                context = multiprocessing.get_context(self.start_method)
+                if self.start_method == 'forkserver':
+                    context.set_forkserver_preload(['enrollment_pipeline'])
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=context,
+                    initializer=_init_worker,
+                    initargs=(self.config,)
+                )
+            return self._pool
+
+    # Start the worker processes (and their detectors) ahead of the first bulk enrollment;
+    # returns how many workers answered
+    def warm_up(self):
+        if self.workers <= 1:
+            return 0
+        pool = self._get_pool()
+        futures = [pool.submit(_worker_ready) for _ in range(self.workers)]
+        return len({future.result() for future in futures})
+
+    # Drop a pool whose worker died; the next run starts a fresh one
+    def _discard_pool(self, pool):
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = None
+                self.pool_restarts += 1
+        pool.shutdown(wait=False)
+
+    # Run both stages over a list of encoded images. `embed_submit` takes a resized
+    # uint8 crop and returns a Future for its embedding. Returns one (outcome, value)
+    # per image in input order: value is the embedding for OK, an error message for ERROR.
+    def run(self, images, embed_submit, timeout=60):
+        results = [None] * len(images)
+        in_flight = deque()  # (image index, embedding Future) in submission order
+
+        def drain(limit):
+            while len(in_flight) > limit:
+                idx, future = in_flight.popleft()
+                try:
+                    results[idx] = (OK, future.result(timeout=timeout))
+                except Exception as e:
+                    results[idx] = (ERROR, f"Feature extraction failed: {str(e)}")
+
+        def accept(idx, outcome, face, timings):
+            if self.observe_stage is not None:
+                for stage, seconds in timings.items():
+                    self.observe_stage(stage, seconds)
+            if outcome != OK:
+                results[idx] = (outcome, None)
+                return
+            # Back-pressure: never hold more crops waiting for the model than the limit
+            drain(self.max_in_flight - 1)
+            try:
+                in_flight.append((idx, embed_submit(face)))
+            except Exception as e:
+                results[idx] = (ERROR, f"Feature extraction failed: {str(e)}")
+
+        parallel = len(images) >= self.min_parallel_images and self.workers > 1
+        if parallel:
+            pool = self._get_pool()
+            futures = {pool.submit(decode_and_crop, image_bytes): idx
+                       for idx, image_bytes in enumerate(images)}
+            for future in as_completed(futures):
+                idx = futures[future]
+                try:
+                    outcome, face, timings = future.result()
+                except BrokenProcessPool as e:
+                    self._discard_pool(pool)
+                    results[idx] = (ERROR, f"Decode worker crashed: {str(e)}")
+                    continue
+                except Exception as e:
+                    results[idx] = (ERROR, str(e))
+                    continue
+                accept(idx, outcome, face, timings)
+        else:
+            for idx, image_bytes in enumerate(images):
+                try:
+                    outcome, face, timings = decode_and_crop(image_bytes, self.inline_pipeline)
+                except Exception as e:
+                    results[idx] = (ERROR, str(e))
+                    continue
+                accept(idx, outcome, face, timings)
+
+        drain(0)
+
+        with self._stats_lock:
+            self.runs += 1
+            self.parallel_runs += int(parallel)
+            self.images += len(images)
+            for outcome, _ in results:
+                self.outcomes[outcome] += 1
+        return results
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "workers": self.workers,
+                "poolStarted": self._pool is not None,
+                "startMethod": self.start_method,
+                "runs": self.runs,
+                "parallelRuns": self.parallel_runs,
+                "images": self.images,
+                "outcomes": dict(self.outcomes),
+                "poolRestarts": self.pool_restarts
+            }
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
@@ -0,0 +1,194 @@
+import argparse
+import os
+import tempfile
+import time
+import zipfile
+from datetime import datetime
+import cv2
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+
+from face_model import FACE_SIZE, load_embedding_model, write_model_metadata
+from face_matching import l2_normalize
+from face_pipeline import FacePipeline, PipelineConfig
+
+# Configuration
+MODEL_FOLDER = 'resnet50_model'
+FEATURE_MODEL_PATH = os.path.join(MODEL_FOLDER, 'resnet50_face_features.h5')
+RESULTS_DIR = 'validation_results'
+REPORT_FILE = os.path.join(RESULTS_DIR, 'quantization_drift.csv')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+LATENCY_BATCH_SIZES = (1, 16)
+
+
+# Function to read encoded images from a directory tree or a .zip archive
+def iter_image_bytes(source):
+    if source.endswith('.zip'):
+        with zipfile.ZipFile(source) as archive:
+            for name in sorted(archive.namelist()):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield name, archive.read(name)
+        return
+    for root, _, files in sorted(os.walk(source)):
+        for file_name in sorted(files):
+            if file_name.lower().endswith(IMAGE_EXTENSIONS):
+                with open(os.path.join(root, file_name), 'rb') as f:
+                    yield os.path.join(root, file_name), f.read()
+
+
+# Function to detect and align the face of every image into a FACE_SIZE crop, the way the
+# service does; a mirrored copy of every crop is added to widen the calibration set
+def load_face_crops(sources, limit):
+    face_pipeline = FacePipeline(PipelineConfig(face_size=FACE_SIZE))
+    crops = []
+    for source in sources:
+        if not os.path.exists(source):
+            continue
+        for name, image_bytes in iter_image_bytes(source):
+            img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+            if img is None:
+                continue
+            faces, _ = face_pipeline.detect_and_align([img])
+            if len(faces) == 0:
+                print(f"  No face detected in: {name}")
+                continue
+            face_img = faces[0]
+            crops.append(face_img)
+            crops.append(cv2.flip(face_img, 1))
+            if len(crops) >= limit:
+                return np.stack(crops[:limit])
+    return np.stack(crops) if crops else np.zeros((0, FACE_SIZE, FACE_SIZE, 3), dtype=np.uint8)
+
+
+# Function to convert the exported SavedModel to TFLite. 'dynamic' stores int8 weights and
+# quantizes activations on the fly; 'int8' also quantizes activations with ranges calibrated
+# on the face crops (ops without an int8 kernel stay in float)
+def convert_to_tflite(saved_model_dir, quantization, calibration_crops):
+    converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'int8':
+        def representative_dataset():
+            for crop in calibration_crops:
+                yield [crop[None]]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8, tf.lite.OpsSet.TFLITE_BUILTINS]
+    return converter.convert()
+
+
+# Function to measure how far the quantized embeddings drift from the float ones: per-crop cosine
+# similarity, and the change of the crop-to-crop similarities that recognition thresholds act on
+def embedding_drift(float_embeddings, quantized_embeddings):
+    float_normalized = l2_normalize(float_embeddings)
+    quantized_normalized = l2_normalize(quantized_embeddings)
+    cosine = np.sum(float_normalized * quantized_normalized, axis=1)
+    pair_delta = np.abs(float_normalized @ float_normalized.T - quantized_normalized @ quantized_normalized.T)
+    return {
+        "crops": int(len(cosine)),
+        "meanCosine": float(cosine.mean()),
+        "minCosine": float(cosine.min()),
+        "p01Cosine": float(np.percentile(cosine, 1)),
+        "meanPairSimilarityDelta": float(pair_delta.mean()),
+        "maxPairSimilarityDelta": float(pair_delta.max())
+    }
+
+
+# Function to time one face per call and full batches; returns {batch size: ms per face}
+def time_per_face(model, crops, repeats):
+    timings = {}
+    for batch_size in LATENCY_BATCH_SIZES:
+        batch = np.resize(crops, (batch_size,) + crops.shape[1:])
+        model.embed(batch)
+        samples = []
+        for _ in range(repeats):
+            start_time = time.perf_counter()
+            model.embed(batch)
+            samples.append((time.perf_counter() - start_time) / batch_size)
+        timings[batch_size] = float(np.median(samples)) * 1000
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a quantized TFLite feature model calibrated on face crops "
+                                                 "and report its embedding drift and speed against the float model")
+    parser.add_argument('--model', default=FEATURE_MODEL_PATH, help="Float Keras feature model")
+    parser.add_argument('--quantization', nargs='+', default=['int8'], choices=['dynamic', 'int8'])
+    parser.add_argument('--images', nargs='+', default=['faces', 'faces.zip', 'temp_faces'],
+                        help="Directories or .zip archives of face photos used for calibration and drift")
+    parser.add_argument('--max-crops', type=int, default=400, help="Most face crops used (including mirrored copies)")
+    parser.add_argument('--threads', type=int, default=4, help="Interpreter threads when timing the TFLite model")
+    parser.add_argument('--repeats', type=int, default=20, help="Timed runs per batch size")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print("Collecting face crops...")
+    crops = load_face_crops(args.images, args.max_crops)
+    if len(crops) < 2:
+        raise SystemExit(f"Found {len(crops)} face crops in {args.images}; at least 2 are needed")
+
+    # Calibrate on one half and measure drift on the other, so the report is not flattered
+    order = np.random.default_rng(args.seed).permutation(len(crops))
+    calibration_crops = crops[order[:len(crops) // 2]]
+    evaluation_crops = crops[order[len(crops) // 2:]]
+    print(f"Using {len(calibration_crops)} crops for calibration and {len(evaluation_crops)} for the drift report")
+
+    float_model = load_embedding_model(args.model, batch_sizes=LATENCY_BATCH_SIZES)
+    float_embeddings = float_model.embed(evaluation_crops)
+    float_timings = time_per_face(float_model, evaluation_crops, args.repeats)
+    float_bytes = os.path.getsize(args.model)
+    rows = [{
+        'model': os.path.basename(args.model),
+        'quantization': 'none',
+        'megabytes': float_bytes / 1e6,
+        **{f'ms_per_face_batch{b}': ms for b, ms in float_timings.items()},
+        'mean_cosine': 1.0,
+        'min_cosine': 1.0,
+        'max_pair_similarity_delta': 0.0
+    }]
+
+    with tempfile.TemporaryDirectory() as saved_model_dir:
+        float_model.export_saved_model(saved_model_dir)
+        for quantization in args.quantization:
+            output_path = f"{os.path.splitext(args.model)[0]}_{quantization}.tflite"
+            print(f"\nConverting to TFLite ({quantization})...")
+            start_time = time.perf_counter()
+            tflite_bytes = convert_to_tflite(saved_model_dir, quantization, calibration_crops)
+            with open(output_path, 'wb') as f:
+                f.write(tflite_bytes)
+            print(f"Wrote {output_path} ({len(tflite_bytes) / 1e6:.1f} MB) in {time.perf_counter() - start_time:.1f}s")
+
+            quantized_model = load_embedding_model(output_path, batch_sizes=LATENCY_BATCH_SIZES, num_threads=args.threads)
+            drift = embedding_drift(float_embeddings, quantized_model.embed(evaluation_crops))
+            timings = time_per_face(quantized_model, evaluation_crops, args.repeats)
+            write_model_metadata(output_path, {
+                "sourceModel": os.path.basename(args.model),
+                "quantization": quantization,
+                "calibrationCrops": int(len(calibration_crops)) if quantization == 'int8' else 0,
+                "createdAt": datetime.now().isoformat(),
+                "drift": drift,
+                "msPerFace": {str(b): ms for b, ms in timings.items()},
+                "floatMsPerFace": {str(b): ms for b, ms in float_timings.items()}
+            })
+
+            rows.append({
+                'model': os.path.basename(output_path),
+                'quantization': quantization,
+                'megabytes': len(tflite_bytes) / 1e6,
+                **{f'ms_per_face_batch{b}': ms for b, ms in timings.items()},
+                'mean_cosine': drift["meanCosine"],
+                'min_cosine': drift["minCosine"],
+                'max_pair_similarity_delta': drift["maxPairSimilarityDelta"]
+            })
+            print(f"{quantization:>8}: {len(tflite_bytes) / float_bytes:.2f}x the float file size, "
+                  + ", ".join(f"batch {b}: {ms:.1f} ms/face ({float_timings[b] / ms:.1f}x faster)" for b, ms in timings.items())
+                  + f", cosine to float mean {drift['meanCosine']:.4f} / min {drift['minCosine']:.4f}, "
+                  f"max pair similarity change {drift['maxPairSimilarityDelta']:.4f}")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    pd.DataFrame(rows).to_csv(REPORT_FILE, index=False)
+    print(f"\nSaved quantization report to {REPORT_FILE}")
+    print("Set INFERENCE_BACKEND = 'tflite' (and QUANTIZED_MODEL_PATH) in app.py to serve a quantized model")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import cv2
+import numpy as np
+
+# Face alignment: one affine warp per face maps the face box of the eye-levelled frame
+# straight into the canonical size x size model input (FACE_SIZE in face_model.py). Only
+# the pixels of the crop are computed, instead of rotating the whole frame, cropping and
+# resizing. This module does not import TensorFlow, so enrollment workers can use it.
+
+
+# Function to compute the face box (x, y, w, h) of a MediaPipe detection in pixels, clipped to
+# the image; `padding` widens it by that fraction of its size on each side
+def face_box(detection, image_shape, padding=0.0):
+    bboxC = detection.location_data.relative_bounding_box
+    ih, iw = image_shape[:2]
+    x = max(0, int(bboxC.xmin * iw))
+    y = max(0, int(bboxC.ymin * ih))
+    w = min(int(bboxC.width * iw), iw - x)
+    h = min(int(bboxC.height * ih), ih - y)
+    if padding:
+        padding_x = int(padding * w)
+        padding_y = int(padding * h)
+        x, y = max(0, x - padding_x), max(0, y - padding_y)
+        w, h = min(iw - x, w + 2 * padding_x), min(ih - y, h + 2 * padding_y)
+    return x, y, w, h
+
+
+# Function to get the eye keypoints of a detection in pixels; returns (left eye, right eye),
+# or None when the detection has no keypoints
+def eye_keypoints(detection, image_shape):
+    keypoints = detection.location_data.relative_keypoints
+    if len(keypoints) < 2:
+        return None
+    ih, iw = image_shape[:2]
+    return (keypoints[0].x * iw, keypoints[0].y * ih), (keypoints[1].x * iw, keypoints[1].y * ih)
+
+
+# Function to build the 2x3 transform taking frame pixels to the size x size crop: rotate about
+# the eye midpoint so the eyes are level, then crop `box` and scale it to the crop size
+def alignment_matrix(eyes, box, size):
+    x, y, w, h = box
+    if eyes is None:
+        rotation = np.eye(3)
+    else:
+        (left_x, left_y), (right_x, right_y) = eyes
+        angle = np.degrees(np.arctan2(right_y - left_y, right_x - left_x))
+        center = ((left_x + right_x) / 2, (left_y + right_y) / 2)
+        rotation = np.vstack([cv2.getRotationMatrix2D(center, angle, scale=1.0), [0, 0, 1]])
+
+    # Box to crop, with the pixel-centre convention cv2.resize uses
+    scale_x, scale_y = size / w, size / h
+    crop = np.array([
+        [scale_x, 0, 0.5 * scale_x - 0.5 - x * scale_x],
+        [0, scale_y, 0.5 * scale_y - 0.5 - y * scale_y],
+        [0, 0, 1]
+    ])
+    return (crop @ rotation)[:2]
+
+
+# Function to align a batch of faces [(image, detection, box)] into one uint8 array of shape
+# (N, size, size, 3); with rotate=False, or without eye keypoints, faces are only cropped and resized
+def align_faces(faces, size, out=None, rotate=True):
+    if out is None:
+        out = np.empty((len(faces), size, size, 3), dtype=np.uint8)
+    for i, (image, detection, box) in enumerate(faces):
+        eyes = eye_keypoints(detection, image.shape) if rotate else None
+        matrix = alignment_matrix(eyes, box, size)
+        cv2.warpAffine(image, matrix, (size, size), dst=out[i], flags=cv2.INTER_LINEAR,
+                       borderMode=cv2.BORDER_CONSTANT)
+    return out
+
+
+# Function to align one face into a size x size crop
+def align_face(image, detection, box, size):
+    return align_faces([(image, detection, box)], size)[0]
@@ -0,0 +1,245 @@
+import numpy as np
+
+# Reductions supported when collapsing per-embedding scores to one score per person
+REDUCTIONS = ('mean', 'max', 'topk')
+
+
+# Function to L2-normalize a batch of vectors (rows), leaving zero vectors at zero
+def l2_normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+# Function to reduce per-embedding similarities (probes x rows) to per-segment scores
+# (probes x segments), where segment i owns `counts[i]` consecutive rows
+def reduce_segments(similarities, counts, reduction='mean', k=3):
+    if reduction not in REDUCTIONS:
+        raise ValueError(f"Unknown reduction '{reduction}', expected one of {REDUCTIONS}")
+
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+    if reduction == 'mean':
+        return np.add.reduceat(similarities, offsets, axis=1) / counts
+    if reduction == 'max':
+        return np.maximum.reduceat(similarities, offsets, axis=1)
+
+    # Top-k: scatter into a (probes, segments, max_count) grid padded with -inf,
+    # partition out the k best per segment and average the valid ones
+    max_count = int(counts.max())
+    k = max(1, min(k, max_count))
+    segment_index = np.repeat(np.arange(len(counts)), counts)
+    segment_position = np.arange(similarities.shape[1]) - offsets[segment_index]
+    padded = np.full((len(similarities), len(counts), max_count), -np.inf, dtype=np.float32)
+    padded[:, segment_index, segment_position] = similarities
+    top = -np.partition(-padded, k - 1, axis=2)[..., :k]
+    return np.where(np.isfinite(top), top, 0).sum(axis=2) / np.minimum(counts, k)
+
+
+class FaceMatcher:
+    """
+    Scores probe embeddings against a gallery of known faces.
+
+    All gallery embeddings are kept as one contiguous, L2-normalized float32
+    matrix; person i owns rows offsets[i]:offsets[i+1]. A probe (or a batch of
+    probes) is scored with a single matrix multiply and the per-embedding
+    cosine similarities are reduced per person with segment reductions.
+
+    An approximate index (see ann_index.IVFIndex) can be attached for large
+    galleries. Matching then only re-scores, exactly, the persons owning the
+    nearest embeddings the index returns.
+
+    A matcher can also be built over an existing row matrix (e.g. a memory
+    map, see gallery_store.py) with from_rows. Person i then owns rows
+    starts[i]:starts[i] + counts[i], and rows owned by nobody are skipped.
+
+    With a projection (see embedding_projection.py) the gallery rows are kept
+    in the smaller projected space, and probes given as model embeddings are
+    projected the same way before scoring.
+    """
+
+    def __init__(self, embeddings_by_person, projection=None):
+        names = []
+        blocks = []
+        counts = []
+        for person_name, embeddings_list in embeddings_by_person.items():
+            if len(embeddings_list) == 0:
+                continue
+            block = np.asarray(embeddings_list, dtype=np.float32)
+            names.append(person_name)
+            block = block.reshape(len(block), -1)
+            blocks.append(projection.project_rows(block) if projection is not None else block)
+            counts.append(len(block))
+
+        self.names = names
+        self.name_to_index = {name: i for i, name in enumerate(names)}
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.offsets = np.concatenate(([0], np.cumsum(self.counts))).astype(np.int64)
+
+        if blocks:
+            self.matrix = np.ascontiguousarray(l2_normalize(np.concatenate(blocks, axis=0)))
+        else:
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+
+        # The mean cosine similarity to a person equals the dot product with the
+        # (unnormalized) mean of that person's normalized embeddings
+        if len(names):
+            sums = np.add.reduceat(self.matrix, self.offsets[:-1], axis=0)
+            self.centroids = np.ascontiguousarray(sums / self.counts[:, None].astype(np.float32))
+        else:
+            self.centroids = np.zeros((0, 0), dtype=np.float32)
+
+        self.projection = projection
+        self.starts = self.offsets[:-1]
+        self.row_order = None  # Matrix rows in person order, when persons are not stored back to back
+        self.index = None
+        self.index_candidates = 0
+
+    # Build a matcher over an existing matrix of L2-normalized rows without copying it;
+    # person i owns rows starts[i]:starts[i] + counts[i] and has the given centroid
+    @classmethod
+    def from_rows(cls, names, starts, counts, matrix, centroids, projection=None):
+        matcher = cls({}, projection)
+        matcher.names = list(names)
+        matcher.name_to_index = {name: i for i, name in enumerate(matcher.names)}
+        matcher.counts = np.asarray(counts, dtype=np.int64)
+        matcher.offsets = np.concatenate(([0], np.cumsum(matcher.counts))).astype(np.int64)
+        matcher.starts = np.asarray(starts, dtype=np.int64)
+        matcher.matrix = matrix
+        matcher.centroids = np.asarray(centroids, dtype=np.float32)
+        if not np.array_equal(matcher.starts, matcher.offsets[:-1]) or len(matrix) != matcher.offsets[-1]:
+            matcher.row_order = np.concatenate(
+                [np.arange(start, start + count) for start, count in zip(matcher.starts, matcher.counts)]
+            ) if len(matcher.names) else np.zeros(0, dtype=np.int64)
+        return matcher
+
+    def __len__(self):
+        return len(self.names)
+
+    # Bring probes into the gallery space: projected (when the gallery is) and L2-normalized
+    def project(self, probes):
+        probes = np.atleast_2d(np.asarray(probes, dtype=np.float32))
+        if self.projection is not None and probes.shape[1] == self.projection.input_dim:
+            return self.projection.project(probes)
+        return l2_normalize(probes)
+
+    @property
+    def size(self):
+        return int(self.counts.sum())
+
+    # Rows of the matrix belonging to one person
+    def person_embeddings(self, person_idx):
+        start = self.starts[person_idx]
+        return self.matrix[start:start + self.counts[person_idx]]
+
+    # All embeddings as one contiguous array in person order (the matrix itself when possible)
+    def ordered_matrix(self):
+        if self.row_order is None:
+            return self.matrix
+        return np.ascontiguousarray(self.matrix[self.row_order])
+
+    # Attach an approximate index; `candidates` is how many nearest embeddings are
+    # fetched per probe before the owning persons are re-scored exactly
+    def attach_index(self, index, candidates=64):
+        if index.ntotal == 0 and self.size:
+            index.add(self.ordered_matrix(), np.repeat(np.arange(len(self.names)), self.counts))
+        # Readers use the index as soon as it is set, so it is set last
+        self.index_candidates = candidates
+        self.index = index
+        return self
+
+    # Score probes against every person; returns an array of shape (n_probes, n_persons)
+    def score(self, probes, reduction='mean', k=3):
+        if reduction not in REDUCTIONS:
+            raise ValueError(f"Unknown reduction '{reduction}', expected one of {REDUCTIONS}")
+
+        probes = self.project(probes)
+        if not len(self.names):
+            return np.zeros((len(probes), 0), dtype=np.float32)
+
+        if reduction == 'mean':
+            return probes @ self.centroids.T
+        similarities = probes @ self.matrix.T
+        if self.row_order is not None:
+            similarities = similarities[:, self.row_order]
+        return reduce_segments(similarities, self.counts, reduction, k)
+
+    # Score one probe against a subset of persons only; returns an array of shape (len(person_ids),)
+    def score_persons(self, probe, person_ids, reduction='mean', k=3):
+        probe = self.project(probe).reshape(-1)
+        person_ids = np.asarray(person_ids, dtype=np.int64)
+
+        if reduction == 'mean':
+            return self.centroids[person_ids] @ probe
+
+        rows = np.concatenate([np.arange(self.starts[i], self.starts[i] + self.counts[i]) for i in person_ids])
+        similarities = (self.matrix[rows] @ probe)[None, :]
+        return reduce_segments(similarities, self.counts[person_ids], reduction, k)[0]
+
+    # Find the best matching person for each probe; returns (names, similarities, [{person: score}]).
+    # With an index attached the score maps only hold the candidate persons of each probe.
+    def match_batch(self, probes, threshold, reduction='mean', k=3):
+        probes = self.project(probes)
+        names = []
+        best_similarities = []
+        all_similarities = []
+
+        if self.index is not None:
+            candidate_labels, _ = self.index.search(probes, self.index_candidates)
+            rows = []
+            for probe, labels in zip(probes, candidate_labels):
+                person_ids = np.unique(labels[labels >= 0])
+                scores = self.score_persons(probe, person_ids, reduction, k) if len(person_ids) else np.zeros(0)
+                rows.append((person_ids, scores))
+        else:
+            scores = self.score(probes, reduction=reduction, k=k)
+            all_persons = np.arange(len(self.names))
+            rows = [(all_persons, row) for row in scores]
+
+        for person_ids, row in rows:
+            if len(row) and row.max() > threshold:
+                best_idx = int(np.argmax(row))
+                names.append(self.names[person_ids[best_idx]])
+                best_similarities.append(float(row[best_idx]))
+            else:
+                names.append("Unknown")
+                best_similarities.append(0.0)
+            all_similarities.append({self.names[i]: float(s) for i, s in zip(person_ids, row)})
+
+        return names, best_similarities, all_similarities
+
+    # Find the best matching person for a single probe; returns (name, similarity, {person: score})
+    def match(self, probe, threshold, reduction='mean', k=3):
+        names, best_similarities, all_similarities = self.match_batch(probe, threshold, reduction=reduction, k=k)
+        return names[0], best_similarities[0], all_similarities[0]
+
+    # Return a new matcher with the given persons added or replaced and the persons named in
+    # `removed` dropped. Persons given without embeddings are left as they are (a failed
+    # re-enrollment never deletes anyone). An attached index is carried over and updated
+    # incrementally instead of being rebuilt.
+    def updated(self, embeddings_by_person, removed=()):
+        changed = {name: embeddings for name, embeddings in embeddings_by_person.items() if len(embeddings)}
+        merged = {name: self.person_embeddings(i) for i, name in enumerate(self.names) if name not in removed}
+        merged.update(changed)
+        return FaceMatcher(merged, self.projection).carry_index(self, list(changed) + list(removed))
+
+    # Take over the index of `previous`, a matcher this one was derived from by
+    # adding or replacing the persons named in `changed_names`
+    def carry_index(self, previous, changed_names):
+        if previous.index is None:
+            return self
+
+        # Person indices stay stable unless someone was removed
+        if self.names[:len(previous.names)] == previous.names:
+            index = previous.index.copy()
+            changed = [self.name_to_index[name] for name in changed_names if name in self.name_to_index]
+            index.remove(changed)
+            for person_idx in changed:
+                embeddings = self.person_embeddings(person_idx)
+                index.add(embeddings, np.full(len(embeddings), person_idx))
+            self.index = index
+            self.index_candidates = previous.index_candidates
+        elif self.size:
+            index = previous.index.copy()
+            index.remove(range(len(previous.names)))
+            self.attach_index(index, previous.index_candidates)
+        return self
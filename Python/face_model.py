@@ -0,0 +1,215 @@
+import json
+import os
+import threading
+import cv2
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.models import load_model
+
+from face_pipeline import FACE_SIZE  # Input size of the face feature models
+
+# Batch sizes that get their own traced graph; other sizes are padded up to the next one
+DEFAULT_BATCH_SIZES = (1, 2, 4, 8, 16, 32)
+
+# Mean pixel values (BGR) subtracted before the ResNet50 face model
+RESNET_MEAN_BGR = np.array([91.4953, 103.8827, 131.0912], dtype=np.float32)
+
+
+# Preprocessing functions run inside the traced model graph: they take a uint8 BGR batch
+# tensor and return the float32 input of the feature model.
+
+# Function to preprocess for the ResNet50 face model (zero-center by mean pixel)
+def resnet_preprocess(batch_uint8):
+    return tf.cast(batch_uint8, tf.float32) - RESNET_MEAN_BGR
+
+
+# Function to preprocess for the VGG face model (RGB scaled to [0, 1])
+def vgg_preprocess(batch_uint8):
+    return tf.reverse(tf.cast(batch_uint8, tf.float32), axis=[-1]) / 255.0
+
+
+# Function to resize face crops into one uint8 batch of shape (N, FACE_SIZE, FACE_SIZE, 3),
+# or into the first N rows of `out`; crops already at the model size are copied as they are
+def resize_faces(face_imgs, size=FACE_SIZE, out=None):
+    batch = out if out is not None else np.empty((len(face_imgs), size, size, 3), dtype=np.uint8)
+    for i, face_img in enumerate(face_imgs):
+        if face_img.shape[:2] == (size, size):
+            batch[i] = face_img
+        else:
+            cv2.resize(face_img, (size, size), dst=batch[i])
+    return batch
+
+
+class BatchedEmbeddingModel:
+    """
+    Batching logic shared by the inference backends. Subclasses set
+    batch_sizes, input_shape and output_dim and implement _run(inputs) for a
+    uint8 BGR batch of exactly one of their batch sizes. Batches of other
+    sizes are padded up to the next batch size (or split into chunks of the
+    largest one).
+    """
+
+    backend = None
+
+    # Run every batch size once so the first real request does not pay for initialisation
+    def warm_up(self):
+        for batch_size in self.batch_sizes:
+            self._run(np.zeros((batch_size,) + self.input_shape, dtype=np.uint8))
+
+    # Batch size a batch of n crops runs at (n is padded up to it; the largest size
+    # when n is bigger than every batch size)
+    def bucket_size(self, n):
+        for batch_size in self.batch_sizes:
+            if batch_size >= n:
+                return batch_size
+        return self.batch_sizes[-1]
+
+    # Embed a uint8 BGR batch of shape (N, 224, 224, 3); returns float32 features of shape (N, D)
+    def embed(self, batch_uint8):
+        batch = np.asarray(batch_uint8, dtype=np.uint8)
+        if batch.ndim == 3:
+            batch = batch[None]
+        outputs = []
+        largest = self.batch_sizes[-1]
+        for start in range(0, len(batch), largest):
+            chunk = batch[start:start + largest]
+            bucket = self.bucket_size(len(chunk))
+            if bucket != len(chunk):
+                padded = np.zeros((bucket,) + self.input_shape, dtype=np.uint8)
+                padded[:len(chunk)] = chunk
+                chunk = padded
+            outputs.append(self._run(chunk)[:min(largest, len(batch) - start)])
+
+        if not outputs:
+            return np.zeros((0, self.output_dim), dtype=np.float32)
+        return np.concatenate(outputs)
+
+    # Embed a list of face crops of any size
+    def embed_faces(self, face_imgs):
+        return self.embed(resize_faces(face_imgs, self.input_shape[0]))
+
+
+class EmbeddingModel(BatchedEmbeddingModel):
+    """
+    Low-overhead inference wrapper around a Keras feature model.
+
+    Model.predict builds a data adapter and step function on every call, which
+    costs several milliseconds per single-image request. This wrapper traces
+    one fixed-signature concrete function per batch size up front, keeps those
+    graphs warm and calls them directly.
+
+    The traced graphs take raw uint8 BGR batches: the cast and the model's
+    preprocessing run inside the graph, so the host only has to put crops
+    into a uint8 batch.
+    """
+
+    backend = 'keras'
+
+    def __init__(self, keras_model, preprocess=resnet_preprocess, batch_sizes=DEFAULT_BATCH_SIZES, warm_up=True):
+        self.model = keras_model
+        self.preprocess = preprocess
+        self.batch_sizes = tuple(sorted(batch_sizes))
+        self.input_shape = tuple(keras_model.input_shape[1:])
+        self.output_dim = int(keras_model.output_shape[-1])
+
+        @tf.function
+        def forward(batch_uint8):
+            return self.model(self.preprocess(batch_uint8), training=False)
+
+        self._concrete_functions = {
+            batch_size: forward.get_concrete_function(tf.TensorSpec((batch_size,) + self.input_shape, tf.uint8))
+            for batch_size in self.batch_sizes
+        }
+
+        if warm_up:
+            self.warm_up()
+
+    def _run(self, inputs):
+        return self._concrete_functions[len(inputs)](tf.constant(inputs)).numpy()
+
+    # Export the feature model with preprocessing folded in as a SavedModel whose serving
+    # signature takes uint8 BGR batches of any size ('faces_bgr') and returns 'embeddings'
+    def export_saved_model(self, export_dir):
+        module = tf.Module()
+        module.model = self.model
+        preprocess = self.preprocess
+
+        @tf.function(input_signature=[tf.TensorSpec((None,) + self.input_shape, tf.uint8, name='faces_bgr')])
+        def serve(faces_bgr):
+            return {"embeddings": module.model(preprocess(faces_bgr), training=False)}
+
+        module.serve = serve
+        tf.saved_model.save(module, export_dir, signatures={'serving_default': serve})
+        return export_dir
+
+
+class TFLiteEmbeddingModel(BatchedEmbeddingModel):
+    """
+    Inference wrapper around a (quantized) TFLite export of the feature model,
+    written by export_quantized_model.py. The export takes uint8 BGR batches
+    with preprocessing inside, like the traced Keras graphs.
+
+    One interpreter is kept per batch size, all mapping the same model file.
+    An interpreter must not be invoked by two threads at once, so calls are
+    serialized.
+    """
+
+    backend = 'tflite'
+
+    def __init__(self, model_path, batch_sizes=DEFAULT_BATCH_SIZES, num_threads=None, warm_up=True):
+        self.model_path = model_path
+        self.batch_sizes = tuple(sorted(batch_sizes))
+        self.num_threads = num_threads
+        self.metadata = read_model_metadata(model_path)
+        self._lock = threading.Lock()
+        self._interpreters = {}
+
+        interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+        self.input_shape = tuple(int(d) for d in interpreter.get_input_details()[0]['shape'][1:])
+        self.output_dim = int(interpreter.get_output_details()[0]['shape'][-1])
+        for batch_size in self.batch_sizes:
+            self._interpreters[batch_size] = self._create_interpreter(batch_size)
+
+        if warm_up:
+            self.warm_up()
+
+    def _create_interpreter(self, batch_size):
+        interpreter = tf.lite.Interpreter(model_path=self.model_path, num_threads=self.num_threads)
+        interpreter.resize_tensor_input(interpreter.get_input_details()[0]['index'], (batch_size,) + self.input_shape)
+        interpreter.allocate_tensors()
+        return interpreter
+
+    def _run(self, inputs):
+        with self._lock:
+            interpreter = self._interpreters[len(inputs)]
+            interpreter.set_tensor(interpreter.get_input_details()[0]['index'], np.ascontiguousarray(inputs))
+            interpreter.invoke()
+            return interpreter.get_tensor(interpreter.get_output_details()[0]['index']).astype(np.float32)
+
+
+# Function to get the path of the metadata file written next to an exported model
+def model_metadata_path(model_path):
+    return f"{model_path}.json"
+
+
+# Function to read the metadata of an exported model (quantization, calibration, drift); {} when missing
+def read_model_metadata(model_path):
+    try:
+        with open(model_metadata_path(model_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_model_metadata(model_path, metadata):
+    with open(model_metadata_path(model_path), 'w') as f:
+        json.dump(metadata, f, indent=2)
+
+
+# Function to load a saved feature model and wrap it for fast inference: a Keras .h5 file, or a
+# .tflite export (which has its preprocessing built in, so `preprocess` does not apply)
+def load_embedding_model(model_path, preprocess=resnet_preprocess, batch_sizes=DEFAULT_BATCH_SIZES, warm_up=True,
+                         num_threads=None):
+    if os.path.splitext(model_path)[1].lower() == '.tflite':
+        return TFLiteEmbeddingModel(model_path, batch_sizes=batch_sizes, num_threads=num_threads, warm_up=warm_up)
+    return EmbeddingModel(load_model(model_path), preprocess=preprocess, batch_sizes=batch_sizes, warm_up=warm_up)
@@ -0,0 +1,214 @@
+import threading
+import time
+import cv2
+import numpy as np
+
+from face_alignment import face_box, align_faces
+
+# Input size of the face feature models (also exported by face_model.py, which imports TensorFlow)
+FACE_SIZE = 224
+
+
+class PipelineConfig:
+    """
+    Settings of the face pipeline, shared by the service (app.py), the kiosk
+    (test2.py) and the validation script. The defaults are the service's.
+    """
+
+    def __init__(self, face_size=FACE_SIZE, model_path=None, model_batch_sizes=(1, 2, 4, 8, 16), inference_threads=None,
+                 detector_model_selection=1, min_detection_confidence=0.5, max_faces=1, box_padding=0.0, align=True,
+                 similarity_threshold=0.4, projected_similarity_threshold=None, match_reduction='mean', match_top_k=3):
+        self.face_size = face_size  # Model input size (FACE_SIZE in face_model.py)
+        self.model_path = model_path  # Feature model (.h5 or .tflite) loaded when no embedder is given
+        self.model_batch_sizes = tuple(model_batch_sizes)
+        self.inference_threads = inference_threads
+        self.detector_model_selection = detector_model_selection  # 0=closer faces, 1=longer distance faces
+        self.min_detection_confidence = min_detection_confidence
+        self.max_faces = max_faces  # Faces kept per frame (None = all)
+        self.box_padding = box_padding  # Margin around detected faces, as a fraction of the box size
+        self.align = align  # Level the eyes when cropping
+        self.similarity_threshold = similarity_threshold  # For galleries of model embeddings
+        # For projected galleries (see embedding_projection.py); None uses the threshold fitted with the projection
+        self.projected_similarity_threshold = projected_similarity_threshold
+        self.match_reduction = match_reduction
+        self.match_top_k = match_top_k
+
+    # Copy of the config with some settings changed
+    def replace(self, **changes):
+        config = PipelineConfig.__new__(PipelineConfig)
+        config.__dict__.update(self.__dict__)
+        for name, value in changes.items():
+            if name not in config.__dict__:
+                raise AttributeError(f"Unknown pipeline setting '{name}'")
+            setattr(config, name, value)
+        return config
+
+
+class FacePipeline:
+    """
+    Batched face pipeline: detect -> align/crop -> preprocess -> embed -> match.
+
+    Every stage takes a list of frames (or a batch of crops) and works on the
+    whole batch. Crops of one call are written into one uint8 array of model
+    input size. The model input buffer is reused per thread, and preprocessing
+    and mean subtraction run inside the model graph.
+
+    The detector may be a MediaPipe detector (used by one thread) or a
+    DetectorPool. Embeddings come from `embedder` (a callable taking a list of
+    crops, e.g. the service's inference batcher) or from the model at
+    config.model_path, loaded on first use. This module imports neither
+    MediaPipe nor TensorFlow until they are needed, so enrollment worker
+    processes can use it for detection and alignment only.
+
+    Stage durations are passed to `observe_stage(stage, seconds)` and, when
+    a call is given a `timings` dict, recorded there too.
+    """
+
+    def __init__(self, config=None, detector=None, model=None, embedder=None, observe_stage=None):
+        self.config = config or PipelineConfig()
+        self._detector = detector
+        self._model = model
+        self._embedder = embedder
+        self.observe_stage = observe_stage
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _observe(self, stage, start_time, timings=None):
+        seconds = time.perf_counter() - start_time
+        if self.observe_stage is not None:
+            self.observe_stage(stage, seconds)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+    @property
+    def detector(self):
+        if self._detector is None:
+            with self._lock:
+                if self._detector is None:
+                    from detector_pool import create_face_detector
+                    self._detector = create_face_detector(self.config.detector_model_selection,
+                                                          self.config.min_detection_confidence)
+        return self._detector
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from face_model import load_embedding_model
+                    self._model = load_embedding_model(self.config.model_path, batch_sizes=self.config.model_batch_sizes,
+                                                       num_threads=self.config.inference_threads)
+        return self._model
+
+    # Stage 1: detect faces in every frame; returns one list of (detection, box, score) per frame,
+    # best first, with boxes (x, y, w, h) padded by `padding` and clipped to the frame
+    def detect(self, frames, max_faces=-1, padding=None, timings=None):
+        max_faces = self.config.max_faces if max_faces == -1 else max_faces
+        padding = self.config.box_padding if padding is None else padding
+        faces = []
+        for frame in frames:
+            start_time = time.perf_counter()
+            results = self.detector.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            self._observe('detection', start_time, timings)
+            frame_faces = []
+            for detection in (results.detections or [])[:max_faces]:
+                box = face_box(detection, frame.shape, padding=padding)
+                if box[2] > 0 and box[3] > 0:
+                    frame_faces.append((detection, box, float(detection.score[0])))
+            faces.append(frame_faces)
+        return faces
+
+    # Stage 2: warp every detected face into a face_size crop (eyes levelled when `align`);
+    # returns (crops of shape (N, size, size, 3), [(frame index, box, score)] per crop)
+    def align(self, frames, faces, align=None, timings=None):
+        align = self.config.align if align is None else align
+        items = []
+        owners = []
+        for frame_index, (frame, frame_faces) in enumerate(zip(frames, faces)):
+            for detection, box, score in frame_faces:
+                items.append((frame, detection, box))
+                owners.append((frame_index, box, score))
+        start_time = time.perf_counter()
+        crops = align_faces(items, self.config.face_size, rotate=align)
+        if items:
+            self._observe('alignment', start_time, timings)
+        return crops, owners
+
+    # Stages 1 and 2 together
+    def detect_and_align(self, frames, max_faces=-1, padding=None, align=None, timings=None):
+        faces = self.detect(frames, max_faces, padding, timings)
+        return self.align(frames, faces, align, timings)
+
+    # Stage 3: put crops of any size into this thread's reused uint8 model input buffer;
+    # the returned view is only valid until the next call on the same thread
+    def preprocess(self, crops, timings=None):
+        from face_model import resize_faces
+        start_time = time.perf_counter()
+        size = self.config.face_size
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None or len(buffer) < len(crops):
+            buffer = self._local.buffer = np.zeros((max(len(crops), 1), size, size, 3), dtype=np.uint8)
+        batch = resize_faces(crops, size, out=buffer)[:len(crops)]
+        self._observe('preprocessing', start_time, timings)
+        return batch
+
+    # Stage 4: embed a batch of crops; returns float32 embeddings of shape (N, D)
+    def embed(self, crops, timings=None):
+        if len(crops) == 0:
+            return np.zeros((0, 0), dtype=np.float32)
+        if self._embedder is not None:
+            # The embedder (e.g. the inference batcher) records its own stages
+            return np.asarray(self._embedder(list(crops)))
+        batch = self.preprocess(crops, timings)
+        start_time = time.perf_counter()
+        embeddings = self.model.embed(batch)
+        self._observe('inference', start_time, timings)
+        return embeddings
+
+    # Similarity threshold for a matcher: projected galleries score on another scale than model embeddings
+    def similarity_threshold(self, matcher):
+        projection = matcher.projection
+        if projection is None:
+            return self.config.similarity_threshold
+        if self.config.projected_similarity_threshold is not None:
+            return self.config.projected_similarity_threshold
+        if projection.similarity_threshold is None:
+            raise ValueError(f"Projection {projection.version} has no fitted similarity threshold; "
+                             f"run fit_projection.py again or set a projected similarity threshold")
+        return projection.similarity_threshold
+
+    # Stage 5: match a batch of embeddings against a FaceMatcher; returns (names, best similarities,
+    # per-person similarity maps)
+    def match(self, embeddings, matcher, timings=None):
+        start_time = time.perf_counter()
+        result = matcher.match_batch(np.asarray(embeddings), self.similarity_threshold(matcher),
+                                     reduction=self.config.match_reduction, k=self.config.match_top_k)
+        self._observe('matching', start_time, timings)
+        return result
+
+    # Match one embedding; returns (name, best similarity, per-person similarity map)
+    def match_one(self, embedding, matcher, timings=None):
+        start_time = time.perf_counter()
+        result = matcher.match(embedding, self.similarity_threshold(matcher),
+                               reduction=self.config.match_reduction, k=self.config.match_top_k)
+        self._observe('matching', start_time, timings)
+        return result
+
+    # All stages over a list of frames; returns one list per frame of dicts with the face's box,
+    # detection score and embedding, plus name and similarity when a matcher is given
+    def process(self, frames, matcher=None, timings=None):
+        crops, owners = self.detect_and_align(frames, timings=timings)
+        embeddings = self.embed(crops, timings)
+        results = [[] for _ in frames]
+        if not owners:
+            return results
+        names, similarities = [None] * len(owners), [None] * len(owners)
+        if matcher is not None:
+            names, similarities, _ = self.match(embeddings, matcher, timings)
+        for (frame_index, box, score), embedding, name, similarity in zip(owners, embeddings, names, similarities):
+            face = {"box": box, "detectionScore": score, "embedding": embedding}
+            if matcher is not None:
+                face["recognizedName"] = name
+                face["similarity"] = float(similarity)
+            results[frame_index].append(face)
+        return results
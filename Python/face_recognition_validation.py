@@ -4,14 +4,15 @@ import numpy as np
 import tensorflow as tf
 import cv2
 import matplotlib.pyplot as plt
-from tensorflow.keras.models import load_model
 from scipy.spatial.distance import cosine, euclidean
 from sklearn.metrics import confusion_matrix, accuracy_score, precision_score, recall_score, f1_score, roc_curve, auc
-import mediapipe as mp
 from tqdm import tqdm
 import pandas as pd
 import seaborn as sns
 from collections import defaultdict
+from face_matching import FaceMatcher
+from face_model import FACE_SIZE
+from face_pipeline import FacePipeline, PipelineConfig
 
 print("TensorFlow version:", tf.__version__)
 
@@ -27,6 +28,15 @@ if not os.path.exists(RESULTS_DIR):
     os.makedirs(RESULTS_DIR)
     print(f"Created directory: {RESULTS_DIR}")
 
+# Face pipeline shared with the service and the kiosk (same detection, alignment and model)
+face_pipeline = FacePipeline(PipelineConfig(
+    face_size=FACE_SIZE,
+    model_path=FEATURE_MODEL_PATH,
+    model_batch_sizes=(1, 4, 16),
+    similarity_threshold=SIMILARITY_THRESHOLD
+))
+EMBED_BATCH_SIZE = 16
+
 # Load the ResNet50 feature extraction model
 print("Loading ResNet50 Face feature extraction model...")
 try:
@@ -34,113 +44,40 @@ try:
     tf.config.threading.set_intra_op_parallelism_threads(4)
     tf.config.threading.set_inter_op_parallelism_threads(4)
     
-    # Load model
-    resnet_feature_model = load_model(FEATURE_MODEL_PATH)
+    # Load model (wrapped with pre-traced graphs for each batch size)
+    face_pipeline.model
     print("Model loaded successfully!")
 except Exception as e:
     print(f"Error loading model: {str(e)}")
     exit(1)
 
-# Initialize MediaPipe Face Detection
-mp_face_detection = mp.solutions.face_detection
-face_detection = mp_face_detection.FaceDetection(
-    model_selection=1,  # 0=closer faces, 1=longer distance faces
-    min_detection_confidence=0.5
-)
-
-# Function to detect face using MediaPipe and return cropped face
-def detect_and_crop_face(image):
-    # Convert the BGR image to RGB
-    rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    # Process the image
-    results = face_detection.process(rgb_image)
-    
-    if not results.detections:
-        return None, None
-    
-    # Get the first detected face
-    detection = results.detections[0]
-    bboxC = detection.location_data.relative_bounding_box
-    
-    # Convert normalized coordinates to absolute pixel values
-    ih, iw, _ = image.shape
-    x = int(bboxC.xmin * iw)
-    y = int(bboxC.ymin * ih)
-    w = int(bboxC.width * iw)
-    h = int(bboxC.height * ih)
-    
-    # Ensure coordinates are within image boundaries
-    x = max(0, x)
-    y = max(0, y)
-    w = min(w, iw - x)
-    h = min(h, ih - y)
-    
-    # Crop the face
-    face_img = image[y:y+h, x:x+w]
-    
-    # Try to align the face if landmarks are available
-    try:
-        aligned_face = align_face(image, detection)
-        # Re-crop the aligned face using the same boundaries
-        aligned_face_crop = aligned_face[y:y+h, x:x+w]
-        if aligned_face_crop.size > 0:
-            face_img = aligned_face_crop
-    except Exception as e:
-        print(f"Warning: Face alignment failed: {e}")
-    
-    return face_img, (x, y, w, h)
-
-# Function to perform face alignment using eye centers
-def align_face(image, landmarks):
-    # Extract eye landmarks (MediaPipe provides normalized coordinates)
-    h, w, _ = image.shape
-    
-    # Convert to absolute coordinates (rough estimate from MediaPipe landmarks)
-    left_eye_x = int(landmarks.location_data.relative_keypoints[0].x * w)
-    left_eye_y = int(landmarks.location_data.relative_keypoints[0].y * h)
-    right_eye_x = int(landmarks.location_data.relative_keypoints[1].x * w)
-    right_eye_y = int(landmarks.location_data.relative_keypoints[1].y * h)
-    
-    # Calculate angle
-    dx = right_eye_x - left_eye_x
-    dy = right_eye_y - left_eye_y
-    angle = np.degrees(np.arctan2(dy, dx))
-    
-    # Get rotation matrix
-    center = ((left_eye_x + right_eye_x) // 2, (left_eye_y + right_eye_y) // 2)
-    rotation_matrix = cv2.getRotationMatrix2D(center, angle, scale=1.0)
-    
-    # Apply rotation
-    aligned_image = cv2.warpAffine(image, rotation_matrix, (w, h), flags=cv2.INTER_CUBIC)
-    
-    return aligned_image
-
-# Function to preprocess image for ResNet50 model
-def preprocess_image(img):
-    # Resize to 224x224 (ResNet input size)
-    resized = cv2.resize(img, (224, 224))
-    # Convert from BGR to RGB (OpenCV uses BGR, but model expects RGB)
-    rgb_img = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
-    
-    # Convert to float32 BEFORE subtraction
-    bgr_img = rgb_img[..., ::-1].copy().astype(np.float32)
-    
-    # Zero-center by mean pixel values
-    bgr_img[..., 0] -= 91.4953
-    bgr_img[..., 1] -= 103.8827
-    bgr_img[..., 2] -= 131.0912
-    
-    # Add batch dimension
-    preprocessed = np.expand_dims(bgr_img, axis=0)
-    return preprocessed
-
-# Function to extract face embeddings using ResNet50 model
-def extract_resnet_features(face_img):
-    start_time = time.time()
-    preprocessed = preprocess_image(face_img)
-    features = resnet_feature_model.predict(preprocessed, verbose=0)
-    processing_time = time.time() - start_time
-    return features[0], processing_time
+# Function to detect, align and embed every image once, in batches; returns
+# {image path: (embedding, processing time per face)} for the images with a face
+def embed_images(image_paths):
+    embeddings = {}
+    for i in tqdm(range(0, len(image_paths), EMBED_BATCH_SIZE), desc="Embedding images"):
+        batch_paths = []
+        frames = []
+        for image_path in image_paths[i:i + EMBED_BATCH_SIZE]:
+            img = cv2.imread(image_path)
+            if img is None:
+                print(f"Could not read image: {image_path}")
+                continue
+            batch_paths.append(image_path)
+            frames.append(img)
+        
+        crops, owners = face_pipeline.detect_and_align(frames, max_faces=1)
+        start_time = time.time()
+        batch_embeddings = face_pipeline.embed(crops)
+        processing_time = (time.time() - start_time) / max(len(crops), 1)
+        
+        found = {frame_index for frame_index, _, _ in owners}
+        for frame_index, image_path in enumerate(batch_paths):
+            if frame_index not in found:
+                print(f"No face detected in: {image_path}")
+        for (frame_index, _, _), embedding in zip(owners, batch_embeddings):
+            embeddings[batch_paths[frame_index]] = (embedding, processing_time)
+    return embeddings
 
 # Define distance metrics
 def calculate_distances(embedding1, embedding2):
@@ -188,6 +125,10 @@ def run_cross_validation(all_person_data, persons_list):
     all_impostor_distances = defaultdict(list)
     processing_times = []
     
+    # Every image is embedded once; the folds below only reuse the embeddings
+    image_paths = [path for person_name in persons_list for path in all_person_data[person_name]]
+    embeddings = embed_images(image_paths)
+    
     print("\nRunning cross-validation...")
     
     # For each person
@@ -198,20 +139,9 @@ def run_cross_validation(all_person_data, persons_list):
         # For each image of the person (leave-one-out)
         for test_idx, test_image_path in enumerate(person_images):
             try:
-                # Load test image
-                test_img = cv2.imread(test_image_path)
-                if test_img is None:
-                    print(f"Could not read image: {test_image_path}")
-                    continue
-                
-                # Detect and crop face
-                test_face, _ = detect_and_crop_face(test_img)
-                if test_face is None or test_face.size == 0:
-                    print(f"No face detected in: {test_image_path}")
+                if test_image_path not in embeddings:
                     continue
-                
-                # Extract features
-                test_embedding, proc_time = extract_resnet_features(test_face)
+                test_embedding, proc_time = embeddings[test_image_path]
                 processing_times.append(proc_time)
                 
                 # Build training set (all other images from this person + other persons)
@@ -219,23 +149,19 @@ def run_cross_validation(all_person_data, persons_list):
                 
                 # Add other images from this person (genuine matches)
                 for train_idx, train_image_path in enumerate(person_images):
-                    if train_idx != test_idx:  # Skip the test image
-                        train_img = cv2.imread(train_image_path)
-                        train_face, _ = detect_and_crop_face(train_img)
+                    if train_idx != test_idx and train_image_path in embeddings:  # Skip the test image
+                        train_embedding, _ = embeddings[train_image_path]
+                        
+                        # Store distances for this genuine pair
+                        distances = calculate_distances(test_embedding, train_embedding)
+                        for metric, value in distances.items():
+                            all_genuine_distances[metric].append(value)
+                            all_distances[metric].append((value, True))  # True = genuine match
                         
-                        if train_face is not None and train_face.size > 0:
-                            train_embedding, _ = extract_resnet_features(train_face)
-                            
-                            # Store distances for this genuine pair
-                            distances = calculate_distances(test_embedding, train_embedding)
-                            for metric, value in distances.items():
-                                all_genuine_distances[metric].append(value)
-                                all_distances[metric].append((value, True))  # True = genuine match
-                            
-                            # Add to training set
-                            if person_name not in training_embeddings:
-                                training_embeddings[person_name] = []
-                            training_embeddings[person_name].append(train_embedding)
+                        # Add to training set
+                        if person_name not in training_embeddings:
+                            training_embeddings[person_name] = []
+                        training_embeddings[person_name].append(train_embedding)
                 
                 # Add samples from other persons (impostor matches)
                 for other_person in persons_list:
@@ -244,11 +170,8 @@ def run_cross_validation(all_person_data, persons_list):
                         other_images = all_person_data[other_person][:min(3, len(all_person_data[other_person]))]
                         
                         for other_image_path in other_images:
-                            other_img = cv2.imread(other_image_path)
-                            other_face, _ = detect_and_crop_face(other_img)
-                            
-                            if other_face is not None and other_face.size > 0:
-                                other_embedding, _ = extract_resnet_features(other_face)
+                            if other_image_path in embeddings:
+                                other_embedding, _ = embeddings[other_image_path]
                                 
                                 # Store distances for this impostor pair
                                 distances = calculate_distances(test_embedding, other_embedding)
@@ -262,21 +185,8 @@ def run_cross_validation(all_person_data, persons_list):
                                 training_embeddings[other_person].append(other_embedding)
                 
                 # Now classify the test image
-                best_match = "Unknown"
-                best_similarity = 0
-                
-                for candidate_name, embeddings in training_embeddings.items():
-                    if not embeddings:
-                        continue
-                    
-                    # Calculate average similarity with all embeddings for this person
-                    similarities = [1 - cosine(test_embedding, emb) for emb in embeddings]
-                    avg_similarity = np.mean(similarities)
-                    
-                    # Update best match if this person is more similar
-                    if avg_similarity > best_similarity and avg_similarity > SIMILARITY_THRESHOLD:
-                        best_similarity = avg_similarity
-                        best_match = candidate_name
+                matcher = FaceMatcher(training_embeddings)
+                best_match, best_similarity, _ = face_pipeline.match_one(test_embedding, matcher)
                 
                 # Record result
                 is_correct = (best_match == person_name)
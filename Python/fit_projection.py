@@ -0,0 +1,247 @@
+import argparse
+import os
+import pickle
+import time
+import zipfile
+import cv2
+import numpy as np
+import pandas as pd
+
+from embedding_projection import EmbeddingProjection
+from face_matching import FaceMatcher
+from face_model import FACE_SIZE
+from face_pipeline import FacePipeline, PipelineConfig
+from gallery_format import gallery_to_dict, read_gallery
+from gallery_store import GalleryStore
+
+# Configuration
+MODEL_FOLDER = 'resnet50_model'
+FEATURE_MODEL_PATH = os.path.join(MODEL_FOLDER, 'resnet50_face_features.h5')
+PROJECTION_FILE = os.path.join(MODEL_FOLDER, 'embedding_projection.npz')  # EMBEDDING_PROJECTION_FILE in app.py
+RESULTS_DIR = 'validation_results'
+REPORT_FILE = os.path.join(RESULTS_DIR, 'projection_accuracy.csv')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+SIMILARITY_THRESHOLD = 0.4
+
+
+# Function to read encoded images grouped by person (the name of the folder holding each image)
+# from a directory tree or a .zip archive
+def iter_person_images(source):
+    if source.endswith('.zip'):
+        with zipfile.ZipFile(source) as archive:
+            for name in sorted(archive.namelist()):
+                parts = name.split('/')
+                if name.lower().endswith(IMAGE_EXTENSIONS) and len(parts) >= 2:
+                    yield parts[-2], name, archive.read(name)
+        return
+    for root, _, files in sorted(os.walk(source)):
+        for file_name in sorted(files):
+            if file_name.lower().endswith(IMAGE_EXTENSIONS) and os.path.abspath(root) != os.path.abspath(source):
+                with open(os.path.join(root, file_name), 'rb') as f:
+                    yield os.path.basename(root), os.path.join(root, file_name), f.read()
+
+
+# Function to embed every face photo with the service's face pipeline; returns {person: (N, D) embeddings}
+def embed_person_images(sources, model_path):
+    face_pipeline = FacePipeline(PipelineConfig(face_size=FACE_SIZE, model_path=model_path, model_batch_sizes=(1, 4, 16)))
+    frames_by_person = {}
+    for source in sources:
+        if not os.path.exists(source):
+            continue
+        for person_name, name, image_bytes in iter_person_images(source):
+            img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+            if img is None:
+                print(f"  Could not read image: {name}")
+                continue
+            frames_by_person.setdefault(person_name, []).append(img)
+
+    embeddings_by_person = {}
+    for person_name, frames in frames_by_person.items():
+        crops, _ = face_pipeline.detect_and_align(frames, max_faces=1)
+        if len(crops) < len(frames):
+            print(f"  No face detected in {len(frames) - len(crops)} of {len(frames)} images of {person_name}")
+        if len(crops):
+            embeddings_by_person[person_name] = face_pipeline.embed(crops)
+    return embeddings_by_person
+
+
+# Function to load model embeddings from a gallery file (.fnrg or legacy .pkl) or a gallery store directory
+def load_gallery_embeddings(path):
+    if os.path.isdir(path):
+        matcher, _ = GalleryStore(path).load_matcher()
+        if matcher is None:
+            raise SystemExit(f"Gallery store {path} is empty")
+        if matcher.projection is not None:
+            raise SystemExit(f"Gallery store {path} is already projected; fit on face images or an unprojected gallery")
+        return {name: np.asarray(matcher.person_embeddings(i)) for i, name in enumerate(matcher.names)}
+    if path.endswith('.pkl'):
+        with open(path, 'rb') as f:
+            return {name: np.asarray(embeddings, dtype=np.float32) for name, embeddings in pickle.load(f).items()}
+    names, counts, vectors, info = read_gallery(path)
+    if info["metadata"].get("projection"):
+        raise SystemExit(f"Gallery file {path} holds projected embeddings; fit on face images or an unprojected gallery")
+    return gallery_to_dict(names, counts, vectors)
+
+
+# Function to split every person with at least 2 embeddings into one probe and a gallery of the rest;
+# fold f uses embedding f (modulo the count) as the probe
+def split_fold(embeddings_by_person, fold):
+    gallery = {}
+    probes = []
+    probe_names = []
+    for person_name, embeddings in embeddings_by_person.items():
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if len(embeddings) < 2:
+            gallery[person_name] = embeddings
+            continue
+        probe_row = fold % len(embeddings)
+        probes.append(embeddings[probe_row])
+        probe_names.append(person_name)
+        gallery[person_name] = np.delete(embeddings, probe_row, axis=0)
+    return gallery, np.asarray(probes), probe_names
+
+
+# Function to find the threshold that best separates genuine from impostor scores (maximum TPR - FPR)
+# and the area under the ROC curve
+def separation(genuine, impostor):
+    scores = np.concatenate([genuine, impostor])
+    labels = np.concatenate([np.ones(len(genuine)), np.zeros(len(impostor))])
+    order = np.argsort(-scores, kind='stable')
+    tpr = np.cumsum(labels[order]) / max(len(genuine), 1)
+    fpr = np.cumsum(1 - labels[order]) / max(len(impostor), 1)
+    best = int(np.argmax(tpr - fpr))
+    tpr, fpr = np.concatenate([[0], tpr]), np.concatenate([[0], fpr])
+    auc = float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+    return float(scores[order][best]), auc
+
+
+# Function to score one fold with the gallery stored as given (projection None) or projected
+def evaluate_fold(gallery, probes, probe_names, projection, threshold, reduction):
+    matcher = FaceMatcher(gallery, projection)
+    start_time = time.perf_counter()
+    names, _, _ = matcher.match_batch(probes, threshold, reduction=reduction)
+    match_seconds = time.perf_counter() - start_time
+
+    scores = matcher.score(probes, reduction=reduction)
+    truth = np.array([matcher.name_to_index[name] for name in probe_names])
+    genuine_mask = np.zeros(scores.shape, dtype=bool)
+    genuine_mask[np.arange(len(truth)), truth] = True
+    return {
+        "correct": sum(a == b for a, b in zip(names, probe_names)),
+        "rank1": int(np.sum(np.argmax(scores, axis=1) == truth)),
+        "probes": len(probe_names),
+        "genuine": scores[genuine_mask],
+        "impostor": scores[~genuine_mask],
+        "match_seconds": match_seconds,
+        "bytes": matcher.matrix.nbytes + matcher.centroids.nbytes
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit a PCA/whitening projection of face embeddings, report recognition "
+                                                 "accuracy against the projected dimension and write the projection")
+    parser.add_argument('--images', nargs='+', default=['faces', 'faces.zip'],
+                        help="Directories or .zip archives of face photos in one folder per person")
+    parser.add_argument('--gallery', help="Fit on a gallery file (.fnrg or .pkl) or gallery store directory instead of images")
+    parser.add_argument('--model', default=FEATURE_MODEL_PATH, help="Feature model used to embed the images")
+    parser.add_argument('--dims', type=int, nargs='+', default=[32, 64, 128, 256], help="Projected dimensions to report")
+    parser.add_argument('--dim', type=int, default=128, help="Dimension of the projection written to --output")
+    parser.add_argument('--whiten', action='store_true', help="Write a whitening projection instead of plain PCA")
+    parser.add_argument('--output', default=PROJECTION_FILE)
+    parser.add_argument('--report-only', action='store_true', help="Only write the report, not the projection")
+    parser.add_argument('--folds', type=int, default=3, help="Leave-one-out folds (each holds out a different image per person)")
+    parser.add_argument('--threshold', type=float, default=SIMILARITY_THRESHOLD)
+    parser.add_argument('--reduction', default='mean', choices=['mean', 'max', 'topk'])
+    args = parser.parse_args()
+
+    if args.gallery:
+        print(f"Loading embeddings from {args.gallery}...")
+        embeddings_by_person = load_gallery_embeddings(args.gallery)
+    else:
+        print(f"Embedding face images from {args.images}...")
+        embeddings_by_person = embed_person_images(args.images, args.model)
+    embeddings_by_person = {name: np.asarray(rows, dtype=np.float32) for name, rows in embeddings_by_person.items() if len(rows)}
+    all_embeddings = np.concatenate(list(embeddings_by_person.values())) if embeddings_by_person else np.zeros((0, 0))
+    print(f"{len(embeddings_by_person)} persons, {len(all_embeddings)} embeddings of dimension {all_embeddings.shape[1]}")
+    if len(embeddings_by_person) < 2:
+        raise SystemExit("At least 2 persons are needed to measure accuracy")
+
+    # The projection of every fold is fitted on that fold's gallery only, never on its probes. The
+    # written projection is always among the variants: its best threshold is saved with it.
+    written_variant = f"{'whiten' if args.whiten else 'pca'}{args.dim}"
+    dims = sorted(set(args.dims) | ({args.dim} if not args.report_only else set()))
+    variants = [('none', None, False)] + [(f'pca{dim}', dim, False) for dim in dims] + \
+               [(f'whiten{dim}', dim, True) for dim in dims]
+    totals = {name: [] for name, _, _ in variants}
+    for fold in range(args.folds):
+        gallery, probes, probe_names = split_fold(embeddings_by_person, fold)
+        if not probe_names:
+            raise SystemExit("No person has 2 or more embeddings to hold one out")
+        gallery_rows = np.concatenate(list(gallery.values()))
+        for name, dim, whiten in variants:
+            projection = None
+            if dim is not None:
+                try:
+                    projection = EmbeddingProjection.fit(gallery_rows, dim, whiten=whiten)
+                except ValueError as e:
+                    if fold == 0:
+                        print(f"Skipping {name}: {str(e)}")
+                    continue
+            result = evaluate_fold(gallery, probes, probe_names, projection, args.threshold, args.reduction)
+            result["explained_variance"] = projection.explained_variance if projection is not None else 1.0
+            totals[name].append(result)
+
+    rows = []
+    for name, dim, whiten in variants:
+        results = totals[name]
+        if not results:
+            continue
+        probes = sum(r["probes"] for r in results)
+        best_threshold, auc = separation(np.concatenate([r["genuine"] for r in results]),
+                                         np.concatenate([r["impostor"] for r in results]))
+        rows.append({
+            'projection': name,
+            'dim': dim or all_embeddings.shape[1],
+            'whiten': whiten,
+            'explained_variance': float(np.mean([r["explained_variance"] for r in results])),
+            'accuracy_at_threshold': sum(r["correct"] for r in results) / probes,
+            'rank1_accuracy': sum(r["rank1"] for r in results) / probes,
+            'roc_auc': auc,
+            'best_threshold': best_threshold,
+            'gallery_bytes': int(np.mean([r["bytes"] for r in results])),
+            'match_us_per_probe': sum(r["match_seconds"] for r in results) / probes * 1e6
+        })
+        row = rows[-1]
+        print(f"{name:>10}: rank-1 {row['rank1_accuracy']:.4f}, accuracy at {args.threshold} {row['accuracy_at_threshold']:.4f}, "
+              f"AUC {row['roc_auc']:.4f} (best threshold {row['best_threshold']:.3f}), "
+              f"variance kept {row['explained_variance']:.3f}, gallery {row['gallery_bytes'] / 1e3:.1f} kB, "
+              f"{row['match_us_per_probe']:.1f} us/probe")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    pd.DataFrame(rows).to_csv(REPORT_FILE, index=False)
+    print(f"\nSaved projection report to {REPORT_FILE}")
+
+    if not args.report_only:
+        # Projected scores are on another scale than model embeddings, so the service matches
+        # projected galleries with the threshold fitted here instead of SIMILARITY_THRESHOLD
+        written = [row for row in rows if row['projection'] == written_variant]
+        if not written:
+            raise SystemExit(f"Could not evaluate {written_variant}, so no similarity threshold can be saved with it")
+        source = args.gallery or ', '.join(args.images)
+        projection = EmbeddingProjection.fit(all_embeddings, args.dim, whiten=args.whiten, metadata={
+            "source": source,
+            "model": os.path.basename(args.model),
+            "persons": len(embeddings_by_person),
+            "embeddings": int(len(all_embeddings)),
+            "similarityThreshold": written[0]['best_threshold'],
+            "rocAuc": written[0]['roc_auc']
+        })
+        projection.save(args.output)
+        print(f"Wrote projection {projection.version} ({projection.input_dim} -> {projection.dim} dimensions, "
+              f"{projection.explained_variance:.3f} of the variance kept, similarity threshold "
+              f"{projection.similarity_threshold:.3f}) to {args.output}")
+        print("The service stores and matches galleries with it (and its threshold) from the next gallery replacement")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import json
+import os
+import struct
+import threading
+import numpy as np
+
+# Compact binary gallery format (.fnrg)
+#
+#   header      32 bytes, little endian: magic b'FNRG', format version (uint16),
+#               dtype code (uint8), reserved (uint8), dimension (uint32),
+#               persons (uint32), vectors (uint64), identity table bytes (uint64)
+#   identity    UTF-8 JSON {"names": [...], "counts": [...], "metadata": {...}};
+#               person i owns the next counts[i] vectors, in order
+#   vectors     (vectors, dimension) array of the stored dtype, 64-byte aligned
+#   scales      int8 only: one float32 scale per vector, 64-byte aligned
+#
+# Vectors are L2-normalized before they are stored. int8 vectors are quantized
+# symmetrically with their own scale (max |x| / 127).
+GALLERY_MAGIC = b'FNRG'
+GALLERY_FORMAT_VERSION = 1
+GALLERY_MIME = 'application/x-facenroll-gallery'
+HEADER = struct.Struct('<4sHBBIIQQ')
+ALIGNMENT = 64
+
+DTYPE_CODES = {'float32': 0, 'float16': 1, 'int8': 2}
+DTYPES = {code: name for name, code in DTYPE_CODES.items()}
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+# Function to L2-normalize and quantize vectors; returns (stored array, per-vector scales or None)
+def quantize(vectors, dtype='float16'):
+    if dtype not in DTYPE_CODES:
+        raise ValueError(f"Unknown gallery dtype '{dtype}', expected one of {tuple(DTYPE_CODES)}")
+    vectors = np.asarray(vectors, dtype=np.float32)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+    if dtype == 'float32':
+        return vectors, None
+    if dtype == 'float16':
+        return vectors.astype(np.float16), None
+
+    scales = np.abs(vectors).max(axis=-1, initial=0.0) / 127.0
+    scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+    quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales
+
+
+# Function to turn stored vectors back into float32
+def dequantize(stored, scales=None):
+    if scales is not None:
+        return stored.astype(np.float32) * scales[:, None]
+    return stored.astype(np.float32)
+
+
+# Function to encode a gallery (names, per-person counts, row vectors) into the binary format
+def encode_gallery(names, counts, vectors, dtype='float16', metadata=None):
+    n_vectors = int(np.sum(counts))
+    vectors = np.asarray(vectors, dtype=np.float32)
+    vectors = vectors.reshape(n_vectors, -1) if n_vectors else np.zeros((0, 0), dtype=np.float32)
+    stored, scales = quantize(vectors, dtype)
+    table = json.dumps({
+        "names": list(names),
+        "counts": [int(c) for c in counts],
+        "metadata": metadata or {}
+    }).encode('utf-8')
+
+    header = HEADER.pack(GALLERY_MAGIC, GALLERY_FORMAT_VERSION, DTYPE_CODES[dtype], 0,
+                         vectors.shape[1] if len(vectors) else 0, len(names), len(vectors), len(table))
+    parts = [header, table]
+    offset = len(header) + len(table)
+    for array in (stored, scales):
+        if array is None:
+            continue
+        padding = _aligned(offset) - offset
+        parts.append(b'\0' * padding)
+        parts.append(np.ascontiguousarray(array).tobytes())
+        offset += padding + array.nbytes
+    return b''.join(parts)
+
+
+# Function to decode the binary format; returns (names, counts, float32 vectors, info)
+# where info holds the dtype, format version and metadata stored with the gallery
+def decode_gallery(buffer):
+    buffer = memoryview(buffer)
+    if len(buffer) < HEADER.size:
+        raise ValueError("Gallery data is too short")
+    magic, version, dtype_code, _, dim, n_persons, n_vectors, table_len = HEADER.unpack_from(buffer, 0)
+    if magic != GALLERY_MAGIC:
+        raise ValueError("Not a FaceNRoll gallery file")
+    if version > GALLERY_FORMAT_VERSION:
+        raise ValueError(f"Gallery format version {version} is newer than supported ({GALLERY_FORMAT_VERSION})")
+    if version < 1:
+        raise ValueError(f"Invalid gallery format version {version}")
+    if dtype_code not in DTYPES:
+        raise ValueError(f"Unknown gallery dtype code {dtype_code}")
+
+    dtype = DTYPES[dtype_code]
+    if len(buffer) < HEADER.size + table_len:
+        raise ValueError("Gallery data is truncated (identity table)")
+    try:
+        table = json.loads(bytes(buffer[HEADER.size:HEADER.size + table_len]).decode('utf-8'))
+    except ValueError as e:
+        raise ValueError(f"Gallery identity table is corrupt: {str(e)}") from e
+    names = table["names"]
+    counts = np.asarray(table["counts"], dtype=np.int64)
+    if len(names) != n_persons or int(counts.sum()) != n_vectors:
+        raise ValueError("Gallery identity table does not match its header")
+
+    offset = _aligned(HEADER.size + table_len)
+    end = offset + n_vectors * dim * np.dtype(dtype).itemsize
+    if dtype == 'int8':
+        end = _aligned(end) + n_vectors * 4
+    if n_vectors and len(buffer) < end:
+        raise ValueError("Gallery data is truncated (vectors)")
+    stored = np.frombuffer(buffer, dtype=np.dtype(dtype), count=n_vectors * dim, offset=offset).reshape(n_vectors, dim)
+    scales = None
+    if dtype == 'int8':
+        offset = _aligned(offset + stored.nbytes)
+        scales = np.frombuffer(buffer, dtype=np.float32, count=n_vectors, offset=offset)
+
+    info = {"dtype": dtype, "formatVersion": version, "metadata": table.get("metadata", {})}
+    return names, counts, dequantize(stored, scales), info
+
+
+# Function to group decoded rows back into {person: (count, dim) array}
+def gallery_to_dict(names, counts, vectors):
+    offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+    return {name: vectors[offsets[i]:offsets[i + 1]] for i, name in enumerate(names)}
+
+
+# Function to flatten {person: embeddings} into (names, counts, vectors), skipping persons without embeddings
+def gallery_from_dict(embeddings_by_person):
+    names = []
+    counts = []
+    blocks = []
+    for person_name, embeddings in embeddings_by_person.items():
+        block = np.asarray(embeddings, dtype=np.float32)
+        if len(block) == 0:
+            continue
+        names.append(person_name)
+        counts.append(len(block))
+        blocks.append(block.reshape(len(block), -1))
+    vectors = np.concatenate(blocks) if blocks else np.zeros((0, 0), dtype=np.float32)
+    return names, counts, vectors
+
+
+# Function to write a gallery file atomically (readers never see a partially written file)
+def write_gallery(path, names, counts, vectors, dtype='float16', metadata=None):
+    data = encode_gallery(names, counts, vectors, dtype=dtype, metadata=metadata)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return len(data)
+
+
+# Function to read a gallery file; returns (names, counts, float32 vectors, info)
+def read_gallery(path):
+    with open(path, 'rb') as f:
+        return decode_gallery(f.read())
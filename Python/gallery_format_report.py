@@ -0,0 +1,95 @@
+import argparse
+import os
+import pickle
+import time
+import numpy as np
+import pandas as pd
+
+from face_matching import FaceMatcher
+from gallery_format import DTYPE_CODES, encode_gallery, decode_gallery, gallery_to_dict, gallery_from_dict, read_gallery
+from ann_benchmark import make_synthetic_gallery, EMBEDDING_DIM
+
+# Configuration
+RESULTS_DIR = 'validation_results'
+REPORT_FILE = os.path.join(RESULTS_DIR, 'gallery_format_accuracy.csv')
+
+
+# Function to load a gallery from a .fnrg file or a legacy pickle of {person: embeddings}
+def load_any_gallery(path):
+    if path.endswith('.pkl'):
+        with open(path, 'rb') as f:
+            return {name: np.asarray(embeddings, dtype=np.float32) for name, embeddings in pickle.load(f).items()}
+    names, counts, vectors, _ = read_gallery(path)
+    return gallery_to_dict(names, counts, vectors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Size, load time and scoring accuracy of each gallery storage dtype against float32")
+    parser.add_argument('--gallery', help="Gallery file (.fnrg or legacy .pkl); a synthetic gallery is used when omitted")
+    parser.add_argument('--identities', type=int, default=2000)
+    parser.add_argument('--images-per-identity', type=int, default=5)
+    parser.add_argument('--noise', type=float, default=1.0, help="Per-embedding noise norm relative to the identity vector")
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--threshold', type=float, default=0.4)
+    parser.add_argument('--reduction', default='mean', choices=['mean', 'max', 'topk'])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.gallery:
+        print(f"Loading gallery from {args.gallery}...")
+        gallery = load_any_gallery(args.gallery)
+        names, counts, vectors = gallery_from_dict(gallery)
+        # Probes are stored embeddings with a little noise added; the true identity is their owner
+        probe_rows = rng.choice(len(vectors), args.queries)
+        noise = 0.1 * rng.standard_normal((args.queries, vectors.shape[1])).astype(np.float32)
+        probes = vectors[probe_rows] / np.linalg.norm(vectors[probe_rows], axis=1, keepdims=True) + noise / np.sqrt(vectors.shape[1])
+        true_names = np.repeat(names, counts)[probe_rows]
+    else:
+        print(f"Building synthetic gallery: {args.identities} identities x {args.images_per_identity} embeddings...")
+        gallery, identities = make_synthetic_gallery(args.identities, args.images_per_identity, args.noise, rng)
+        names, counts, vectors = gallery_from_dict(gallery)
+        probe_ids = rng.choice(args.identities, args.queries)
+        probes = identities[probe_ids] + args.noise * rng.standard_normal((args.queries, EMBEDDING_DIM)).astype(np.float32) / np.sqrt(EMBEDDING_DIM)
+        true_names = np.array([f"person_{i}" for i in probe_ids])
+
+    # Reference: float32 scores and decisions
+    reference_matcher = FaceMatcher(gallery)
+    reference_scores = reference_matcher.score(probes, reduction=args.reduction)
+    reference_names, _, _ = reference_matcher.match_batch(probes, args.threshold, reduction=args.reduction)
+    legacy_bytes = len(pickle.dumps({name: [list(map(float, row)) for row in block] for name, block in gallery.items()}))
+
+    rows = []
+    for dtype in DTYPE_CODES:
+        data = encode_gallery(names, counts, vectors, dtype=dtype)
+
+        start_time = time.time()
+        decoded_names, decoded_counts, decoded_vectors, _ = decode_gallery(data)
+        matcher = FaceMatcher(gallery_to_dict(decoded_names, decoded_counts, decoded_vectors))
+        load_time = time.time() - start_time
+
+        scores = matcher.score(probes, reduction=args.reduction)
+        matched_names, _, _ = matcher.match_batch(probes, args.threshold, reduction=args.reduction)
+        delta = np.abs(scores - reference_scores)
+        rows.append({
+            'dtype': dtype,
+            'bytes': len(data),
+            'compression_vs_pickle': legacy_bytes / len(data),
+            'load_ms': load_time * 1000,
+            'max_abs_score_delta': float(delta.max()),
+            'mean_abs_score_delta': float(delta.mean()),
+            'decision_agreement': float(np.mean([a == b for a, b in zip(matched_names, reference_names)])),
+            'accuracy': float(np.mean([a == b for a, b in zip(matched_names, true_names)]))
+        })
+        row = rows[-1]
+        print(f"{dtype:>8}: {row['bytes'] / 1e6:8.2f} MB ({row['compression_vs_pickle']:.1f}x smaller than pickle), "
+              f"load {row['load_ms']:.1f} ms, max |delta| {row['max_abs_score_delta']:.2e}, "
+              f"agreement {row['decision_agreement']:.4f}, accuracy {row['accuracy']:.4f}")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    pd.DataFrame(rows).to_csv(REPORT_FILE, index=False)
+    print(f"Saved gallery format report to {REPORT_FILE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+import glob
+import json
+import os
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialized within one process
+    fcntl = None
+
+from embedding_projection import EmbeddingProjection
+from face_matching import FaceMatcher, l2_normalize
+
+STORE_FORMAT_VERSION = 2
+INDEX_FILE = 'index.json'
+LOCK_FILE = 'write.lock'
+
+
+class GalleryStore:
+    """
+    Memory-mapped on-disk gallery.
+
+    L2-normalized float32 embeddings live in an append-only segment file and
+    per-person mean vectors (centroids) in a second one. A small JSON index
+    names the segment files and maps every person to a row range and a
+    centroid row. Updates append the changed persons' rows first and then
+    atomically replace the index, so a reader (another thread or another
+    worker process) always sees a complete gallery.
+
+    Loading only maps the files: startup time does not grow with the roster,
+    and every process mapping the same files shares one copy in the page
+    cache. Rows of replaced or removed persons stay in the segment until they
+    outnumber the live ones; the store is then compacted into a new
+    generation of files.
+
+    With a projection (see embedding_projection.py) rows are stored in the
+    projected space. A copy of the projection is written next to the segments
+    and named in the index, and every update of that gallery reuses it; a
+    different projection only takes over when the whole gallery is replaced.
+
+    Writers in several processes (e.g. the prefork workers of serve.py) are
+    serialized with a lock file; every update starts from the committed index,
+    so no process overwrites another's changes. Readers notice new versions
+    through index_stamp.
+    """
+
+    def __init__(self, directory, compact_ratio=1.0, projection=None):
+        self.directory = directory
+        self.compact_ratio = compact_ratio
+        self.projection = projection  # Used for the rows of the next replaced gallery
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        self.lock_path = os.path.join(directory, LOCK_FILE)
+        self._lock = threading.Lock()
+        self._projections = {}  # Projections read from the store, by version
+        os.makedirs(directory, exist_ok=True)
+
+    def exists(self):
+        return os.path.exists(self.index_path)
+
+    # Stamp of the index file; changes whenever a new gallery version is committed (the index
+    # is replaced by a new file every time, so its inode changes even within one clock tick)
+    def index_stamp(self):
+        try:
+            stat = os.stat(self.index_path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    # Hold the store's write lock: the thread lock, plus an exclusive lock on the lock file
+    # against writers in other processes
+    @contextmanager
+    def _write_lock(self):
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def read_index(self):
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return None
+        if index.get("formatVersion", 0) > STORE_FORMAT_VERSION:
+            raise ValueError(f"Gallery store format {index['formatVersion']} is newer than supported ({STORE_FORMAT_VERSION})")
+        return index
+
+    def _map(self, file_name, rows, dim):
+        if rows == 0 or dim == 0:
+            return np.zeros((0, dim), dtype=np.float32)
+        return np.memmap(os.path.join(self.directory, file_name), dtype=np.float32, mode='r', shape=(rows, dim))
+
+    # Projection the index's rows were made with (None for unprojected galleries)
+    def index_projection(self, index):
+        entry = index.get("projection")
+        if entry is None:
+            return None
+        projection = self._projections.get(entry["version"])
+        if projection is None:
+            projection = EmbeddingProjection.load(os.path.join(self.directory, entry["file"]))
+            if projection.version != entry["version"]:
+                raise ValueError(f"Projection file {entry['file']} does not match the gallery index")
+            self._projections[entry["version"]] = projection
+        return projection
+
+    # Copy a projection into the store; returns its index entry
+    def _store_projection(self, projection):
+        if projection is None:
+            return None
+        file_name = f"projection-{projection.version}.npz"
+        if not os.path.exists(os.path.join(self.directory, file_name)):
+            projection.save(os.path.join(self.directory, file_name))
+        self._projections[projection.version] = projection
+        return {"file": file_name, "version": projection.version, "inputDim": projection.input_dim, "dim": projection.dim}
+
+    # Map the committed gallery; returns (matcher, version), or (None, None) when the store is empty
+    def load_matcher(self):
+        index = self.read_index()
+        if index is None:
+            return None, None
+
+        dim = index["dim"]
+        persons = index["persons"]
+        matrix = self._map(index["vectorsFile"], index["rows"], dim)
+        centroid_rows = self._map(index["centroidsFile"], index["centroidRows"], dim)
+        if persons:
+            centroids = np.ascontiguousarray(centroid_rows[[person["centroid"] for person in persons]])
+        else:
+            centroids = np.zeros((0, dim), dtype=np.float32)
+
+        matcher = FaceMatcher.from_rows(
+            [person["name"] for person in persons],
+            [person["start"] for person in persons],
+            [person["count"] for person in persons],
+            matrix,
+            centroids,
+            self.index_projection(index)
+        )
+        return matcher, index["version"]
+
+    # Append rows to a segment file after dropping anything past the committed rows
+    # (left over from an update that was interrupted before its index was written)
+    def _append(self, file_name, committed_rows, dim, vectors):
+        path = os.path.join(self.directory, file_name)
+        with open(path, 'r+b' if os.path.exists(path) else 'w+b') as f:
+            f.truncate(committed_rows * dim * 4)
+            f.seek(0, os.SEEK_END)
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        return committed_rows + len(vectors)
+
+    def _write_index(self, index):
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.index_path)
+
+    # Append persons ([(name, normalized rows)]) to the index's segments; returns their index entries
+    def _append_persons(self, index, persons):
+        if not persons:
+            return []
+        entries = []
+        start = index["rows"]
+        for i, (person_name, rows) in enumerate(persons):
+            entries.append({"name": person_name, "start": start, "count": len(rows), "centroid": index["centroidRows"] + i})
+            start += len(rows)
+        dim = index["dim"]
+        index["rows"] = self._append(index["vectorsFile"], index["rows"], dim, np.concatenate([rows for _, rows in persons]))
+        index["centroidRows"] = self._append(index["centroidsFile"], index["centroidRows"], dim,
+                                             np.stack([rows.mean(axis=0) for _, rows in persons]))
+        return entries
+
+    # Delete segment files that the committed index no longer refers to. Files still mapped
+    # elsewhere may refuse deletion on Windows; they are retried on the next rewrite.
+    def _remove_stale_files(self, index):
+        keep = {index["vectorsFile"], index["centroidsFile"]}
+        if index.get("projection"):
+            keep.add(index["projection"]["file"])
+        for path in glob.glob(os.path.join(self.directory, '*.f32')) + glob.glob(os.path.join(self.directory, 'projection-*.npz')):
+            if os.path.basename(path) not in keep:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    # Write persons ([(name, normalized rows)]) as a fresh generation of segment files
+    def _rewrite(self, persons, version, dim, generation, projection=None):
+        index = {
+            "formatVersion": STORE_FORMAT_VERSION,
+            "generation": generation,
+            "vectorsFile": f"vectors-{generation}.f32",
+            "centroidsFile": f"centroids-{generation}.f32",
+            "dim": dim,
+            "rows": 0,
+            "centroidRows": 0,
+            "persons": [],
+            "projection": projection,
+            "version": str(version)
+        }
+        index["persons"] = self._append_persons(index, persons)
+        self._write_index(index)
+        self._remove_stale_files(index)
+        return index
+
+    # Normalize (and project) each person's rows; persons without embeddings are skipped
+    @staticmethod
+    def _normalized_persons(embeddings_by_person, projection=None):
+        persons = []
+        for person_name, embeddings in embeddings_by_person.items():
+            rows = np.asarray(embeddings, dtype=np.float32)
+            if len(rows):
+                rows = rows.reshape(len(rows), -1)
+                persons.append((person_name, projection.project_rows(rows) if projection is not None else l2_normalize(rows)))
+        return persons
+
+    # Replace the whole gallery (stored with the store's current projection)
+    def replace(self, embeddings_by_person, version):
+        with self._write_lock():
+            old = self.read_index()
+            persons = self._normalized_persons(embeddings_by_person, self.projection)
+            if persons:
+                dim = persons[0][1].shape[1]
+            elif self.projection is not None:
+                dim = self.projection.dim
+            else:
+                dim = old["dim"] if old and not old.get("projection") else 0
+            return self._rewrite(persons, version, dim, old["generation"] + 1 if old else 1,
+                                 self._store_projection(self.projection))
+
+    # Add or replace persons and delete the persons named in `removed`; persons given without
+    # embeddings are left unchanged. The returned index also names the version it was applied
+    # to ("previousVersion"), which is not the caller's own last version when another process
+    # committed in between.
+    def update(self, embeddings_by_person, version, removed=()):
+        with self._write_lock():
+            old = self.read_index()
+            if old is None:
+                persons = self._normalized_persons(embeddings_by_person, self.projection)
+                dim = persons[0][1].shape[1] if persons else (self.projection.dim if self.projection is not None else 0)
+                index = self._rewrite(persons, version, dim, 1, self._store_projection(self.projection))
+                return dict(index, previousVersion=None)
+
+            # New rows are made with the gallery's own projection, so they match its existing rows
+            index = dict(old)
+            changed = self._normalized_persons(embeddings_by_person, self.index_projection(old))
+            if changed and index["rows"] == 0:
+                index["dim"] = changed[0][1].shape[1]
+            for person_name, rows in changed:
+                if rows.shape[1] != index["dim"]:
+                    raise ValueError(f"Embedding dimension {rows.shape[1]} does not match the gallery ({index['dim']})")
+
+            # Existing persons keep their position (so person indices stay stable), new ones are appended
+            positions = {person["name"]: i for i, person in enumerate(old["persons"])}
+            persons = list(old["persons"])
+            for entry in self._append_persons(index, changed):
+                if entry["name"] in positions:
+                    persons[positions[entry["name"]]] = entry
+                else:
+                    persons.append(entry)
+            removed = set(removed)
+            index["persons"] = [person for person in persons if person["name"] not in removed]
+            index["version"] = str(version)
+
+            live_rows = sum(person["count"] for person in index["persons"])
+            if index["rows"] - live_rows > self.compact_ratio * live_rows:
+                matrix = self._map(index["vectorsFile"], index["rows"], index["dim"])
+                live = [(person["name"], np.asarray(matrix[person["start"]:person["start"] + person["count"]]))
+                        for person in index["persons"]]
+                index = self._rewrite(live, version, index["dim"], index["generation"] + 1, index.get("projection"))
+                return dict(index, previousVersion=old["version"])
+
+            self._write_index(index)
+            return dict(index, previousVersion=old["version"])
+
+    def stats(self):
+        index = self.read_index()
+        if index is None:
+            return {"directory": os.path.abspath(self.directory), "persons": 0}
+        live_rows = sum(person["count"] for person in index["persons"])
+        return {
+            "directory": os.path.abspath(self.directory),
+            "version": index["version"],
+            "generation": index["generation"],
+            "persons": len(index["persons"]),
+            "liveRows": live_rows,
+            "deadRows": index["rows"] - live_rows,
+            "dim": index["dim"],
+            "projection": index["projection"]["version"] if index.get("projection") else None,
+            "segmentBytes": index["rows"] * index["dim"] * 4
+        }
@@ -2,31 +2,20 @@ import cv2
 import os
 import numpy as np
 import tensorflow as tf
-from tensorflow.keras.models import load_model
-import pickle
+from face_model import load_embedding_model, resize_faces, vgg_preprocess
+from gallery_format import gallery_from_dict, read_gallery, write_gallery
 
 # Configuration
 MODEL_FOLDER = 'vgg_model'
 FEATURE_MODEL_PATH = os.path.join(MODEL_FOLDER, 'vggface_features.h5')
 FACES_DIR = 'faces'
-OUTPUT_FILE = 'face_embeddings.pkl'
-
-# Function to preprocess image for VGG model
-def preprocess_image(img):
-    # Resize to 224x224 (VGG input size)
-    resized = cv2.resize(img, (224, 224))
-    # Convert from BGR to RGB (OpenCV uses BGR, but model expects RGB)
-    rgb_img = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
-    # Normalize pixel values
-    normalized = rgb_img / 255.0
-    # Add batch dimension
-    preprocessed = np.expand_dims(normalized, axis=0)
-    return preprocessed
+OUTPUT_FILE = 'face_gallery_vgg.fnrg'  # Compact binary gallery (see gallery_format.py)
+GALLERY_STORAGE_DTYPE = 'float16'
 
 # Function to extract face embeddings using VGG model
+# (the wrapper converts BGR to RGB and normalizes pixel values to [0, 1])
 def extract_vgg_features(face_img):
-    preprocessed = preprocess_image(face_img)
-    features = vgg_feature_model.predict(preprocessed, verbose=0)
+    features = vgg_feature_model.embed(resize_faces([face_img]))
     return features[0]  # Return the feature vector
 
 def main():
@@ -34,7 +23,7 @@ def main():
     print("Loading VGG Face feature extraction model...")
     try:
         global vgg_feature_model
-        vgg_feature_model = load_model(FEATURE_MODEL_PATH)
+        vgg_feature_model = load_embedding_model(FEATURE_MODEL_PATH, preprocess=vgg_preprocess, batch_sizes=(1,))
         print("Model loaded successfully!")
     except Exception as e:
         print(f"Error loading model: {str(e)}")
@@ -94,9 +83,13 @@ def main():
     
     # Save embeddings to file
     print(f"Saving embeddings to {OUTPUT_FILE}...")
-    with open(OUTPUT_FILE, 'wb') as f:
-        pickle.dump(embeddings_data, f)
-    print("Embeddings saved successfully!")
+    saved_bytes = write_gallery(OUTPUT_FILE, *gallery_from_dict(embeddings_data), dtype=GALLERY_STORAGE_DTYPE,
+                                metadata={"model": os.path.basename(FEATURE_MODEL_PATH)})
+    print(f"Embeddings saved successfully ({saved_bytes} bytes)!")
+    
+    # Read the file back to check it loads
+    names, counts, vectors, info = read_gallery(OUTPUT_FILE)
+    print(f"Verified {OUTPUT_FILE}: {len(names)} persons, {len(vectors)} embeddings ({info['dtype']})")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
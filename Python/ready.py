@@ -6,6 +6,7 @@ from tensorflow.keras.models import Model, load_model
 from tensorflow.keras.layers import Input, Dense, Dropout, BatchNormalization, GlobalAveragePooling2D
 from tensorflow.keras.preprocessing import image
 from tensorflow.keras.utils import get_file
+from face_model import resnet_preprocess
 
 # Check TensorFlow version
 print(f"TensorFlow version: {tf.__version__}")
@@ -86,18 +87,11 @@ else:
 # Preprocessing function for ResNet50
 def preprocess_input(x):
     """
-    Preprocesses images for ResNet50
+    Preprocesses RGB images for ResNet50 with the same mean subtraction
+    the service runs inside its model graph (see face_model.py)
     """
-    # Standard ResNet50 preprocessing
-    x_temp = x.copy()
-    # Convert to BGR
-    x_temp = x_temp[..., ::-1]
-    # Zero-center by mean pixel values
-    x_temp[..., 0] -= 91.4953
-    x_temp[..., 1] -= 103.8827
-    x_temp[..., 2] -= 131.0912
-    
-    return x_temp
+    # Convert to BGR, then zero-center by mean pixel values
+    return resnet_preprocess(x[..., ::-1]).numpy()
 
 # Function to load and prepare an image
 def load_and_prepare_image(image_path):
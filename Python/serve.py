@@ -0,0 +1,171 @@
+import argparse
+import os
+import signal
+import socket
+import time
+import traceback
+
+# Production entry point for the face recognition service.
+#
+# Requests are accepted by a pool of server threads (waitress when installed,
+# otherwise Werkzeug's threaded server) that only parse requests and write
+# responses. The CPU-bound work of every recognition/enrollment endpoint runs
+# on the bounded executor in app.py; once its queue is full, requests are
+# rejected with 429 instead of piling up behind each other.
+#
+# By default the model, detectors and inference path are warmed up in the
+# background right away: /api/health/live answers at once, /api/health/ready
+# returns 503 until the warm-up has finished.
+#
+# With --workers N (POSIX only) the listening socket is opened once and N
+# worker processes are forked to accept on it, each running the service with
+# cores / N model threads. The parent never imports TensorFlow: it is not
+# fork-safe once its thread pools exist, so every worker loads the model after
+# the fork. The gallery is shared through the memory-mapped gallery store (one
+# page-cache copy for all workers; see gallery_store.py); a change committed by
+# one worker is picked up by the others within GALLERY_STORE_POLL_SECONDS.
+# Crashed workers are restarted.
+
+
+# Function to count the cores this process may run on
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+# Function to import and configure the service in this process; returns the app module
+def load_service(args, inference_threads=None, enrollment_workers=None):
+    import app as face_service
+
+    if inference_threads:
+        # One inter-op thread: a worker's cores go to the intra-op pool of the one model call running at a time
+        face_service.configure_inference_threads(inference_threads, 1, enrollment_workers=enrollment_workers)
+    face_service.configure_serving(args.max_concurrency or face_service.SERVING_MAX_CONCURRENCY,
+                                   args.max_queue_depth or face_service.SERVING_MAX_QUEUE_DEPTH)
+    if args.warm_up != 'off':
+        face_service.start_warm_up(background=args.warm_up == 'background')
+    return face_service
+
+
+# Function to serve the app on the given listening socket, or on host:port when there is none
+def run_server(face_service, args, sock=None):
+    try:
+        from waitress import serve
+    except ImportError:
+        serve = None
+
+    if serve is not None:
+        if sock is not None:
+            serve(face_service.app, sockets=[sock], threads=args.threads)
+        else:
+            serve(face_service.app, host=args.host, port=args.port, threads=args.threads)
+        return
+
+    print("waitress is not installed, falling back to the threaded Werkzeug server")
+    if sock is not None:
+        from werkzeug.serving import make_server
+        make_server(args.host, args.port, face_service.app, threaded=True, fd=sock.fileno()).serve_forever()
+    else:
+        face_service.app.run(host=args.host, port=args.port, threaded=True, debug=False)
+
+
+# Function run in a forked worker: load the service with its share of the cores and serve the shared socket
+def run_worker(args, sock, worker_index, inference_threads):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    print(f"Worker {worker_index} (pid {os.getpid()}) starting with {inference_threads} inference threads")
+    face_service = load_service(args, inference_threads, enrollment_workers=inference_threads)
+    run_server(face_service, args, sock)
+
+
+# Function to fork the workers and restart any that exits, until the server is stopped
+def serve_prefork(args):
+    cores = available_cores()
+    inference_threads = args.inference_threads or max(1, cores // args.workers)
+    sock = socket.create_server((args.host, args.port), backlog=2048)
+    sock.set_inheritable(True)
+    print(f"Serving face recognition API on {args.host}:{args.port} with {args.workers} worker processes "
+          f"({inference_threads} inference threads each on {cores} cores, {args.threads} server threads, "
+          f"{args.max_concurrency or 'default'} concurrent requests per worker)")
+
+    workers = {}  # pid -> worker index
+    stopping = False
+
+    def spawn(worker_index):
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                run_worker(args, sock, worker_index, inference_threads)
+                status = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(status)
+        workers[pid] = worker_index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for worker_index in range(args.workers):
+        spawn(worker_index)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        worker_index = workers.pop(pid, None)
+        if worker_index is None or stopping:
+            continue
+        print(f"Worker {worker_index} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}, restarting")
+        time.sleep(1)  # Do not spin when a worker fails right at startup
+        if not stopping:
+            spawn(worker_index)
+    sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the FaceNRoll face recognition API")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--threads', type=int, default=16,
+                        help="Server threads accepting connections and parsing requests (per worker)")
+    parser.add_argument('--max-concurrency', type=int,
+                        help="Requests whose CPU-bound work may run at the same time (per worker; default SERVING_MAX_CONCURRENCY)")
+    parser.add_argument('--max-queue-depth', type=int,
+                        help="Requests allowed to wait for a work slot before new ones get 429 (per worker; default SERVING_MAX_QUEUE_DEPTH)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Worker processes sharing the listening socket and the gallery store (0 = one per 4 cores)")
+    parser.add_argument('--inference-threads', type=int, default=0,
+                        help="Model threads per worker (0 = cores / workers)")
+    parser.add_argument('--warm-up', choices=['background', 'blocking', 'off'], default='background',
+                        help="Warm up while already accepting requests, before accepting them, or not at all (lazy loading)")
+    args = parser.parse_args()
+
+    if args.workers == 0:
+        args.workers = max(1, available_cores() // 4)
+    if args.workers > 1:
+        if not hasattr(os, 'fork'):
+            parser.error("--workers needs os.fork (POSIX); run one worker on this platform")
+        serve_prefork(args)
+        return
+
+    face_service = load_service(args, args.inference_threads or available_cores())
+    print(f"Serving face recognition API on {args.host}:{args.port} "
+          f"({args.threads} server threads, {face_service.work_limiter.max_concurrency} workers, "
+          f"queue depth {face_service.work_limiter.max_queue_depth}, {face_service.INFERENCE_THREADS} inference threads)")
+    run_server(face_service, args)
+
+
+if __name__ == "__main__":
+    main()
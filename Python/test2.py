@@ -1,19 +1,27 @@
 import cv2
+import hashlib
 import os
 import datetime
 import numpy as np
 import tensorflow as tf
-from tensorflow.keras.models import load_model
-from scipy.spatial.distance import cosine
 import mediapipe as mp
 import h5py
 import time
 from collections import defaultdict, Counter
+from face_matching import FaceMatcher
+from face_model import FACE_SIZE
+from face_pipeline import FacePipeline, PipelineConfig
+from gallery_format import gallery_from_dict, gallery_to_dict, read_gallery, write_gallery
+from gallery_store import GalleryStore
 
 # Configuration
 MODEL_FOLDER = 'resnet50_model'
 FEATURE_MODEL_PATH = os.path.join(MODEL_FOLDER, 'resnet50_face_features.h5')
 KNOWN_FACES_DIR = 'faces'
+DATA_DIR = os.environ.get('FACENROLL_DATA_DIR', '')  # The service's data directory (DATA_DIR in app.py)
+GALLERY_STORE_DIR = os.path.join(DATA_DIR, 'gallery_store')  # Memory-mapped gallery kept up to date by app.py
+GALLERY_FILE = 'face_gallery.fnrg'  # Embeddings of faces/, rebuilt when faces/ changes (or a gallery exported from app.py)
+GALLERY_STORAGE_DTYPE = 'float16'
 ATTENDANCE_FILE = 'attendance.csv'
 SIMILARITY_THRESHOLD = 0.4  # Adjusted for ResNet50 (higher value means more similar)
 
@@ -40,151 +48,117 @@ try:
     tf.config.threading.set_intra_op_parallelism_threads(4)
     tf.config.threading.set_inter_op_parallelism_threads(4)
     
-    # Load model
-    resnet_feature_model = load_model(FEATURE_MODEL_PATH)
+    # Face pipeline shared with the recognition service: MediaPipe detection, alignment,
+    # embedding (pre-traced graphs for single frames and enrollment batches) and matching
+    face_pipeline = FacePipeline(PipelineConfig(
+        face_size=FACE_SIZE,
+        model_path=FEATURE_MODEL_PATH,
+        model_batch_sizes=(1, 4, 16),
+        inference_threads=4,
+        similarity_threshold=SIMILARITY_THRESHOLD
+    ))
+    face_pipeline.model  # Load and warm up the model now
     print("Model loaded successfully!")
 except Exception as e:
     print(f"Error loading model: {str(e)}")
     exit(1)
 
-# Initialize MediaPipe Face Detection
-mp_face_detection = mp.solutions.face_detection
+# MediaPipe drawing helpers (the face detector is owned by the face pipeline)
 mp_drawing = mp.solutions.drawing_utils
-face_detection = mp_face_detection.FaceDetection(
-    model_selection=1,  # 0=closer faces, 1=longer distance faces
-    min_detection_confidence=0.5
-)
 
-# Function to perform face alignment using eye centers
-def align_face(image, landmarks):
-    # Extract eye landmarks (MediaPipe provides normalized coordinates)
-    h, w, _ = image.shape
-    
-    # Convert to absolute coordinates (rough estimate from MediaPipe landmarks)
-    left_eye_x = int(landmarks.location_data.relative_keypoints[0].x * w)
-    left_eye_y = int(landmarks.location_data.relative_keypoints[0].y * h)
-    right_eye_x = int(landmarks.location_data.relative_keypoints[1].x * w)
-    right_eye_y = int(landmarks.location_data.relative_keypoints[1].y * h)
-    
-    # Calculate angle
-    dx = right_eye_x - left_eye_x
-    dy = right_eye_y - left_eye_y
-    angle = np.degrees(np.arctan2(dy, dx))
-    
-    # Get rotation matrix
-    center = ((left_eye_x + right_eye_x) // 2, (left_eye_y + right_eye_y) // 2)
-    rotation_matrix = cv2.getRotationMatrix2D(center, angle, scale=1.0)
-    
-    # Apply rotation
-    aligned_image = cv2.warpAffine(image, rotation_matrix, (w, h), flags=cv2.INTER_CUBIC)
-    
-    return aligned_image
+attended_persons = set()  # To avoid duplicate attendance entries
 
-# Function to preprocess image for ResNet50 model
-def preprocess_image(img):
-    # Resize to 224x224 (ResNet input size)
-    resized = cv2.resize(img, (224, 224))
-    # Convert from BGR to RGB (OpenCV uses BGR, but model expects RGB)
-    rgb_img = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
-    
-    # Convert to float32 BEFORE subtraction
-    bgr_img = rgb_img[..., ::-1].copy().astype(np.float32)
-    
-    # Zero-center by mean pixel values
-    bgr_img[..., 0] -= 91.4953
-    bgr_img[..., 1] -= 103.8827
-    bgr_img[..., 2] -= 131.0912
-    
-    # Add batch dimension
-    preprocessed = np.expand_dims(bgr_img, axis=0)
-    return preprocessed
+# Map the gallery store written by the recognition service when there is one (near-instant);
+# the kiosk only reads the store, so it is not opened (which would create the directory) otherwise
+face_matcher = None
+gallery_store = GalleryStore(GALLERY_STORE_DIR) if os.path.isdir(GALLERY_STORE_DIR) else None
+if gallery_store is not None and gallery_store.exists():
+    try:
+        face_matcher, gallery_version = gallery_store.load_matcher()
+        print(f"Mapped gallery version {gallery_version} from {GALLERY_STORE_DIR}")
+    except Exception as e:
+        print(f"Could not load gallery store {GALLERY_STORE_DIR}: {str(e)}")
 
-# Function to extract face embeddings using ResNet50 model
-def extract_resnet_features(face_img):
-    preprocessed = preprocess_image(face_img)
-    features = resnet_feature_model.predict(preprocessed, verbose=0)
-    return features[0]  # Return the feature vector
+# Function to fingerprint the photos under KNOWN_FACES_DIR (paths, sizes and modification times)
+def known_faces_fingerprint():
+    digest = hashlib.sha1()
+    for root, _, files in sorted(os.walk(KNOWN_FACES_DIR)):
+        for file_name in sorted(files):
+            if file_name.lower().endswith(('.png', '.jpg', '.jpeg')):
+                path = os.path.join(root, file_name)
+                stat = os.stat(path)
+                digest.update(f"{os.path.relpath(path, KNOWN_FACES_DIR)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode('utf-8'))
+    return digest.hexdigest()
 
-# Function to detect face using MediaPipe and return cropped face
-def detect_and_crop_face(image):
-    # Convert the BGR image to RGB
-    rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    # Process the image
-    results = face_detection.process(rgb_image)
-    
-    if not results.detections:
-        return None, None
-    
-    # Get the first detected face
-    detection = results.detections[0]
-    bboxC = detection.location_data.relative_bounding_box
-    
-    # Convert normalized coordinates to absolute pixel values
-    ih, iw, _ = image.shape
-    x = int(bboxC.xmin * iw)
-    y = int(bboxC.ymin * ih)
-    w = int(bboxC.width * iw)
-    h = int(bboxC.height * ih)
-    
-    # Ensure coordinates are within image boundaries
-    x = max(0, x)
-    y = max(0, y)
-    w = min(w, iw - x)
-    h = min(h, ih - y)
-    
-    # Crop the face
-    face_img = image[y:y+h, x:x+w]
-    
-    # Try to align the face if landmarks are available
+# Otherwise load known faces from the gallery file when it exists: a file written by an earlier run is
+# only used while faces/ is unchanged; a gallery exported from app.py (GET /api/gallery/export, no
+# fingerprint) is used as it is
+known_faces = None
+faces_fingerprint = known_faces_fingerprint()
+if face_matcher is None and os.path.exists(GALLERY_FILE):
     try:
-        aligned_face = align_face(image, detection)
-        # Re-crop the aligned face using the same boundaries
-        aligned_face_crop = aligned_face[y:y+h, x:x+w]
-        if aligned_face_crop.size > 0:
-            face_img = aligned_face_crop
+        names, counts, vectors, info = read_gallery(GALLERY_FILE)
+        stored_fingerprint = info["metadata"].get("knownFaces")
+        if info["metadata"].get("model", os.path.basename(FEATURE_MODEL_PATH)) != os.path.basename(FEATURE_MODEL_PATH):
+            print(f"Gallery file {GALLERY_FILE} was built with another model, recomputing embeddings")
+        elif stored_fingerprint is not None and stored_fingerprint != faces_fingerprint:
+            print(f"Photos in {KNOWN_FACES_DIR} changed since {GALLERY_FILE} was written, recomputing embeddings")
+        elif info["metadata"].get("projection"):
+            # Projected vectors can only be matched through their projection, which the gallery store keeps
+            print(f"Gallery file {GALLERY_FILE} holds projected embeddings, recomputing embeddings")
+        else:
+            known_faces = gallery_to_dict(names, counts, vectors)
+            print(f"Loaded gallery from {GALLERY_FILE} ({info['dtype']})")
+            if stored_fingerprint is None:
+                print(f"  (exported gallery: photos added to {KNOWN_FACES_DIR} are not enrolled until it is deleted)")
     except Exception as e:
-        print(f"Warning: Face alignment failed: {e}")
-    
-    return face_img, (x, y, w, h)
+        print(f"Could not load gallery file {GALLERY_FILE}: {str(e)}")
 
-# Load known faces and compute their embeddings
-print("Loading known faces and computing embeddings...")
-known_faces = {}
-attended_persons = set()  # To avoid duplicate attendance entries
+# Otherwise compute the embeddings of the known faces and save them for the next start
+if face_matcher is None and known_faces is None:
+    print("Loading known faces and computing embeddings...")
+    known_faces = {}
 
-# Process each person's directory
-for person_name in os.listdir(KNOWN_FACES_DIR):
-    person_path = os.path.join(KNOWN_FACES_DIR, person_name)
-    if os.path.isdir(person_path):
-        known_faces[person_name] = []
-        print(f"Processing images for: {person_name}")
-        
-        # Process each image in the person's directory
-        for img_name in os.listdir(person_path):
-            if img_name.lower().endswith(('.png', '.jpg', '.jpeg')):
-                img_path = os.path.join(person_path, img_name)
-                try:
-                    # Load image
+    # Process each person's directory
+    for person_name in os.listdir(KNOWN_FACES_DIR):
+        person_path = os.path.join(KNOWN_FACES_DIR, person_name)
+        if os.path.isdir(person_path):
+            known_faces[person_name] = []
+            print(f"Processing images for: {person_name}")
+            
+            # Load every image in the person's directory
+            img_names = []
+            images = []
+            for img_name in os.listdir(person_path):
+                if img_name.lower().endswith(('.png', '.jpg', '.jpeg')):
+                    img_path = os.path.join(person_path, img_name)
                     img = cv2.imread(img_path)
                     if img is None:
                         print(f"Could not read image: {img_path}")
                         continue
-                    
-                    # Detect and crop face using MediaPipe
-                    face_img, face_coords = detect_and_crop_face(img)
-                    
-                    if face_img is not None and face_img.size > 0:
-                        # Extract features and store
-                        embedding = extract_resnet_features(face_img)
-                        known_faces[person_name].append(embedding)
-                        print(f"  Processed: {img_name}")
-                    else:
-                        print(f"  No face detected in: {img_name}")
-                
-                except Exception as e:
-                    print(f"  Error processing {img_path}: {str(e)}")
+                    img_names.append(img_name)
+                    images.append(img)
+            
+            # Detect, align and embed the person's faces as one batch
+            try:
+                face_imgs, owners = face_pipeline.detect_and_align(images)
+                embeddings = face_pipeline.embed(face_imgs)
+                found = {image_index for image_index, _, _ in owners}
+                known_faces[person_name].extend(embeddings)
+                for image_index, img_name in enumerate(img_names):
+                    print(f"  Processed: {img_name}" if image_index in found else f"  No face detected in: {img_name}")
+            except Exception as e:
+                print(f"  Error processing images of {person_name}: {str(e)}")
+        
+    write_gallery(GALLERY_FILE, *gallery_from_dict(known_faces), dtype=GALLERY_STORAGE_DTYPE,
+                  metadata={"model": os.path.basename(FEATURE_MODEL_PATH), "knownFaces": faces_fingerprint})
+    print(f"Saved gallery to {GALLERY_FILE}")
 
-print(f"Loaded embeddings for {len(known_faces)} persons")
+# Build the matching engine over all known embeddings
+if face_matcher is None:
+    face_matcher = FaceMatcher(known_faces)
+
+print(f"Loaded embeddings for {len(face_matcher)} persons")
 
 # Function to mark attendance
 def mark_attendance(name):
@@ -408,31 +382,18 @@ while True:
         processing_start_time = time.time()
         
         # Detect and process face in current frame
-        face_img, face_coords = detect_and_crop_face(frame)
+        face_imgs, owners = face_pipeline.detect_and_align([frame])
         
-        if face_img is not None and face_img.size > 0 and face_coords is not None:
+        if owners:
+            _, face_coords, _ = owners[0]
             x, y, w, h = face_coords
             
             # Extract face features
             try:
-                embedding = extract_resnet_features(face_img)
+                embedding = face_pipeline.embed(face_imgs)[0]
                 
                 # Compare with known faces
-                best_match = "Unknown"
-                best_similarity = 0
-                
-                for person_name, known_embeddings in known_faces.items():
-                    if not known_embeddings:
-                        continue
-                    
-                    # Calculate cosine similarity with all known embeddings for this person
-                    similarities = [1 - cosine(embedding, known_emb) for known_emb in known_embeddings]
-                    avg_similarity = np.mean(similarities)
-                    
-                    # Update best match if this person is more similar
-                    if avg_similarity > best_similarity and avg_similarity > SIMILARITY_THRESHOLD:
-                        best_similarity = avg_similarity
-                        best_match = person_name
+                best_match, best_similarity, _ = face_pipeline.match_one(embedding, face_matcher)
                 
                 # Update face tracker with new detection
                 face_id = face_tracker.update_face(face_coords, best_match, best_similarity)
@@ -0,0 +1,61 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ann_index import IVFIndex
+from face_matching import l2_normalize
+
+
+# Synthetic clustered vectors: `per_cluster` noisy vectors around each of `clusters` random centres
+def clustered_vectors(clusters=20, per_cluster=25, dim=16, noise=0.2, seed=0):
+    rng = np.random.default_rng(seed)
+    centres = l2_normalize(rng.normal(size=(clusters, dim)).astype(np.float32))
+    vectors = np.repeat(centres, per_cluster, axis=0) + noise * rng.normal(size=(clusters * per_cluster, dim))
+    return l2_normalize(vectors.astype(np.float32))
+
+
+def trained_index(vectors, nlist=8, nprobe=2):
+    index = IVFIndex(nlist=nlist, nprobe=nprobe).train(vectors)
+    return index.add(vectors, np.arange(len(vectors)))
+
+
+def test_added_label_is_found_and_removed_label_is_not():
+    vectors = clustered_vectors()
+    index = trained_index(vectors)
+    new_vector = vectors[:1] + 0.01
+    index.add(new_vector, [10000])
+
+    labels, _ = index.search(new_vector, 5)
+    assert 10000 in labels[0]
+
+    index.remove([10000])
+    labels, _ = index.search(new_vector, 5, nprobe=index.nlist)
+    assert 10000 not in labels[0]
+    assert index.ntotal == len(vectors)
+
+
+def test_removal_does_not_touch_copies():
+    vectors = clustered_vectors()
+    index = trained_index(vectors)
+    clone = index.copy()
+    index.remove(range(10))
+
+    assert clone.ntotal == len(vectors)
+    assert index.ntotal == len(vectors) - 10
+
+
+def test_full_nprobe_recall_matches_exact_top1():
+    vectors = clustered_vectors()
+    index = trained_index(vectors)
+    queries = l2_normalize(vectors[::5] + 0.05 * np.random.default_rng(1).normal(size=vectors[::5].shape).astype(np.float32))
+    exact_top1 = np.argmax(queries @ vectors.T, axis=1)
+
+    labels, _ = index.search(queries, 1, nprobe=index.nlist)
+    assert np.mean(labels[:, 0] == exact_top1) == 1.0
+
+    # Probing fewer lists may only lose recall, never return labels that are not stored
+    labels, _ = index.search(queries, 1)
+    assert np.mean(labels[:, 0] == exact_top1) >= 0.8
+    assert set(labels[:, 0]) <= set(range(len(vectors)))
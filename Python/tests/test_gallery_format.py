@@ -0,0 +1,55 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gallery_format import HEADER, decode_gallery, encode_gallery, gallery_from_dict, gallery_to_dict
+
+
+def sample_gallery():
+    rng = np.random.default_rng(0)
+    return {"alice": rng.normal(size=(3, 32)), "bob": rng.normal(size=(2, 32))}
+
+
+@pytest.mark.parametrize("dtype, tolerance", [('float32', 1e-6), ('float16', 1e-3), ('int8', 1e-2)])
+def test_round_trip_within_dtype_tolerance(dtype, tolerance):
+    gallery = sample_gallery()
+    data = encode_gallery(*gallery_from_dict(gallery), dtype=dtype, metadata={"version": "v1"})
+    names, counts, vectors, info = decode_gallery(data)
+
+    assert names == ["alice", "bob"]
+    assert list(counts) == [3, 2]
+    assert info["dtype"] == dtype
+    assert info["metadata"] == {"version": "v1"}
+    decoded = gallery_to_dict(names, counts, vectors)
+    for name, embeddings in gallery.items():
+        expected = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        assert np.max(np.abs(decoded[name] - expected)) < tolerance
+
+
+def test_empty_gallery_round_trip():
+    names, counts, vectors, _ = decode_gallery(encode_gallery(*gallery_from_dict({})))
+
+    assert names == []
+    assert len(counts) == 0
+    assert len(vectors) == 0
+
+
+def test_bad_magic_and_version_are_rejected():
+    data = bytearray(encode_gallery(*gallery_from_dict(sample_gallery())))
+    with pytest.raises(ValueError, match="Not a FaceNRoll gallery"):
+        decode_gallery(b'XXXX' + bytes(data[4:]))
+
+    data[4:6] = (99).to_bytes(2, 'little')
+    with pytest.raises(ValueError, match="newer than supported"):
+        decode_gallery(bytes(data))
+
+
+@pytest.mark.parametrize("dtype", ['float32', 'int8'])
+def test_truncated_data_is_a_format_error(dtype):
+    data = encode_gallery(*gallery_from_dict(sample_gallery()), dtype=dtype)
+    for length in (HEADER.size - 1, HEADER.size + 10, len(data) - 1):
+        with pytest.raises(ValueError, match="too short|truncated"):
+            decode_gallery(data[:length])
@@ -0,0 +1,40 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from face_matching import FaceMatcher
+from gallery_store import GalleryStore
+
+
+def embeddings(seed, count=3, dim=8):
+    return np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+
+
+# A re-enrollment that found no usable face must not delete the person
+def test_store_keeps_person_reenrolled_without_faces(tmp_path):
+    store = GalleryStore(str(tmp_path / "gallery_store"))
+    store.update({"alice": embeddings(1), "bob": embeddings(2)}, "v1")
+    store.update({"alice": []}, "v2")
+
+    matcher, _ = store.load_matcher()
+    assert matcher.names == ["alice", "bob"]
+    assert len(matcher.person_embeddings(matcher.name_to_index["alice"])) == 3
+
+
+def test_store_removes_only_explicitly_deleted_person(tmp_path):
+    store = GalleryStore(str(tmp_path / "gallery_store"))
+    store.update({"alice": embeddings(1), "bob": embeddings(2)}, "v1")
+    store.update({}, "v2", removed=["alice"])
+
+    matcher, _ = store.load_matcher()
+    assert matcher.names == ["bob"]
+
+
+def test_matcher_keeps_person_reenrolled_without_faces():
+    matcher = FaceMatcher({"alice": embeddings(1), "bob": embeddings(2)})
+    updated = matcher.updated({"alice": []})
+
+    assert updated.names == ["alice", "bob"]
+    assert updated.updated({}, removed=["alice"]).names == ["bob"]
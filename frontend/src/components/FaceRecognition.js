@@ -22,6 +22,7 @@ const FaceRecognition = () => {
   const [similarity, setSimilarity] = useState(0);
   const [recognitionError, setRecognitionError] = useState(null);
   const recognitionIntervalRef = useRef(null);
+  const galleryVersionRef = useRef(null);
   const [isMirrored, setIsMirrored] = useState(false);
   const navigate = useNavigate();
   const [userAttendanceStatus, setUserAttendanceStatus] = useState(null);
@@ -151,6 +152,7 @@ const markAttendance = async (personName) => {
       if (data.embeddings && data.embeddings.embeddings) {
         console.log("Embeddings fetched successfully");
         setEmbeddings(data.embeddings.embeddings);
+        await loadGallery(data.embeddings.embeddings, data.embeddings.timestamp);
         return data.embeddings.embeddings;
       } else {
         console.warn("No embeddings found in the database");
@@ -163,6 +165,43 @@ const markAttendance = async (personName) => {
     }
   };
 
+  // Load embeddings into the recognition service once, so recognition requests only carry the image
+  const loadGallery = async (embeddingsData, version) => {
+    try {
+      const galleryVersion = String(version);
+      const statusResponse = await fetch('http://localhost:5001/api/gallery');
+      if (statusResponse.ok) {
+        const status = await statusResponse.json();
+        if (status.version === galleryVersion) {
+          galleryVersionRef.current = galleryVersion;
+          return;
+        }
+      }
+      
+      const response = await fetch('http://localhost:5001/api/gallery', {
+        method: 'PUT',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+          embeddings: embeddingsData,
+          version: galleryVersion
+        }),
+      });
+      
+      if (!response.ok) {
+        throw new Error(`Failed to load gallery: ${response.status}`);
+      }
+      
+      const result = await response.json();
+      galleryVersionRef.current = result.version;
+    } catch (error) {
+      // Fall back to sending the embeddings with every recognition request
+      console.warn("Could not load gallery into recognition service:", error);
+      galleryVersionRef.current = null;
+    }
+  };
+
   // Capture image from video stream
   const captureImage = () => {
     if (!videoRef.current || !canvasRef.current) return null;
@@ -217,12 +256,22 @@ const markAttendance = async (personName) => {
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({
+        body: JSON.stringify(galleryVersionRef.current ? {
+          image: imageData,
+          galleryVersion: galleryVersionRef.current
+        } : {
           image: imageData,
           embeddings: embeddingsData
         }),
       });
       
+      if (response.status === 409) {
+        // The recognition service holds a different gallery (e.g. it restarted), reload it
+        await loadGallery(embeddingsData, galleryVersionRef.current);
+        setRecognitionStatus('idle');
+        return;
+      }
+      
       if (!response.ok) {
         const errorText = await response.text();
         throw new Error(`Recognition failed: ${errorText}`);
@@ -115,26 +115,69 @@ const ProcessingMainPage = () => {
         
         addLog(`Total images to process: ${allImages.length}`);
         
-        // Step 3: Process all images with the Python backend
+        // Step 3: Submit an enrollment job to the Python backend
         addLog(`Sending all images to processing server...`);
-        const processingResponse = await axios.post('http://localhost:5001/api/process-images', {
+        const jobResponse = await axios.post('http://localhost:5001/api/enrollment-jobs', {
           images: allImages
         });
+        const jobId = jobResponse.data.jobId;
+        addLog(`Enrollment job ${jobId} started.`);
         
-        // Step 4: Display the logs from the Python processing
-        const processingLogs = processingResponse.data.logs;
-        for (const log of processingLogs) {
-          // Add a small delay between logs to simulate real-time processing
-          await new Promise(resolve => setTimeout(resolve, 100));
-          addLog(log);
+        // Step 4: Follow the job's progress events (NDJSON) as they arrive
+        const eventsResponse = await fetch(`http://localhost:5001/api/enrollment-jobs/${jobId}/events`);
+        if (!eventsResponse.ok) {
+          let message = `HTTP ${eventsResponse.status}`;
+          try {
+            message = (await eventsResponse.json()).error || message;
+          } catch (parseError) {
+            // Keep the status code as the message
+          }
+          throw new Error(`Could not follow enrollment job ${jobId}: ${message}`);
+        }
+        const reader = eventsResponse.body.getReader();
+        const decoder = new TextDecoder();
+        let buffered = '';
+        let terminalEvent = null;
+        while (true) {
+          const { value, done } = await reader.read();
+          if (done) break;
+          buffered += decoder.decode(value, { stream: true });
+          const lines = buffered.split('\n');
+          buffered = lines.pop();
+          for (const line of lines) {
+            if (!line.trim()) continue;
+            const event = JSON.parse(line);
+            if (event.type === 'log') {
+              addLog(event.message);
+            } else if (event.type === 'progress') {
+              addLog(`⏳ Progress: ${event.processedImages}/${event.totalImages} images, ${event.processedPersons}/${event.totalPersons} users`);
+            } else if (event.type === 'completed' || event.type === 'failed') {
+              terminalEvent = event;
+            }
+          }
+        }
+        if (terminalEvent === null) {
+          // The stream ended without a terminal event: the job was interrupted or the connection dropped
+          const statusResponse = await axios.get(`http://localhost:5001/api/enrollment-jobs/${jobId}`);
+          const job = statusResponse.data;
+          if (job.status === 'interrupted') {
+            throw new Error(`Enrollment job ${jobId} was INTERRUPTED: ${job.error || 'the service stopped before it finished'}`);
+          } else if (job.status === 'failed') {
+            throw new Error(`Enrollment job ${jobId} failed: ${job.error || 'unknown error'}`);
+          } else if (job.status !== 'completed') {
+            throw new Error(`Lost the event stream of enrollment job ${jobId} while it was ${job.status}`);
+          }
+        } else if (terminalEvent.type === 'failed') {
+          throw new Error(`Enrollment job ${jobId} failed: ${terminalEvent.error}`);
         }
         
-        // Step 5: Save the embeddings to the database
+        // Step 5: Fetch the finished results and save the embeddings to the database
+        const resultsResponse = await axios.get(`http://localhost:5001/api/enrollment-jobs/${jobId}/results`);
         addLog(`Saving embeddings to database...`);
         await axios.post('http://localhost:5000/embeddings', {
-          embeddings: processingResponse.data.embeddings,
-          timestamp: processingResponse.data.timestamp,
-          logs: processingLogs
+          embeddings: resultsResponse.data.embeddings,
+          timestamp: resultsResponse.data.timestamp,
+          logs: resultsResponse.data.logs
         });
         
         addLog(`🎉 Processing completed successfully!`);
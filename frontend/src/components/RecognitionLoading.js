@@ -3,6 +3,10 @@ import { useNavigate } from 'react-router-dom';
 import './ProcessingPage.css'; // We'll reuse the terminal styling
 import axios from 'axios';
 
+// How long to wait for the recognition service warm-up, and how many failed status polls in a row to tolerate
+const WARM_UP_TIMEOUT_MS = 120000;
+const WARM_UP_MAX_POLL_FAILURES = 3;
+
 const RecognitionLoading = () => {
   const navigate = useNavigate();
   const [logs, setLogs] = useState(['Initializing Face Recognition System...']);
@@ -206,6 +210,34 @@ const RecognitionLoading = () => {
       
       if (response.status === 200) {
         addLog('Recognition service is online');
+        
+        // Wait for the model warm-up so the first recognition is not slow
+        let status = response.data;
+        const warmUpDeadline = Date.now() + WARM_UP_TIMEOUT_MS;
+        let pollFailures = 0;
+        while (status.ready === false && status.readiness && status.readiness.state === 'warming') {
+          if (Date.now() >= warmUpDeadline) {
+            addLog(`⚠️ Recognition service still warming up after ${WARM_UP_TIMEOUT_MS / 1000}s; the first recognitions may be slow`);
+            break;
+          }
+          addLog('Recognition service is warming up...');
+          await new Promise(resolve => setTimeout(resolve, 1000));
+          try {
+            status = (await axios.get('http://localhost:5001/api/status')).data;
+            pollFailures = 0;
+          } catch (pollError) {
+            pollFailures += 1;
+            addLog(`⚠️ Could not check warm-up status: ${pollError.message}`);
+            if (pollFailures >= WARM_UP_MAX_POLL_FAILURES) {
+              throw new Error(`Recognition service stopped responding during warm-up (${pollError.message})`);
+            }
+          }
+        }
+        if (status.readiness && status.readiness.state === 'failed') {
+          addLog(`⚠️ Recognition service warm-up failed: ${status.readiness.error}`);
+        } else if (status.readiness && status.readiness.warmUpSeconds) {
+          addLog(`Recognition service ready (warm-up took ${status.readiness.warmUpSeconds.toFixed(1)}s)`);
+        }
         return true;
       } else {
         throw new Error(`Unexpected status: ${response.status}`);